@@ -0,0 +1,181 @@
+"""
+Write-behind recorder for user activity timestamps (last_login, last_seen)
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Dict, Optional
+
+from pymongo import UpdateOne
+
+from core.metrics import span
+from .user_cache import invalidate_user
+
+logger = logging.getLogger(__name__)
+
+ACTIVITY_FLUSH_INTERVAL_SECONDS = float(os.environ.get("ACTIVITY_FLUSH_INTERVAL_SECONDS", "5"))
+ACTIVITY_MAX_BATCH = int(os.environ.get("ACTIVITY_MAX_BATCH", "1000"))
+ACTIVITY_MAX_PENDING = int(os.environ.get("ACTIVITY_MAX_PENDING", "100000"))
+
+
+class ActivityRecorder:
+    """Queues activity timestamps per user and flushes them as bulk_write batches.
+
+    Updates are deduplicated per user, keeping only the latest timestamp per
+    field, so a burst of logins or requests costs a single write per user.
+    At most max_pending users are queued: past that last_seen updates of
+    new users are dropped and logins are written directly.
+    """
+
+    def __init__(
+        self,
+        flush_interval: float = ACTIVITY_FLUSH_INTERVAL_SECONDS,
+        max_batch: int = ACTIVITY_MAX_BATCH,
+        max_pending: int = ACTIVITY_MAX_PENDING,
+    ):
+        self.flush_interval = flush_interval
+        self.max_batch = max(1, max_batch)
+        self.max_pending = max_pending
+        self.db = None
+        # user id -> {field: latest timestamp}
+        self._pending: Dict[str, Dict[str, datetime]] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+        # Metrics
+        self.recorded = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.flushed_users = 0
+        self.failed_flushes = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def start(self, db) -> None:
+        self.db = db
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(), name="activity-recorder")
+
+    async def stop(self) -> None:
+        """Stop the flush loop and write everything still queued.
+
+        The loop is asked to stop rather than cancelled, so a batch being
+        written is never abandoned halfway.
+        """
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        try:
+            await self._task
+        finally:
+            self._task = None
+            self._stopping = False
+        while self._pending:
+            if not await self.flush():
+                break
+
+    def _merge(self, user_id: str, fields: Dict[str, datetime]) -> None:
+        pending = self._pending.setdefault(user_id, {})
+        for field, when in fields.items():
+            if field not in pending or pending[field] < when:
+                pending[field] = when
+
+    def _record(self, user_id: str, fields: Dict[str, datetime]) -> bool:
+        """Queue fields for user_id; False when the queue is full"""
+        if user_id not in self._pending and len(self._pending) >= self.max_pending:
+            self._wakeup.set()
+            return False
+        self._merge(user_id, fields)
+        self.recorded += 1
+        if len(self._pending) >= self.max_pending:
+            self._wakeup.set()
+        return True
+
+    async def record_login(self, db, user_id: str, when: Optional[datetime] = None) -> None:
+        """Queue a login; written directly when the recorder is not running"""
+        when = when or datetime.utcnow()
+        fields = {"last_login": when, "last_seen": when}
+        if self.running and self._record(user_id, fields):
+            return
+
+        with span("mongo.users.update_one"):
+            await db.users.update_one({"id": user_id}, {"$set": fields, "$inc": {"version": 1}})
+        invalidate_user(user_id=user_id)
+
+    def record_seen(self, user_id: str, when: Optional[datetime] = None) -> None:
+        """Queue a last_seen update; dropped when the recorder is not running"""
+        if self.running and not self._record(user_id, {"last_seen": when or datetime.utcnow()}):
+            self.dropped += 1
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            while self._pending:
+                if not await self.flush():
+                    break
+
+    async def flush(self) -> bool:
+        """Write one batch of queued updates; False if the write failed"""
+        if not self._pending:
+            return True
+
+        user_ids = list(self._pending)[:self.max_batch]
+        batch = {user_id: self._pending.pop(user_id) for user_id in user_ids}
+        # last_seen is not part of User, so only logins change the document's version
+        operations = [
+            UpdateOne({"id": user_id}, {"$set": fields, "$inc": {"version": 1}} if "last_login" in fields else {"$set": fields})
+            for user_id, fields in batch.items()
+        ]
+
+        try:
+            with span("mongo.users.bulk_write"):
+                await self.db.users.bulk_write(operations, ordered=False)
+        except asyncio.CancelledError:
+            # Re-applying the timestamps is harmless, losing them is not
+            for user_id, fields in batch.items():
+                self._merge(user_id, fields)
+            raise
+        except Exception:
+            self.failed_flushes += 1
+            logger.exception("Activity flush of %d users failed", len(batch))
+            # Put the batch back; merging keeps the latest timestamps
+            for user_id, fields in batch.items():
+                self._merge(user_id, fields)
+            return False
+
+        self.flushes += 1
+        self.flushed_users += len(batch)
+        # last_login is part of the cached User model; last_seen is not
+        for user_id, fields in batch.items():
+            if "last_login" in fields:
+                invalidate_user(user_id=user_id)
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "running": self.running,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "recorded": self.recorded,
+            "dropped": self.dropped,
+            "flushes": self.flushes,
+            "flushed_users": self.flushed_users,
+            "failed_flushes": self.failed_flushes,
+        }
+
+
+activity_recorder = ActivityRecorder()
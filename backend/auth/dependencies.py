@@ -1,31 +1,108 @@
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from motor.motor_asyncio import AsyncIOMotorDatabase
 from typing import Optional
 from .jwt_handler import verify_token, TokenData  
 from .models import User
+from .principal import PRINCIPAL_PROJECTION, Principal
+from .user_cache import user_cache
+from .activity import activity_recorder
+from core.metrics import span
 import os
 
 security = HTTPBearer()
 
-def get_database():
-    """Get database instance - will be injected by main app"""
-    # This will be set by the main app
-    pass
+def get_database(request: Request):
+    """Database of the running app, opened by its lifespan (see server.create_app)"""
+    return request.app.state.db
 
-# We'll set this from the main server.py file
+# Set by server.bind_database when the app starts
 db = None
 
+async def load_user(username: str) -> Optional[User]:
+    """Load a user by username, serving from the in-process user cache when possible"""
+    user = user_cache.get(username)
+    if user is not None:
+        return user
+    
+    generation = user_cache.generation
+    with span("mongo.users.find_one"):
+        user_doc = await db.users.find_one({"username": username})
+    if user_doc is None:
+        return None
+    
+    user = User(**user_doc)
+    user_cache.set(user, generation)
+    return user
+
+async def load_principal(username: str) -> Optional[Principal]:
+    """Load a user's Principal by username, reading only the fields it needs"""
+    principal = user_cache.get_principal(username)
+    if principal is not None:
+        return principal
+    
+    generation = user_cache.generation
+    with span("mongo.users.find_one"):
+        user_doc = await db.users.find_one({"username": username}, PRINCIPAL_PROJECTION)
+    if user_doc is None:
+        return None
+    
+    principal = Principal.from_document(user_doc)
+    user_cache.set_principal(principal, generation)
+    return principal
+
+async def load_principal_user(principal: Principal) -> User:
+    """Upgrade a Principal to the full User, for handlers that need profile or provider fields"""
+    user = await load_user(principal.username)
+    if user is None or user.id != principal.id:
+        # Deleted (or the username reused) since the principal was loaded
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Usuário não encontrado",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return user
+
+async def get_current_principal(
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+) -> Principal:
+    """Get the Principal of the JWT token's user, without loading the full User"""
+    
+    with span("verify_token"):
+        token_data = verify_token(credentials.credentials)
+    
+    principal = await load_principal(token_data.username)
+    if principal is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Usuário não encontrado",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    
+    activity_recorder.record_seen(principal.id)
+    return principal
+
+async def get_active_principal(
+    principal: Principal = Depends(get_current_principal)
+) -> Principal:
+    """Get the Principal of the current active user"""
+    if not principal.is_active:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, 
+            detail="Usuário inativo"
+        )
+    return principal
+
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security)
 ) -> User:
     """Get current authenticated user from JWT token"""
     
     # Verify token
-    token_data = verify_token(credentials.credentials)
+    with span("verify_token"):
+        token_data = verify_token(credentials.credentials)
     
-    # Get user from database
-    user = await db.users.find_one({"username": token_data.username})
+    # Get user from cache or database
+    user = await load_user(token_data.username)
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -33,7 +110,8 @@ async def get_current_user(
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    return User(**user)
+    activity_recorder.record_seen(user.id)
+    return user
 
 async def get_current_active_user(
     current_user: User = Depends(get_current_user)
@@ -55,10 +133,9 @@ async def get_current_user_optional(
         return None
     
     try:
-        token_data = verify_token(credentials.credentials)
-        user = await db.users.find_one({"username": token_data.username})
-        if user:
-            return User(**user)
+        with span("verify_token"):
+            token_data = verify_token(credentials.credentials)
+        return await load_user(token_data.username)
     except:
         pass  # Invalid token, return None
     
@@ -0,0 +1,127 @@
+"""
+Bounded worker pool for bcrypt hashing and verification, so the event loop never runs bcrypt
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from fastapi import HTTPException, status
+
+from core.metrics import span
+from .jwt_handler import get_password_hash, verify_password
+
+PASSWORD_HASH_EXECUTOR = os.environ.get("PASSWORD_HASH_EXECUTOR", "thread")  # thread | process
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_QUEUE = int(os.environ.get("PASSWORD_HASH_MAX_QUEUE", "64"))
+PASSWORD_HASH_RETRY_AFTER = int(os.environ.get("PASSWORD_HASH_RETRY_AFTER", "1"))
+
+
+class PasswordHashingPool:
+    """Runs bcrypt on a dedicated executor with a bounded queue in front of it.
+
+    bcrypt releases the GIL, so a thread pool is enough to keep the event loop free;
+    a process pool can be selected to spread the work over more cores.
+    """
+
+    def __init__(
+        self,
+        workers: int = PASSWORD_HASH_WORKERS,
+        max_queue: int = PASSWORD_HASH_MAX_QUEUE,
+        executor_kind: str = PASSWORD_HASH_EXECUTOR,
+        retry_after: int = PASSWORD_HASH_RETRY_AFTER,
+    ):
+        if executor_kind not in ("thread", "process"):
+            raise ValueError(f"Unknown password hash executor: {executor_kind}")
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self.executor_kind = executor_kind
+        self.retry_after = retry_after
+        self._executor: Optional[Executor] = None
+
+        # Metrics
+        self.pending = 0
+        self.rejected = 0
+        self.completed = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        """Jobs waiting for a free worker"""
+        return max(0, self.pending - self.workers)
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.executor_kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="bcrypt"
+                )
+        return self._executor
+
+    def _release(self, started: float) -> None:
+        elapsed = time.perf_counter() - started
+        self.pending -= 1
+        self.completed += 1
+        self.latency_total += elapsed
+        if elapsed > self.latency_max:
+            self.latency_max = elapsed
+
+    async def _run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        if self.pending >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Servidor ocupado, tente novamente em instantes",
+                headers={"Retry-After": str(self.retry_after)},
+            )
+
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        future = self._get_executor().submit(fn, *args)
+        self.pending += 1
+
+        # Release the slot when the worker finishes, not when the awaiting request
+        # goes away, so cancelled requests still count against the queue bound
+        def _done(_):
+            try:
+                loop.call_soon_threadsafe(self._release, started)
+            except RuntimeError:
+                pass  # Event loop already closed
+
+        future.add_done_callback(_done)
+        return await asyncio.wrap_future(future, loop=loop)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        """Verify a password against its hash on the pool"""
+        with span("bcrypt.verify"):
+            return await self._run(verify_password, plain_password, hashed_password)
+
+    async def hash(self, password: str) -> str:
+        """Generate a password hash on the pool"""
+        with span("bcrypt.hash"):
+            return await self._run(get_password_hash, password)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "executor": self.executor_kind,
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "in_flight": min(self.pending, self.workers),
+            "queue_depth": self.queue_depth,
+            "rejected": self.rejected,
+            "completed": self.completed,
+            "latency_seconds_total": self.latency_total,
+            "latency_seconds_max": self.latency_max,
+        }
+
+
+hashing_pool = PasswordHashingPool()
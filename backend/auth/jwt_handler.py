@@ -1,10 +1,15 @@
 from jose import jwt, JWTError
-from passlib.context import CryptContext
 from datetime import datetime, timedelta
 from fastapi import HTTPException, status
 from pydantic import BaseModel
+import hashlib
 import os
-from typing import Optional
+import time
+import uuid
+from typing import Optional, Tuple
+
+from core.cache import TTLCache
+from .revocation import revocation_list
 
 # Security configuration
 SECRET_KEY = os.environ.get("JWT_SECRET_KEY", "your-super-secret-jwt-key-change-in-production")
@@ -12,11 +17,31 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 24 hours
 REFRESH_TOKEN_EXPIRE_DAYS = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# "jose" (python-jose) or "pyjwt" (PyJWT); both produce and accept the same HS256 tokens
+JWT_BACKEND = os.environ.get("JWT_BACKEND", "jose")
+
+# Verified access tokens are cached by digest, never beyond their own expiry
+TOKEN_CACHE_MAX_SIZE = int(os.environ.get("TOKEN_CACHE_MAX_SIZE", "10000"))
+TOKEN_CACHE_TTL_SECONDS = float(os.environ.get("TOKEN_CACHE_TTL_SECONDS", "300"))
+
+_token_cache = TTLCache(max_size=TOKEN_CACHE_MAX_SIZE, ttl=TOKEN_CACHE_TTL_SECONDS)
+
+_pwd_context = None
+
+def get_pwd_context():
+    """bcrypt context, built on first use so importing passlib stays off worker boot"""
+    global _pwd_context
+    if _pwd_context is None:
+        from passlib.context import CryptContext
+        _pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    return _pwd_context
 
 class TokenData(BaseModel):
     username: Optional[str] = None
     user_id: Optional[str] = None
+    jti: Optional[str] = None
+    # Login session the token belongs to; rotated refresh tokens keep it
+    family: Optional[str] = None
 
 class Token(BaseModel):
     access_token: str
@@ -25,11 +50,41 @@ class Token(BaseModel):
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against its hash"""
-    return pwd_context.verify(plain_password, hashed_password)
+    return get_pwd_context().verify(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
     """Generate password hash"""
-    return pwd_context.hash(password)
+    return get_pwd_context().hash(password)
+
+def encode_token(claims: dict) -> str:
+    """Sign claims with the configured JWT backend"""
+    if JWT_BACKEND == "pyjwt":
+        import jwt as pyjwt
+        return pyjwt.encode(claims, SECRET_KEY, algorithm=ALGORITHM)
+    return jwt.encode(claims, SECRET_KEY, algorithm=ALGORITHM)
+
+def decode_token(token: str) -> dict:
+    """Verify signature and expiry with the configured JWT backend.
+
+    Raises JWTError for any invalid token, whichever backend is in use.
+    """
+    if JWT_BACKEND == "pyjwt":
+        import jwt as pyjwt
+        try:
+            return pyjwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except pyjwt.PyJWTError as e:
+            raise JWTError(str(e))
+    return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+
+def unverified_claims(token: str) -> dict:
+    """Claims of a token this process just signed, without verifying it again"""
+    if JWT_BACKEND == "pyjwt":
+        import jwt as pyjwt
+        return pyjwt.decode(token, options={"verify_signature": False})
+    return jwt.get_unverified_claims(token)
+
+def _token_digest(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Create JWT access token"""
@@ -39,22 +94,52 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     
-    to_encode.update({"exp": expire, "type": "access"})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    to_encode.update({"exp": expire, "type": "access", "jti": uuid.uuid4().hex})
+    encoded_jwt = encode_token(to_encode)
     return encoded_jwt
 
 def create_refresh_token(data: dict):
     """Create JWT refresh token"""
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
-    to_encode.update({"exp": expire, "type": "refresh"})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    to_encode.update({"exp": expire, "type": "refresh", "jti": uuid.uuid4().hex})
+    encoded_jwt = encode_token(to_encode)
     return encoded_jwt
 
+def _revoked_token_error() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Token revogado",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+def create_token_pair(username: str, user_id: str, family: Optional[str] = None) -> Tuple[str, str]:
+    """Access and refresh token for one login session (a new one unless family is given)"""
+    data = {"sub": username, "user_id": user_id, "fam": family or uuid.uuid4().hex}
+    return create_access_token(data), create_refresh_token(data)
+
+def is_token_revoked(token_data: TokenData) -> bool:
+    return revocation_list.is_revoked(token_data.jti) or revocation_list.is_revoked(token_data.family)
+
+def cached_token_subject(token: str) -> Optional[str]:
+    """User id of an already verified, unrevoked token; never decodes, so it is safe before auth"""
+    cached = _token_cache.peek(_token_digest(token))
+    if cached is None or is_token_revoked(cached):
+        return None
+    return cached.user_id or cached.username
+
 def verify_token(token: str) -> TokenData:
-    """Verify and decode JWT token"""
+    """Verify and decode JWT token, reusing the result for recently seen tokens"""
+    digest = _token_digest(token)
+    cached = _token_cache.get(digest)
+    if cached is not None:
+        # Cached tokens may have been revoked since; the check is in memory
+        if is_token_revoked(cached):
+            raise _revoked_token_error()
+        return cached
+    
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token)
         username: str = payload.get("sub")
         user_id: str = payload.get("user_id")
         token_type: str = payload.get("type", "access")
@@ -66,7 +151,15 @@ def verify_token(token: str) -> TokenData:
                 headers={"WWW-Authenticate": "Bearer"},
             )
         
-        return TokenData(username=username, user_id=user_id)
+        token_data = TokenData(username=username, user_id=user_id, jti=payload.get("jti"), family=payload.get("fam"))
+        if is_token_revoked(token_data):
+            raise _revoked_token_error()
+        
+        exp = payload.get("exp")
+        if exp is not None:
+            _token_cache.set(digest, token_data, ttl=min(TOKEN_CACHE_TTL_SECONDS, exp - time.time()))
+        
+        return token_data
     except JWTError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -74,28 +167,18 @@ def verify_token(token: str) -> TokenData:
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-def refresh_access_token(refresh_token: str) -> str:
-    """Generate new access token from refresh token"""
+async def revoke_token(token: str, user_id: Optional[str] = None, reason: str = "logout") -> bool:
+    """Revoke a token until it expires; False if it is invalid, has no jti or belongs to another user"""
     try:
-        payload = jwt.decode(refresh_token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        user_id: str = payload.get("user_id")
-        token_type: str = payload.get("type")
-        
-        if username is None or token_type != "refresh":
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Refresh token inválido",
-            )
-        
-        # Create new access token
-        access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-        return create_access_token(
-            data={"sub": username, "user_id": user_id}, 
-            expires_delta=access_token_expires
-        )
+        payload = decode_token(token)
     except JWTError:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Refresh token inválido",
-        )
\ No newline at end of file
+        return False
+    
+    jti = payload.get("jti")
+    exp = payload.get("exp")
+    if jti is None or exp is None or (user_id is not None and payload.get("user_id") != user_id):
+        return False
+    
+    await revocation_list.revoke(jti, datetime.utcfromtimestamp(exp), user_id=payload.get("user_id"), reason=reason)
+    _token_cache.pop(_token_digest(token))
+    return True
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, Field, EmailStr
-from typing import Optional, List
+from pydantic import BaseModel, ConfigDict, Field, EmailStr
+from typing import Dict, Optional, List
 from datetime import datetime
 import uuid
 
@@ -28,16 +28,51 @@ class User(UserBase):
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
     last_login: Optional[datetime] = None
+    # Bumped by every update of the document; the ETag of /auth/me and /auth/oauth/status
+    version: int = 0
     
     # OAuth provider tokens (encrypted)
     oauth_providers: Optional[dict] = Field(default_factory=dict)  # {"gdrive": {...}, "proton": {...}}
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class UserInDB(User):
     hashed_password: str
 
+class ProviderConnection(BaseModel):
+    """What a client may see of a connected provider: never tokens or credentials"""
+    connected: bool
+    expires_at: Optional[datetime] = None
+    scope: Optional[List[str]] = None
+    connected_at: Optional[datetime] = None
+
+class UserPublic(UserBase):
+    """User as returned to its owner by /auth/me"""
+    id: str
+    created_at: datetime
+    updated_at: datetime
+    last_login: Optional[datetime] = None
+    version: int = 0
+    oauth_providers: Dict[str, ProviderConnection] = Field(default_factory=dict)
+
+    @classmethod
+    def from_user(cls, user: User) -> "UserPublic":
+        providers = {
+            name: ProviderConnection(
+                connected=bool(data.get("access_token") or data.get("auth_header")),
+                expires_at=data.get("expires_at"),
+                scope=data.get("scope"),
+                connected_at=data.get("connected_at"),
+            )
+            for name, data in (user.oauth_providers or {}).items()
+            if isinstance(data, dict)
+        }
+        return cls(
+            **user.model_dump(include={"username", "email", "full_name", "is_active", "id",
+                                       "created_at", "updated_at", "last_login", "version"}),
+            oauth_providers=providers,
+        )
+
 # OAuth Models
 class OAuthProvider(BaseModel):
     provider: str  # gdrive, proton, terabox
@@ -46,6 +81,16 @@ class OAuthProvider(BaseModel):
     expires_at: Optional[datetime] = None
     scope: Optional[List[str]] = None
 
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
+
+class LogoutRequest(BaseModel):
+    refresh_token: Optional[str] = None
+
+class TeraboxCredentials(BaseModel):
+    username: str
+    password: str
+
 class OAuthCallback(BaseModel):
     code: str
     state: str
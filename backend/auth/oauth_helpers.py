@@ -1,45 +1,114 @@
 """
 OAuth helper functions for multicloud providers
 """
-import httpx
 import base64
+import os
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+from typing import TYPE_CHECKING, Optional, Dict, Any
 from fastapi import HTTPException
 import logging
 
+from core.http_client import get_http_client
+from core.metrics import span
+from core.singleflight import SingleFlight
+from .user_cache import invalidate_user, user_cache
+
+if TYPE_CHECKING:
+    import httpx
+
 logger = logging.getLogger(__name__)
 
+# OAuth configuration (configure in .env)
+OAUTH_CONFIG = {
+    "gdrive": {
+        "client_id": os.environ.get("GDRIVE_CLIENT_ID", "your-google-client-id"),
+        "client_secret": os.environ.get("GDRIVE_CLIENT_SECRET", "your-google-client-secret"),
+        "auth_url": os.environ.get("GDRIVE_AUTH_URL", "https://accounts.google.com/o/oauth2/auth"),
+        "token_url": os.environ.get("GDRIVE_TOKEN_URL", "https://oauth2.googleapis.com/token"),
+        "scope": "https://www.googleapis.com/auth/drive.file",
+        "redirect_uri": os.environ.get(
+            "GDRIVE_REDIRECT_URI",
+            "https://progressive-release.preview.emergentagent.com/auth/callback/gdrive"
+        )
+    },
+    "proton": {
+        "client_id": os.environ.get("PROTON_CLIENT_ID", "your-proton-client-id"),
+        "client_secret": os.environ.get("PROTON_CLIENT_SECRET", "your-proton-client-secret"),
+        "auth_url": os.environ.get("PROTON_AUTH_URL", "https://account.proton.me/oauth/authorize"),
+        "token_url": os.environ.get("PROTON_TOKEN_URL", "https://account.proton.me/oauth/token"),
+        "scope": "drive:read drive:write",
+        "redirect_uri": os.environ.get(
+            "PROTON_REDIRECT_URI",
+            "https://progressive-release.preview.emergentagent.com/auth/callback/proton"
+        )
+    }
+}
+
+TERABOX_USER_INFO_URL = os.environ.get("TERABOX_USER_INFO_URL", "https://terabox.com/api/user/info")  # Placeholder URL
+
 class OAuthTokenManager:
     """Manages OAuth tokens for multicloud providers"""
     
-    def __init__(self, db):
+    # Shared by every manager instance so concurrent requests for the same
+    # (user, provider) wait on a single refresh instead of each calling the provider
+    _refresh_flights = SingleFlight()
+    
+    def __init__(self, db, http_client: Optional["httpx.AsyncClient"] = None):
         self.db = db
+        self._http_client = http_client
+    
+    @property
+    def http_client(self) -> "httpx.AsyncClient":
+        return self._http_client or get_http_client()
+    
+    @staticmethod
+    def _is_expiring(provider_data: Dict[str, Any]) -> bool:
+        """Check if token is expiring soon (within 5 minutes)"""
+        expires_at = provider_data.get("expires_at")
+        if expires_at and isinstance(expires_at, datetime):
+            return expires_at <= datetime.utcnow() + timedelta(minutes=5)
+        return False
     
     async def refresh_token_if_needed(self, user_id: str, provider: str) -> Optional[Dict[str, Any]]:
         """Check if token needs refresh and refresh if necessary"""
         
-        user = await self.db.users.find_one({"id": user_id})
-        if not user or provider not in user.get("oauth_providers", {}):
-            return None
+        # Tokens are normally kept fresh by the background refresher, so the
+        # cached projection is enough unless it is missing or about to expire
+        providers = user_cache.get_providers(user_id)
+        if providers is None:
+            generation = user_cache.generation
+            with span("mongo.users.find_one"):
+                user = await self.db.users.find_one(
+                    {"id": user_id}, {"_id": 0, "id": 1, "username": 1, "oauth_providers": 1}
+                )
+            if not user:
+                return None
+            providers = user.get("oauth_providers") or {}
+            user_cache.set_providers(user_id, user["username"], providers, generation)
         
-        provider_data = user["oauth_providers"][provider]
+        provider_data = providers.get(provider)
+        if provider_data is None:
+            return None
         
-        # Check if token is expiring soon (within 5 minutes)
-        expires_at = provider_data.get("expires_at")
-        if expires_at and isinstance(expires_at, datetime):
-            if expires_at <= datetime.utcnow() + timedelta(minutes=5):
-                # Token is expiring, refresh it
-                return await self._refresh_provider_token(user_id, provider, provider_data)
+        if self._is_expiring(provider_data):
+            # Token is expiring, refresh it
+            return await self.refresh_token(user_id, provider, provider_data)
         
         return provider_data
     
+    async def refresh_token(self, user_id: str, provider: str, provider_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Refresh a provider token once, however many callers are waiting on it"""
+        return await self._refresh_flights.do(
+            (user_id, provider),
+            lambda: self._refresh_provider_token(user_id, provider, provider_data)
+        )
+    
     async def _refresh_provider_token(self, user_id: str, provider: str, provider_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Refresh token for specific provider"""
         
         refresh_token = provider_data.get("refresh_token")
         if not refresh_token:
-            logger.warning(f"No refresh token available for user {user_id}, provider {provider}")
+            logger.warning("No refresh token available for user %s, provider %s", user_id, provider)
             return None
         
         try:
@@ -48,33 +117,31 @@ class OAuthTokenManager:
             elif provider == "proton":
                 return await self._refresh_proton_token(user_id, refresh_token)
             else:
-                logger.warning(f"Refresh not implemented for provider {provider}")
+                logger.warning("Refresh not implemented for provider %s", provider)
                 return provider_data
         
         except Exception as e:
-            logger.error(f"Failed to refresh token for {provider}: {str(e)}")
+            logger.error("Failed to refresh token for %s: %s", provider, e)
             return None
     
     async def _refresh_google_token(self, user_id: str, refresh_token: str) -> Dict[str, Any]:
         """Refresh Google OAuth token"""
         
+        config = OAUTH_CONFIG["gdrive"]
         token_data = {
-            "client_id": "your-google-client-id",  # From config
-            "client_secret": "your-google-client-secret",
+            "client_id": config["client_id"],
+            "client_secret": config["client_secret"],
             "refresh_token": refresh_token,
             "grant_type": "refresh_token"
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "https://oauth2.googleapis.com/token",
-                data=token_data
-            )
-            
-            if response.status_code != 200:
-                raise HTTPException(status_code=400, detail="Failed to refresh Google token")
-            
-            tokens = response.json()
+        with span("http.gdrive.token_refresh"):
+            response = await self.http_client.post(config["token_url"], data=token_data)
+        
+        if response.status_code != 200:
+            raise HTTPException(status_code=400, detail="Failed to refresh Google token")
+        
+        tokens = response.json()
         
         # Calculate new expiry
         expires_at = datetime.utcnow() + timedelta(seconds=tokens.get("expires_in", 3600))
@@ -88,10 +155,12 @@ class OAuthTokenManager:
         }
         
         # Update in database
-        await self.db.users.update_one(
-            {"id": user_id},
-            {"$set": {"oauth_providers.gdrive": new_provider_data}}
-        )
+        with span("mongo.users.update_one"):
+            await self.db.users.update_one(
+                {"id": user_id},
+                {"$set": {"oauth_providers.gdrive": new_provider_data}, "$inc": {"version": 1}}
+            )
+        invalidate_user(user_id=user_id)
         
         return new_provider_data
     
@@ -100,23 +169,21 @@ class OAuthTokenManager:
         
         # Proton uses different refresh mechanism
         # This is a placeholder - adjust based on Proton's actual OAuth implementation
+        config = OAUTH_CONFIG["proton"]
         token_data = {
-            "client_id": "your-proton-client-id",
-            "client_secret": "your-proton-client-secret", 
+            "client_id": config["client_id"],
+            "client_secret": config["client_secret"],
             "refresh_token": refresh_token,
             "grant_type": "refresh_token"
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "https://account.proton.me/oauth/token",
-                data=token_data
-            )
-            
-            if response.status_code != 200:
-                raise HTTPException(status_code=400, detail="Failed to refresh Proton token")
-            
-            tokens = response.json()
+        with span("http.proton.token_refresh"):
+            response = await self.http_client.post(config["token_url"], data=token_data)
+        
+        if response.status_code != 200:
+            raise HTTPException(status_code=400, detail="Failed to refresh Proton token")
+        
+        tokens = response.json()
         
         expires_at = datetime.utcnow() + timedelta(seconds=tokens.get("expires_in", 3600))
         
@@ -127,17 +194,32 @@ class OAuthTokenManager:
             "scope": tokens.get("scope", "").split(" ") if tokens.get("scope") else []
         }
         
-        await self.db.users.update_one(
-            {"id": user_id},
-            {"$set": {"oauth_providers.proton": new_provider_data}}
-        )
+        with span("mongo.users.update_one"):
+            await self.db.users.update_one(
+                {"id": user_id},
+                {"$set": {"oauth_providers.proton": new_provider_data}, "$inc": {"version": 1}}
+            )
+        invalidate_user(user_id=user_id)
         
         return new_provider_data
 
-    async def get_valid_token(self, user_id: str, provider: str) -> Optional[str]:
+    async def force_refresh(self, user_id: str, provider: str) -> Optional[Dict[str, Any]]:
+        """Refresh regardless of expiry, e.g. after the provider rejected the token"""
+
+        with span("mongo.users.find_one"):
+            user = await self.db.users.find_one({"id": user_id}, {"oauth_providers": 1})
+        if not user or provider not in user.get("oauth_providers", {}):
+            return None
+
+        return await self.refresh_token(user_id, provider, user["oauth_providers"][provider])
+
+    async def get_valid_token(self, user_id: str, provider: str, force_refresh: bool = False) -> Optional[str]:
         """Get a valid access token for provider, refreshing if necessary"""
-        
-        provider_data = await self.refresh_token_if_needed(user_id, provider)
+
+        if force_refresh:
+            provider_data = await self.force_refresh(user_id, provider)
+        else:
+            provider_data = await self.refresh_token_if_needed(user_id, provider)
         if provider_data:
             return provider_data.get("access_token")
         
@@ -160,13 +242,13 @@ class TeraboxAuth:
         try:
             auth_header = TeraboxAuth.create_auth_header(username, password)
             
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    "https://terabox.com/api/user/info",  # Placeholder URL
+            with span("http.terabox.user_info"):
+                response = await get_http_client().get(
+                    TERABOX_USER_INFO_URL,
                     headers={"Authorization": auth_header}
                 )
-                
-                return response.status_code == 200
+            
+            return response.status_code == 200
         except Exception as e:
-            logger.error(f"Terabox validation failed: {str(e)}")
+            logger.error("Terabox validation failed: %s", e)
             return False
\ No newline at end of file
@@ -0,0 +1,60 @@
+"""
+Storage for pending OAuth authorization flows, keyed by the CSRF state parameter
+"""
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from pymongo import ASCENDING
+
+from core.cache import TTLCache
+from core.indexes import register_index, register_query_shape
+
+# "memory" for a single worker, "mongo" when several workers share callbacks
+OAUTH_STATE_STORE = os.environ.get("OAUTH_STATE_STORE", "memory")
+OAUTH_STATE_TTL_SECONDS = int(os.environ.get("OAUTH_STATE_TTL_SECONDS", "600"))
+OAUTH_STATE_MAX_PENDING = int(os.environ.get("OAUTH_STATE_MAX_PENDING", "10000"))
+
+# Database will be injected from main app (only used by the Mongo store)
+db = None
+
+
+class InMemoryOAuthStateStore:
+    """Pending flows in a bounded TTL cache; abandoned flows expire or get evicted"""
+
+    def __init__(self, max_size: int = OAUTH_STATE_MAX_PENDING, ttl: float = OAUTH_STATE_TTL_SECONDS):
+        self._states = TTLCache(max_size=max_size, ttl=ttl)
+
+    async def save(self, state: str, flow: Dict[str, Any]) -> None:
+        self._states.set(state, flow)
+
+    async def pop(self, state: str) -> Optional[Dict[str, Any]]:
+        """Consume a pending flow; a state can only be used once"""
+        return self._states.pop(state)
+
+
+class MongoOAuthStateStore:
+    """Pending flows in the oauth_states collection, cleaned up by a TTL index"""
+
+    def __init__(self, ttl: float = OAUTH_STATE_TTL_SECONDS):
+        self.ttl = timedelta(seconds=ttl)
+
+    async def save(self, state: str, flow: Dict[str, Any]) -> None:
+        now = datetime.utcnow()
+        await db.oauth_states.insert_one({"_id": state, **flow, "created_at": now, "expires_at": now + self.ttl})
+
+    async def pop(self, state: str) -> Optional[Dict[str, Any]]:
+        """Consume a pending flow atomically, so a state can only be used once"""
+        # The TTL monitor only runs every minute, so check expiry here as well
+        return await db.oauth_states.find_one_and_delete(
+            {"_id": state, "expires_at": {"$gt": datetime.utcnow()}},
+            projection={"_id": 0, "created_at": 0, "expires_at": 0},
+        )
+
+
+if OAUTH_STATE_STORE == "mongo":
+    register_index("oauth_states", [("expires_at", ASCENDING)], expireAfterSeconds=0, name="expires_at_ttl")
+    register_query_shape("oauth state by id", "oauth_states", {"_id": "audit"})
+    oauth_state_store = MongoOAuthStateStore()
+else:
+    oauth_state_store = InMemoryOAuthStateStore()
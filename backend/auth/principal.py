@@ -0,0 +1,60 @@
+"""
+Compact, immutable identity of an authenticated request
+"""
+from typing import Any, Dict
+
+from .models import User
+
+# The only users fields a Principal is built from
+PRINCIPAL_PROJECTION = {"_id": 0, "id": 1, "username": 1, "is_active": 1, "version": 1}
+
+
+class Principal:
+    """Who is calling: the user's id, username, is_active flag and document version.
+
+    Built from a projected read of the users document, so protected routes
+    that only need to know who is calling skip the full document and the
+    User validation. Handlers that touch profile or provider fields upgrade
+    with auth.dependencies.load_principal_user. Instances are shared through
+    the user cache, hence immutable.
+    """
+
+    __slots__ = ("id", "username", "is_active", "version")
+
+    def __init__(self, id: str, username: str, is_active: bool = True, version: int = 0):
+        object.__setattr__(self, "id", id)
+        object.__setattr__(self, "username", username)
+        object.__setattr__(self, "is_active", is_active)
+        object.__setattr__(self, "version", version)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f"Principal is immutable, cannot set {name}")
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError(f"Principal is immutable, cannot delete {name}")
+
+    def __repr__(self) -> str:
+        return f"Principal(id={self.id!r}, username={self.username!r}, is_active={self.is_active!r}, version={self.version!r})"
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Principal):
+            return NotImplemented
+        return (self.id, self.username, self.is_active, self.version) == (other.id, other.username, other.is_active, other.version)
+
+    def __hash__(self) -> int:
+        return hash((self.id, self.username, self.is_active, self.version))
+
+    @classmethod
+    def from_document(cls, document: Dict[str, Any]) -> "Principal":
+        """Principal from a users document read with PRINCIPAL_PROJECTION"""
+        # Same defaults as User for documents written before these fields existed
+        return cls(
+            document["id"],
+            document["username"],
+            bool(document.get("is_active", True)),
+            document.get("version", 0),
+        )
+
+    @classmethod
+    def from_user(cls, user: User) -> "Principal":
+        return cls(user.id, user.username, bool(user.is_active), user.version)
@@ -0,0 +1,176 @@
+"""
+Revoked JWT ids, persisted in Mongo and mirrored in memory for the hot path
+"""
+import asyncio
+import calendar
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+
+from core.cache_coherence import cache_invalidator
+from core.indexes import register_index, register_query_shape
+from core.metrics import span
+
+logger = logging.getLogger(__name__)
+
+TOKEN_REVOCATION_POLL_INTERVAL = float(os.environ.get("TOKEN_REVOCATION_POLL_INTERVAL", "2"))
+# Each poll re-reads this far behind the last revocation seen, so entries
+# written with a slightly older revoked_at by another worker are not missed
+TOKEN_REVOCATION_POLL_OVERLAP = float(os.environ.get("TOKEN_REVOCATION_POLL_OVERLAP", "10"))
+
+# Database will be injected from main app
+db = None
+
+register_index("revoked_tokens", [("expires_at", ASCENDING)], expireAfterSeconds=0, name="expires_at_ttl")
+register_index("revoked_tokens", [("revoked_at", ASCENDING)], name="revoked_at")
+register_query_shape(
+    "revocations since", "revoked_tokens",
+    {"revoked_at": {"$gte": datetime(2000, 1, 1)}, "expires_at": {"$gt": datetime(2000, 1, 1)}},
+    sort=[("revoked_at", ASCENDING)],
+)
+
+
+class RevocationList:
+    """In-memory set of revoked jtis, kept in sync with the revoked_tokens collection.
+
+    is_revoked is a dict lookup, so checking every request costs no database
+    round-trip. Revocations made by this worker apply immediately; those made
+    by other workers arrive with the next poll. Entries are dropped once the
+    token would have expired anyway, which bounds the set to the tokens
+    revoked within the refresh token lifetime.
+    """
+
+    def __init__(self, poll_interval: float = TOKEN_REVOCATION_POLL_INTERVAL, overlap: float = TOKEN_REVOCATION_POLL_OVERLAP):
+        self.poll_interval = poll_interval
+        self.overlap = timedelta(seconds=overlap)
+        # jti -> (token expiry, revocation time), epoch seconds
+        self._revoked: Dict[str, Tuple[float, float]] = {}
+        self._watermark: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+
+        # Metrics
+        self.polls = 0
+        self.failed_polls = 0
+        self.checks = 0
+        self.rejections = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def is_revoked(self, jti: Optional[str]) -> bool:
+        self.checks += 1
+        if jti is not None and jti in self._revoked:
+            self.rejections += 1
+            return True
+        return False
+
+    def revoked_for(self, jti: Optional[str]) -> Optional[float]:
+        """Seconds since jti was revoked, or None if it is not revoked"""
+        entry = self._revoked.get(jti) if jti is not None else None
+        return time.time() - entry[1] if entry is not None else None
+
+    def add(self, jti: str, expires_at: datetime, revoked_at: Optional[datetime] = None) -> None:
+        """Revoke in this worker only; the caller persists the revocation"""
+        revoked_at = calendar.timegm(revoked_at.utctimetuple()) if revoked_at else time.time()
+        self._revoked[jti] = (calendar.timegm(expires_at.utctimetuple()), revoked_at)
+
+    @staticmethod
+    def record(jti: str, expires_at: datetime, user_id: Optional[str] = None, reason: str = "logout") -> dict:
+        """revoked_tokens document for a revocation"""
+        return {
+            "_id": jti,
+            "user_id": user_id,
+            "reason": reason,
+            "revoked_at": datetime.utcnow(),
+            "expires_at": expires_at,
+        }
+
+    async def revoke(self, jti: str, expires_at: datetime, user_id: Optional[str] = None, reason: str = "logout") -> None:
+        """Revoke a token until its own expiry"""
+        self.add(jti, expires_at)
+        with span("mongo.revoked_tokens.insert_one"):
+            try:
+                await db.revoked_tokens.insert_one(self.record(jti, expires_at, user_id, reason))
+            except DuplicateKeyError:
+                pass
+
+    async def start(self) -> None:
+        """Load the current revocations, then keep polling for new ones"""
+        await self.sync()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="token-revocation-poller")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.sync()
+            except Exception:
+                self.failed_polls += 1
+                logger.exception("Polling revoked tokens failed")
+
+    async def sync(self) -> None:
+        """Pull revocations newer than the watermark (all of them on the first call)"""
+        now = datetime.utcnow()
+        query = {"expires_at": {"$gt": now}}
+        if self._watermark is not None:
+            query["revoked_at"] = {"$gte": self._watermark - self.overlap}
+
+        with span("mongo.revoked_tokens.find"):
+            cursor = db.revoked_tokens.find(query, {"revoked_at": 1, "expires_at": 1}).sort("revoked_at", ASCENDING)
+            async for doc in cursor:
+                self.add(doc["_id"], doc["expires_at"], doc["revoked_at"])
+                if self._watermark is None or doc["revoked_at"] > self._watermark:
+                    self._watermark = doc["revoked_at"]
+        if self._watermark is None:
+            self._watermark = now
+        self.polls += 1
+        self._prune()
+
+    def _prune(self) -> None:
+        now = time.time()
+        expired = [jti for jti, (expires_at, _) in self._revoked.items() if expires_at <= now]
+        for jti in expired:
+            del self._revoked[jti]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "running": self.running,
+            "revoked": len(self._revoked),
+            "polls": self.polls,
+            "failed_polls": self.failed_polls,
+            "checks": self.checks,
+            "rejections": self.rejections,
+        }
+
+
+revocation_list = RevocationList()
+
+
+def _revocation_change(change: dict) -> None:
+    """Apply revocations from other workers as soon as they are written"""
+    document = change.get("fullDocument")
+    if change.get("operationType") == "insert" and document:
+        revocation_list.add(change["documentKey"]["_id"], document["expires_at"], document["revoked_at"])
+
+
+# The poll keeps running and catches up anything the stream misses
+cache_invalidator.register(
+    "revoked_tokens", _revocation_change, lambda: None, fields=("expires_at", "revoked_at")
+)
@@ -0,0 +1,216 @@
+"""
+Refresh token rotation with a reuse grace window and batched lineage writes
+"""
+import asyncio
+import hashlib
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from fastapi import HTTPException, status
+from jose import JWTError
+from pymongo import ASCENDING
+from pymongo.errors import BulkWriteError
+
+from core.cache import TTLCache
+from core.indexes import register_index
+from core.metrics import span
+from .jwt_handler import REFRESH_TOKEN_EXPIRE_DAYS, create_token_pair, decode_token, unverified_claims
+from .revocation import revocation_list
+
+logger = logging.getLogger(__name__)
+
+# Refreshes of the same token within this window get the pair minted by the first one
+REFRESH_REUSE_GRACE_SECONDS = float(os.environ.get("REFRESH_REUSE_GRACE_SECONDS", "10"))
+REFRESH_GRACE_CACHE_MAX_SIZE = int(os.environ.get("REFRESH_GRACE_CACHE_MAX_SIZE", "10000"))
+REFRESH_LINEAGE_FLUSH_INTERVAL = float(os.environ.get("REFRESH_LINEAGE_FLUSH_INTERVAL", "1"))
+REFRESH_LINEAGE_MAX_PENDING = int(os.environ.get("REFRESH_LINEAGE_MAX_PENDING", "10000"))
+
+LINEAGE_COLLECTION = "refresh_token_lineage"
+
+# Database will be injected from main app
+db = None
+
+register_index(LINEAGE_COLLECTION, [("expires_at", ASCENDING)], expireAfterSeconds=0, name="expires_at_ttl")
+
+
+def _invalid_refresh_token(detail: str = "Refresh token inválido") -> HTTPException:
+    return HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=detail)
+
+
+class RefreshTokenRotator:
+    """Issues a new access/refresh pair for each refresh and retires the old refresh token.
+
+    rotate() never awaits, so concurrent refreshes of one token in this worker
+    cannot interleave: the first mints a pair and the rest, within the grace
+    window, get that same pair from an in-memory cache keyed by the token
+    digest. The old jti is revoked in memory at once; its revocation record
+    and the lineage record (new jti -> parent jti, family) are queued and
+    written in batches.
+
+    A rotated token presented again after the grace window is treated as
+    stolen and the whole token family (login session) is revoked.
+    """
+
+    def __init__(
+        self,
+        grace_seconds: float = REFRESH_REUSE_GRACE_SECONDS,
+        flush_interval: float = REFRESH_LINEAGE_FLUSH_INTERVAL,
+        max_pending: int = REFRESH_LINEAGE_MAX_PENDING,
+    ):
+        self.grace_seconds = grace_seconds
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._grace = TTLCache(max_size=REFRESH_GRACE_CACHE_MAX_SIZE, ttl=grace_seconds)
+        self._revocations: List[Dict[str, Any]] = []
+        self._lineage: List[Dict[str, Any]] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+        # Metrics
+        self.rotations = 0
+        self.grace_hits = 0
+        self.reuse_detected = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    @property
+    def pending(self) -> int:
+        return len(self._revocations) + len(self._lineage)
+
+    def rotate(self, refresh_token: str) -> Dict[str, str]:
+        digest = hashlib.sha256(refresh_token.encode()).digest()
+        cached = self._grace.get(digest)
+        if cached is not None:
+            self.grace_hits += 1
+            return cached
+
+        try:
+            payload = decode_token(refresh_token)
+        except JWTError:
+            raise _invalid_refresh_token()
+
+        username = payload.get("sub")
+        user_id = payload.get("user_id")
+        jti = payload.get("jti")
+        family = payload.get("fam")
+        if username is None or payload.get("type") != "refresh" or revocation_list.is_revoked(family):
+            raise _invalid_refresh_token()
+
+        if revocation_list.is_revoked(jti):
+            revoked_for = revocation_list.revoked_for(jti)
+            if revoked_for is not None and revoked_for < self.grace_seconds:
+                # Rotated moments ago, most likely by another worker or tab
+                raise _invalid_refresh_token("Refresh token já utilizado")
+            self._revoke_family(family, user_id)
+            raise _invalid_refresh_token()
+
+        access_token, new_refresh_token = create_token_pair(username, user_id, family)
+        result = {"access_token": access_token, "refresh_token": new_refresh_token, "token_type": "bearer"}
+
+        if jti is not None:
+            expires_at = datetime.utcfromtimestamp(payload["exp"])
+            revocation_list.add(jti, expires_at)
+            self._revocations.append(revocation_list.record(jti, expires_at, user_id, reason="rotated"))
+            # Just minted and signed here; no need to verify again
+            new_payload = unverified_claims(new_refresh_token)
+            self._lineage.append({
+                "_id": new_payload["jti"],
+                "parent": jti,
+                "family": family,
+                "user_id": user_id,
+                "rotated_at": datetime.utcnow(),
+                "expires_at": datetime.utcfromtimestamp(new_payload["exp"]),
+            })
+        self._grace.set(digest, result)
+        self.rotations += 1
+        if self.pending >= self.max_pending:
+            self._wakeup.set()
+        return result
+
+    def _revoke_family(self, family: Optional[str], user_id: Optional[str]) -> None:
+        self.reuse_detected += 1
+        if family is None:
+            return
+        logger.warning("Refresh token reuse detected for user %s, revoking token family %s", user_id, family)
+        expires_at = datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+        revocation_list.add(family, expires_at)
+        self._revocations.append(revocation_list.record(family, expires_at, user_id, reason="reuse_detected"))
+        # Other workers must learn about this quickly
+        self._wakeup.set()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(), name="refresh-lineage-writer")
+
+    async def stop(self) -> None:
+        """Stop the writer and persist everything still queued.
+
+        The writer is asked to stop rather than cancelled, so records being
+        written are never abandoned halfway.
+        """
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            try:
+                await self._task
+            finally:
+                self._task = None
+                self._stopping = False
+        await self.flush()
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Write queued revocation and lineage records with one insert_many per collection"""
+        for collection, attr in (("revoked_tokens", "_revocations"), (LINEAGE_COLLECTION, "_lineage")):
+            docs = getattr(self, attr)
+            if not docs:
+                continue
+            setattr(self, attr, [])
+            try:
+                with span(f"mongo.{collection}.insert_many"):
+                    await db[collection].insert_many(docs, ordered=False)
+                self.flushes += 1
+            except asyncio.CancelledError:
+                # Rewriting them later is harmless (duplicates are ignored), losing them is not
+                setattr(self, attr, docs + getattr(self, attr))
+                raise
+            except BulkWriteError as e:
+                # Duplicates (e.g. a family revoked twice) are fine; anything else is not
+                if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                    self.failed_flushes += 1
+                    logger.error("Writing %s records failed: %s", collection, e.details)
+            except Exception:
+                self.failed_flushes += 1
+                logger.exception("Writing %d %s records failed", len(docs), collection)
+                # Keep them for the next flush
+                setattr(self, attr, docs + getattr(self, attr))
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "running": self.running,
+            "pending": self.pending,
+            "rotations": self.rotations,
+            "grace_hits": self.grace_hits,
+            "reuse_detected": self.reuse_detected,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+        }
+
+
+refresh_rotator = RefreshTokenRotator()
@@ -1,95 +1,81 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi import APIRouter, Depends, Header, HTTPException, status, Request
 from fastapi.responses import RedirectResponse
-from motor.motor_asyncio import AsyncIOMotorDatabase
+from fastapi.security import HTTPAuthorizationCredentials
+from pymongo.errors import DuplicateKeyError
 from datetime import datetime, timedelta
 from typing import Optional
 import secrets
-import httpx
 import base64
 import json
 
-from .models import User, UserCreate, UserLogin, UserInDB, OAuthCallback, OAuthTokenResponse
+from .models import (
+    User, UserCreate, UserLogin, UserInDB, UserPublic, OAuthCallback, OAuthTokenResponse,
+    TeraboxCredentials, LogoutRequest, RefreshTokenRequest
+)
 from .jwt_handler import (
-    verify_password, 
-    get_password_hash, 
-    create_access_token, 
-    create_refresh_token,
-    refresh_access_token,
+    create_token_pair,
+    revoke_token,
     Token
 )
-from .dependencies import get_current_user, get_current_active_user
+from .rotation import refresh_rotator
+from .dependencies import get_active_principal, get_current_principal, load_principal_user, security
+from .principal import Principal
+from .user_cache import invalidate_user
+from .hashing_pool import hashing_pool
+from .oauth_state import oauth_state_store
+from .activity import activity_recorder
+from core.http_client import get_http_client
+from core.metrics import span
+from core.responses import FastJSONResponse, etag_matches, model_response, not_modified
+from providers.metadata_cache import file_metadata_cache
 
 router = APIRouter(prefix="/auth", tags=["authentication"])
 
 # Database will be injected from main app
 db = None
 
-# OAuth configuration
-OAUTH_CONFIG = {
-    "gdrive": {
-        "client_id": "your-google-client-id",  # Configure in .env
-        "client_secret": "your-google-client-secret",
-        "auth_url": "https://accounts.google.com/o/oauth2/auth",
-        "token_url": "https://oauth2.googleapis.com/token",
-        "scope": "https://www.googleapis.com/auth/drive.file",
-        "redirect_uri": "https://progressive-release.preview.emergentagent.com/auth/callback/gdrive"
-    },
-    "proton": {
-        "client_id": "your-proton-client-id",
-        "client_secret": "your-proton-client-secret", 
-        "auth_url": "https://account.proton.me/oauth/authorize",
-        "token_url": "https://account.proton.me/oauth/token",
-        "scope": "drive:read drive:write",
-        "redirect_uri": "https://progressive-release.preview.emergentagent.com/auth/callback/proton"
-    }
-}
+# Clients revalidate polled resources every time; the ETag makes that a 304
+REVALIDATE_HEADERS = {"Cache-Control": "private, no-cache"}
 
 @router.post("/signup", response_model=dict)
 async def signup(user_data: UserCreate):
     """Register new user"""
     
-    # Check if user already exists
-    existing_user = await db.users.find_one({
-        "$or": [
-            {"username": user_data.username},
-            {"email": user_data.email}
-        ]
-    })
-    
-    if existing_user:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Usuário ou email já existe"
-        )
-    
     # Create user
-    hashed_password = get_password_hash(user_data.password)
-    user_dict = user_data.dict()
+    hashed_password = await hashing_pool.hash(user_data.password)
+    user_dict = user_data.model_dump()
     del user_dict["password"]
     
     user_in_db = UserInDB(**user_dict, hashed_password=hashed_password)
     
-    # Insert user
-    result = await db.users.insert_one(user_in_db.dict())
+    # Insert user; the unique indexes on username and email reject duplicates
+    try:
+        with span("mongo.users.insert_one"):
+            result = await db.users.insert_one(user_in_db.model_dump())
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Usuário ou email já existe"
+        )
     
     # Create tokens
-    access_token = create_access_token(data={"sub": user_data.username, "user_id": user_in_db.id})
-    refresh_token = create_refresh_token(data={"sub": user_data.username, "user_id": user_in_db.id})
+    access_token, refresh_token = create_token_pair(user_data.username, user_in_db.id)
     
-    return {
+    return FastJSONResponse({
         "message": "Usuário criado com sucesso",
         "access_token": access_token,
         "refresh_token": refresh_token,
         "token_type": "bearer",
-        "user": User(**user_dict, id=user_in_db.id)
-    }
+        "user": User(**user_dict, id=user_in_db.id).model_dump()
+    })
 
 @router.post("/login", response_model=dict)
 async def login(user_credentials: UserLogin):
     """Login user with username/password"""
     
     # Find user
-    user = await db.users.find_one({"username": user_credentials.username})
+    with span("mongo.users.find_one"):
+        user = await db.users.find_one({"username": user_credentials.username})
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -98,61 +84,130 @@ async def login(user_credentials: UserLogin):
         )
     
     # Verify password
-    if not verify_password(user_credentials.password, user["hashed_password"]):
+    if not await hashing_pool.verify(user_credentials.password, user["hashed_password"]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Credenciais inválidas",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    # Update last login
-    await db.users.update_one(
-        {"_id": user["_id"]}, 
-        {"$set": {"last_login": datetime.utcnow()}}
-    )
+    # Update last login (queued and written in batches, off the critical path)
+    await activity_recorder.record_login(db, user["id"])
     
     # Create tokens
-    access_token = create_access_token(data={"sub": user["username"], "user_id": user["id"]})
-    refresh_token = create_refresh_token(data={"sub": user["username"], "user_id": user["id"]})
+    access_token, refresh_token = create_token_pair(user["username"], user["id"])
     
-    return {
+    return FastJSONResponse({
         "access_token": access_token,
         "refresh_token": refresh_token,
         "token_type": "bearer",
-        "user": User(**{k: v for k, v in user.items() if k != "hashed_password"})
-    }
+        "user": User(**{k: v for k, v in user.items() if k != "hashed_password"}).model_dump()
+    })
 
 @router.post("/refresh", response_model=dict)
-async def refresh_token(refresh_token: str):
-    """Refresh access token"""
+async def refresh_token(body: Optional[RefreshTokenRequest] = None, refresh_token: Optional[str] = None):
+    """Rotate a refresh token into a new access/refresh pair.
     
-    new_access_token = refresh_access_token(refresh_token)
+    The token is read from the JSON body; the refresh_token query parameter
+    is still accepted for older clients.
+    """
     
-    return {
-        "access_token": new_access_token,
-        "token_type": "bearer"
-    }
+    token = body.refresh_token if body is not None else refresh_token
+    if not token:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Refresh token obrigatório")
+    
+    try:
+        tokens = refresh_rotator.rotate(token)
+    finally:
+        # Without the background writer (e.g. scripts), persist right away
+        if not refresh_rotator.running:
+            await refresh_rotator.flush()
+    
+    return FastJSONResponse(tokens)
+
+@router.post("/logout")
+async def logout(
+    body: Optional[LogoutRequest] = None,
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    current_user: Principal = Depends(get_current_principal)
+):
+    """Revoke the current access token and, if given, the refresh token"""
+    
+    await revoke_token(credentials.credentials, user_id=current_user.id)
+    if body is not None and body.refresh_token:
+        await revoke_token(body.refresh_token, user_id=current_user.id)
+    
+    return {"message": "Logout realizado com sucesso"}
 
-@router.get("/me", response_model=User)
-async def get_current_user_info(current_user: User = Depends(get_current_active_user)):
+@router.get("/me", response_model=UserPublic)
+async def get_current_user_info(
+    principal: Principal = Depends(get_active_principal),
+    if_none_match: Optional[str] = Header(None)
+):
     """Get current user information"""
-    return current_user
+    
+    # Revalidations are answered from the principal, without loading the User
+    etag = f'"{principal.id}:{principal.version}"'
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag, REVALIDATE_HEADERS)
+    
+    current_user = await load_principal_user(principal)
+    etag = f'"{current_user.id}:{current_user.version}"'
+    # Provider tokens and credentials stay on the server
+    return model_response(UserPublic.from_user(current_user), headers={**REVALIDATE_HEADERS, "ETag": etag})
 
 # OAuth Routes
+# Declared before /oauth/{provider}, which would otherwise match "status"
+@router.get("/oauth/status")
+async def oauth_status(
+    current_user: Principal = Depends(get_active_principal),
+    if_none_match: Optional[str] = Header(None)
+):
+    """Get OAuth connection status for all providers"""
+    
+    from .oauth_helpers import OAUTH_CONFIG
+    
+    # Any change to the connected providers bumps the user's version
+    etag = f'"oauth:{current_user.id}:{current_user.version}"'
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag, REVALIDATE_HEADERS)
+    
+    # Only the fields shown here, never the refresh tokens
+    projection = {"_id": 0, "version": 1}
+    for provider in OAUTH_CONFIG:
+        for field in ("access_token", "expires_at", "scope"):
+            projection[f"oauth_providers.{provider}.{field}"] = 1
+    with span("mongo.users.find_one"):
+        user_data = await db.users.find_one({"id": current_user.id}, projection) or {}
+    oauth_providers = user_data.get("oauth_providers", {})
+    
+    status = {}
+    for provider in OAUTH_CONFIG.keys():
+        provider_data = oauth_providers.get(provider, {})
+        status[provider] = {
+            "connected": bool(provider_data.get("access_token")),
+            "expires_at": provider_data.get("expires_at"),
+            "scope": provider_data.get("scope", [])
+        }
+    
+    etag = f'"oauth:{current_user.id}:{user_data.get("version", 0)}"'
+    return FastJSONResponse(status, headers={**REVALIDATE_HEADERS, "ETag": etag})
+
 @router.get("/oauth/{provider}")
-async def oauth_login(provider: str, request: Request):
+async def oauth_login(provider: str, request: Request, current_user: Principal = Depends(get_active_principal)):
     """Initiate OAuth flow for provider (gdrive, proton)"""
     
+    # OAuth helpers pull in httpx; import them on the first OAuth request, not at boot
+    from .oauth_helpers import OAUTH_CONFIG
+    
     if provider not in OAUTH_CONFIG:
         raise HTTPException(status_code=400, detail="Provider não suportado")
     
     config = OAUTH_CONFIG[provider]
     
-    # Generate state for CSRF protection
+    # Generate state for CSRF protection and bind the pending flow to the user
     state = secrets.token_urlsafe(32)
-    
-    # Store state in session/cache (for now, we'll use a simple approach)
-    # In production, use Redis or proper session management
+    await oauth_state_store.save(state, {"user_id": current_user.id, "provider": provider})
     
     auth_url = (
         f"{config['auth_url']}?"
@@ -167,12 +222,20 @@ async def oauth_login(provider: str, request: Request):
     return {"auth_url": auth_url, "state": state}
 
 @router.get("/callback/{provider}")
-async def oauth_callback(provider: str, code: str, state: str, current_user: User = Depends(get_current_user)):
+async def oauth_callback(provider: str, code: str, state: str):
     """Handle OAuth callback and store tokens"""
     
+    from .oauth_helpers import OAUTH_CONFIG
+    
     if provider not in OAUTH_CONFIG:
         raise HTTPException(status_code=400, detail="Provider não suportado")
     
+    # The state identifies the user who started the flow; it can only be used once
+    pending = await oauth_state_store.pop(state)
+    if pending is None or pending.get("provider") != provider:
+        raise HTTPException(status_code=400, detail="Estado OAuth inválido ou expirado")
+    user_id = pending["user_id"]
+    
     config = OAUTH_CONFIG[provider]
     
     # Exchange code for tokens
@@ -184,13 +247,13 @@ async def oauth_callback(provider: str, code: str, state: str, current_user: Use
         "redirect_uri": config["redirect_uri"]
     }
     
-    async with httpx.AsyncClient() as client:
-        response = await client.post(config["token_url"], data=token_data)
-        
-        if response.status_code != 200:
-            raise HTTPException(status_code=400, detail="Falha na autenticação OAuth")
-        
-        tokens = response.json()
+    with span(f"http.{provider}.token_exchange"):
+        response = await get_http_client().post(config["token_url"], data=token_data)
+    
+    if response.status_code != 200:
+        raise HTTPException(status_code=400, detail="Falha na autenticação OAuth")
+    
+    tokens = response.json()
     
     # Calculate expiry
     expires_at = None
@@ -206,10 +269,14 @@ async def oauth_callback(provider: str, code: str, state: str, current_user: Use
     }
     
     # Update user with OAuth tokens
-    await db.users.update_one(
-        {"id": current_user.id},
-        {"$set": {f"oauth_providers.{provider}": oauth_data}}
-    )
+    with span("mongo.users.update_one"):
+        await db.users.update_one(
+            {"id": user_id},
+            {"$set": {f"oauth_providers.{provider}": oauth_data}, "$inc": {"version": 1}}
+        )
+    invalidate_user(user_id=user_id)
+    # The account may differ from the one previously connected
+    await file_metadata_cache.forget(user_id, provider)
     
     return {
         "message": f"{provider} conectado com sucesso",
@@ -217,31 +284,45 @@ async def oauth_callback(provider: str, code: str, state: str, current_user: Use
         "expires_at": expires_at
     }
 
-@router.delete("/oauth/{provider}")
-async def disconnect_oauth(provider: str, current_user: User = Depends(get_current_active_user)):
-    """Disconnect OAuth provider"""
+@router.post("/terabox/connect")
+async def connect_terabox(credentials: TeraboxCredentials, current_user: Principal = Depends(get_active_principal)):
+    """Connect Terabox, which uses basic auth instead of OAuth"""
     
-    await db.users.update_one(
-        {"id": current_user.id},
-        {"$unset": {f"oauth_providers.{provider}": ""}}
-    )
+    from .oauth_helpers import TeraboxAuth
+    from providers.adapters import ADAPTERS
     
-    return {"message": f"{provider} desconectado com sucesso"}
-
-@router.get("/oauth/status")
-async def oauth_status(current_user: User = Depends(get_current_active_user)):
-    """Get OAuth connection status for all providers"""
+    if "terabox" not in ADAPTERS:
+        raise HTTPException(status_code=400, detail="Provider não suportado")
     
-    user_data = await db.users.find_one({"id": current_user.id})
-    oauth_providers = user_data.get("oauth_providers", {})
+    if not await TeraboxAuth.validate_credentials(credentials.username, credentials.password):
+        raise HTTPException(status_code=400, detail="Credenciais do Terabox inválidas")
     
-    status = {}
-    for provider in OAUTH_CONFIG.keys():
-        provider_data = oauth_providers.get(provider, {})
-        status[provider] = {
-            "connected": bool(provider_data.get("access_token")),
-            "expires_at": provider_data.get("expires_at"),
-            "scope": provider_data.get("scope", [])
-        }
+    terabox_data = {
+        "username": credentials.username,
+        "auth_header": TeraboxAuth.create_auth_header(credentials.username, credentials.password),
+        "connected_at": datetime.utcnow()
+    }
     
-    return status
\ No newline at end of file
+    with span("mongo.users.update_one"):
+        await db.users.update_one(
+            {"id": current_user.id},
+            {"$set": {"oauth_providers.terabox": terabox_data}, "$inc": {"version": 1}}
+        )
+    invalidate_user(user_id=current_user.id, username=current_user.username)
+    await file_metadata_cache.forget(current_user.id, "terabox")
+    
+    return {"message": "terabox conectado com sucesso", "provider": "terabox"}
+
+@router.delete("/oauth/{provider}")
+async def disconnect_oauth(provider: str, current_user: Principal = Depends(get_active_principal)):
+    """Disconnect OAuth provider"""
+    
+    with span("mongo.users.update_one"):
+        await db.users.update_one(
+            {"id": current_user.id},
+            {"$unset": {f"oauth_providers.{provider}": ""}, "$inc": {"version": 1}}
+        )
+    invalidate_user(user_id=current_user.id, username=current_user.username)
+    await file_metadata_cache.forget(current_user.id, provider)
+    
+    return {"message": f"{provider} desconectado com sucesso"}
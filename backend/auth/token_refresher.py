@@ -0,0 +1,211 @@
+"""
+Background scheduler that refreshes OAuth provider tokens ahead of expiry
+"""
+import asyncio
+import logging
+import os
+import random
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from core.indexes import register_index, register_query_shape
+from .oauth_helpers import OAUTH_CONFIG, OAuthTokenManager
+from .user_cache import invalidate_user
+
+logger = logging.getLogger(__name__)
+
+OAUTH_REFRESH_SCHEDULER_ENABLED = os.environ.get("OAUTH_REFRESH_SCHEDULER_ENABLED", "true").lower() == "true"
+OAUTH_REFRESH_INTERVAL_SECONDS = float(os.environ.get("OAUTH_REFRESH_INTERVAL_SECONDS", "60"))
+# Must stay well above the 5 minute window used by the request path
+OAUTH_REFRESH_LEAD_SECONDS = float(os.environ.get("OAUTH_REFRESH_LEAD_SECONDS", "900"))
+OAUTH_REFRESH_BATCH_SIZE = int(os.environ.get("OAUTH_REFRESH_BATCH_SIZE", "100"))
+OAUTH_REFRESH_CONCURRENCY = int(os.environ.get("OAUTH_REFRESH_CONCURRENCY", "5"))
+OAUTH_REFRESH_RATE_PER_SECOND = float(os.environ.get("OAUTH_REFRESH_RATE_PER_SECOND", "10"))
+OAUTH_REFRESH_JITTER_SECONDS = float(os.environ.get("OAUTH_REFRESH_JITTER_SECONDS", "1"))
+OAUTH_REFRESH_LEASE_SECONDS = float(os.environ.get("OAUTH_REFRESH_LEASE_SECONDS", "120"))
+OAUTH_REFRESH_BACKOFF_BASE_SECONDS = float(os.environ.get("OAUTH_REFRESH_BACKOFF_BASE_SECONDS", "60"))
+OAUTH_REFRESH_BACKOFF_MAX_SECONDS = float(os.environ.get("OAUTH_REFRESH_BACKOFF_MAX_SECONDS", "3600"))
+
+LEASE_NAME = "oauth_token_refresh"
+
+# The due-token scan filters and sorts on each provider's expiry
+for _provider in OAUTH_CONFIG:
+    register_index("users", [(f"oauth_providers.{_provider}.expires_at", ASCENDING)], sparse=True)
+    register_query_shape(
+        f"users with expiring {_provider} token",
+        "users",
+        {f"oauth_providers.{_provider}.expires_at": {"$lte": datetime(2000, 1, 1)}},
+        sort=[(f"oauth_providers.{_provider}.expires_at", ASCENDING)],
+    )
+
+
+class TokenRefreshScheduler:
+    """Periodically refreshes provider tokens that expire within the lead window.
+
+    Several uvicorn workers may run a scheduler; a lease document in the
+    scheduler_leases collection makes sure only one of them works at a time.
+    """
+
+    def __init__(
+        self,
+        db,
+        interval: float = OAUTH_REFRESH_INTERVAL_SECONDS,
+        lead: float = OAUTH_REFRESH_LEAD_SECONDS,
+        batch_size: int = OAUTH_REFRESH_BATCH_SIZE,
+        concurrency: int = OAUTH_REFRESH_CONCURRENCY,
+        rate_per_second: float = OAUTH_REFRESH_RATE_PER_SECOND,
+        jitter: float = OAUTH_REFRESH_JITTER_SECONDS,
+        lease_seconds: float = OAUTH_REFRESH_LEASE_SECONDS,
+    ):
+        self.db = db
+        self.interval = interval
+        self.lead = timedelta(seconds=lead)
+        self.batch_size = batch_size
+        self.concurrency = max(1, concurrency)
+        self.rate_per_second = rate_per_second
+        self.jitter = jitter
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._task: Optional[asyncio.Task] = None
+
+        # Metrics
+        self.runs = 0
+        self.refreshed = 0
+        self.failed = 0
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="oauth-token-refresher")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self._release_lease()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if await self._acquire_lease():
+                    await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("OAuth token refresh run failed")
+            await asyncio.sleep(self.interval + random.uniform(0, self.jitter))
+
+    async def _acquire_lease(self) -> bool:
+        """Take or extend the shared lease; False while another worker holds it"""
+        now = datetime.utcnow()
+        try:
+            lease = await self.db.scheduler_leases.find_one_and_update(
+                {
+                    "_id": LEASE_NAME,
+                    "$or": [{"owner": self.owner}, {"expires_at": {"$lte": now}}],
+                },
+                {"$set": {"owner": self.owner, "expires_at": now + timedelta(seconds=self.lease_seconds)}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # The lease exists and is held by someone else, so the upsert tried to insert
+            return False
+        return lease is not None and lease.get("owner") == self.owner
+
+    async def _release_lease(self) -> None:
+        try:
+            await self.db.scheduler_leases.delete_one({"_id": LEASE_NAME, "owner": self.owner})
+        except Exception:
+            logger.exception("Could not release OAuth refresh lease")
+
+    async def run_once(self) -> Dict[str, int]:
+        """Refresh every due token once; returns per-run counters"""
+        self.runs += 1
+        semaphore = asyncio.Semaphore(self.concurrency)
+        spacing = 1.0 / self.rate_per_second if self.rate_per_second > 0 else 0.0
+        results = {"refreshed": 0, "failed": 0}
+        tasks = []
+
+        for provider in OAUTH_CONFIG:
+            async for user in self._due_users(provider):
+                await semaphore.acquire()
+                tasks.append(asyncio.create_task(
+                    self._refresh_one(semaphore, user, provider, results)
+                ))
+                if spacing:
+                    await asyncio.sleep(spacing)
+
+        if tasks:
+            await asyncio.gather(*tasks)
+        self.refreshed += results["refreshed"]
+        self.failed += results["failed"]
+        return results
+
+    def _due_users(self, provider: str):
+        field = f"oauth_providers.{provider}"
+        now = datetime.utcnow()
+        query = {
+            f"{field}.expires_at": {"$lte": now + self.lead},
+            f"{field}.refresh_token": {"$nin": [None, ""]},
+            "$or": [
+                {f"{field}.next_refresh_attempt": {"$exists": False}},
+                {f"{field}.next_refresh_attempt": {"$lte": now}},
+            ],
+        }
+        return self.db.users.find(query, {"_id": 0, "id": 1, field: 1}) \
+            .sort(f"{field}.expires_at", 1) \
+            .limit(self.batch_size)
+
+    async def _refresh_one(
+        self, semaphore: asyncio.Semaphore, user: Dict[str, Any], provider: str, results: Dict[str, int]
+    ) -> None:
+        try:
+            if self.jitter:
+                await asyncio.sleep(random.uniform(0, self.jitter))
+            provider_data = user["oauth_providers"][provider]
+            refreshed = await OAuthTokenManager(self.db).refresh_token(user["id"], provider, provider_data)
+            if refreshed is None:
+                results["failed"] += 1
+                await self._record_failure(user["id"], provider, provider_data)
+            else:
+                results["refreshed"] += 1
+        except Exception:
+            results["failed"] += 1
+            logger.exception("Unexpected error refreshing %s token for user %s", provider, user.get("id"))
+        finally:
+            semaphore.release()
+
+    async def _record_failure(self, user_id: str, provider: str, provider_data: Dict[str, Any]) -> None:
+        """Push the next attempt out with exponential backoff"""
+        field = f"oauth_providers.{provider}"
+        failures = provider_data.get("refresh_failures", 0) + 1
+        delay = min(OAUTH_REFRESH_BACKOFF_BASE_SECONDS * 2 ** (failures - 1), OAUTH_REFRESH_BACKOFF_MAX_SECONDS)
+        now = datetime.utcnow()
+        # Match on the refresh token so a concurrent disconnect or reconnect is not overwritten
+        await self.db.users.update_one(
+            {"id": user_id, f"{field}.refresh_token": provider_data.get("refresh_token")},
+            {"$set": {
+                f"{field}.refresh_failures": failures,
+                f"{field}.last_refresh_failure": now,
+                f"{field}.next_refresh_attempt": now + timedelta(seconds=delay),
+            }, "$inc": {"version": 1}}
+        )
+        invalidate_user(user_id=user_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None,
+            "runs": self.runs,
+            "refreshed": self.refreshed,
+            "failed": self.failed,
+        }
@@ -0,0 +1,195 @@
+"""
+In-process cache of authenticated users, sitting in front of the users collection
+"""
+import os
+from typing import Any, Dict, Optional
+
+from core.cache import TTLCache
+from core.cache_coherence import cache_invalidator
+from .models import User
+from .principal import Principal
+
+USER_CACHE_MAX_SIZE = int(os.environ.get("USER_CACHE_MAX_SIZE", "10000"))
+USER_CACHE_TTL_SECONDS = float(os.environ.get("USER_CACHE_TTL_SECONDS", "60"))
+# Used while change streams invalidate users on every worker
+USER_CACHE_COHERENT_TTL_SECONDS = float(os.environ.get("USER_CACHE_COHERENT_TTL_SECONDS", "600"))
+
+
+class UserCache:
+    """LRU + TTL cache of User models and Principals, addressable by username or user id.
+
+    Principals are kept apart from the models: most requests only need a
+    Principal, which is cached from a projected read without ever building
+    the User. Provider tokens are cached the same way, by user id, for the
+    file routes. Cached values are shared between requests and must be
+    treated as read-only.
+    """
+
+    def __init__(
+        self,
+        max_size: int = USER_CACHE_MAX_SIZE,
+        ttl: float = USER_CACHE_TTL_SECONDS,
+        coherent_ttl: float = USER_CACHE_COHERENT_TTL_SECONDS,
+    ):
+        self._users = TTLCache(max_size=max_size, ttl=ttl)
+        self._principals = TTLCache(max_size=max_size, ttl=ttl)
+        # user id -> (username, oauth_providers)
+        self._providers = TTLCache(max_size=max_size, ttl=ttl)
+        self.ttl = ttl
+        self.coherent_ttl = coherent_ttl
+        # user id -> username; entries may outlive the user they point to,
+        # so lookups always double check the id of the cached entry
+        self._ids: Dict[str, str] = {}
+        # Bumped by every invalidation, so a load that raced one is not cached
+        self.generation = 0
+
+    def get(self, username: str) -> Optional[User]:
+        return self._users.get(username)
+
+    def get_by_id(self, user_id: str) -> Optional[User]:
+        username = self._ids.get(user_id)
+        if username is None:
+            self._users.misses += 1
+            return None
+
+        user = self._users.get(username)
+        if user is None or user.id != user_id:
+            self._ids.pop(user_id, None)
+            return None
+        return user
+
+    def get_principal(self, username: str) -> Optional[Principal]:
+        principal = self._principals.get(username)
+        if principal is not None:
+            return principal
+
+        user = self._users.peek(username)
+        remaining = self._users.remaining_ttl(username)
+        if user is None or remaining is None:
+            return None
+        # Derived once from the cached model, then served from the principals
+        # until the model would have expired: never fresher than its source
+        principal = Principal.from_user(user)
+        self._principals.set(username, principal, ttl=remaining)
+        return principal
+
+    def get_providers(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """oauth_providers of the user, or None when not cached"""
+        entry = self._providers.get(user_id)
+        if entry is not None:
+            return entry[1]
+
+        username = self._ids.get(user_id)
+        user = self._users.peek(username) if username is not None else None
+        remaining = self._users.remaining_ttl(username) if username is not None else None
+        if user is None or user.id != user_id or remaining is None:
+            return None
+        # Derived like principals: never fresher than the cached model
+        providers = user.oauth_providers or {}
+        self._providers.set(user_id, (username, providers), ttl=remaining)
+        return providers
+
+    def set(self, user: User, generation: Optional[int] = None) -> None:
+        """Cache user; pass the generation read before loading it to skip a possibly stale load"""
+        if generation is not None and generation != self.generation:
+            return
+        self._users.set(user.username, user)
+        self._map_id(user.id, user.username)
+
+    def set_principal(self, principal: Principal, generation: Optional[int] = None) -> None:
+        """Cache principal; generation works as in set"""
+        if generation is not None and generation != self.generation:
+            return
+        self._principals.set(principal.username, principal)
+        self._map_id(principal.id, principal.username)
+
+    def set_providers(
+        self, user_id: str, username: str, providers: Dict[str, Any], generation: Optional[int] = None
+    ) -> None:
+        """Cache the oauth_providers of a user; generation works as in set"""
+        if generation is not None and generation != self.generation:
+            return
+        self._providers.set(user_id, (username, providers))
+        self._map_id(user_id, username)
+
+    def _map_id(self, user_id: str, username: str) -> None:
+        self._ids[user_id] = username
+        if len(self._ids) > 2 * max(self._users.max_size, 1):
+            # Drop id mappings whose user has already been evicted
+            self._ids = {
+                uid: name for uid, name in self._ids.items()
+                if name in self._users or name in self._principals or uid in self._providers
+            }
+
+    def invalidate(self, user_id: Optional[str] = None, username: Optional[str] = None) -> None:
+        """Forget a user by id and/or username"""
+        self.generation += 1
+        if user_id is not None:
+            self._providers.pop(user_id)
+            mapped = self._ids.pop(user_id, None)
+            if mapped is not None:
+                self._users.pop(mapped)
+                self._principals.pop(mapped)
+        if username is not None:
+            for cached in (self._users.pop(username), self._principals.pop(username)):
+                if cached is not None:
+                    self._ids.pop(cached.id, None)
+                    self._providers.pop(cached.id)
+            # Provider tokens may be cached without the user they belong to
+            for uid in [uid for uid, name in self._ids.items() if name == username]:
+                self._ids.pop(uid)
+                self._providers.pop(uid)
+
+    def clear(self) -> None:
+        self.generation += 1
+        self._users.clear()
+        self._principals.clear()
+        self._providers.clear()
+        self._ids.clear()
+
+    def set_coherent(self, coherent: bool) -> None:
+        """Keep users longer while other workers' writes invalidate them here"""
+        if not coherent:
+            # Entries cached with the long TTL would no longer be invalidated
+            self.clear()
+        self._users.ttl = self._principals.ttl = self._providers.ttl = self.coherent_ttl if coherent else self.ttl
+
+    def invalidate_change(self, change: Dict[str, Any]) -> None:
+        """Invalidation for a users change event"""
+        document = change.get("fullDocument")
+        if document and (document.get("id") or document.get("username")):
+            self.invalidate(user_id=document.get("id"), username=document.get("username"))
+        else:
+            # Deleted documents do not say which user they were
+            self.clear()
+
+    def stats(self) -> Dict[str, int]:
+        principals = self._principals.stats()
+        providers = self._providers.stats()
+        return {
+            **self._users.stats(),
+            "principals": principals["size"],
+            "principal_hits": principals["hits"],
+            "principal_misses": principals["misses"],
+            "provider_tokens": len(self._providers),
+            "provider_token_hits": providers["hits"],
+            "provider_token_misses": providers["misses"],
+        }
+
+
+user_cache = UserCache()
+
+# last_seen is not part of User and is written constantly by the activity recorder
+cache_invalidator.register(
+    "users",
+    user_cache.invalidate_change,
+    user_cache.clear,
+    fields=("id", "username"),
+    ignore_fields=("last_seen",),
+    on_coherence=user_cache.set_coherent,
+)
+
+
+def invalidate_user(user_id: Optional[str] = None, username: Optional[str] = None) -> None:
+    """Invalidation hook for every code path that writes to a users document"""
+    user_cache.invalidate(user_id=user_id, username=username)
@@ -0,0 +1,61 @@
+"""
+Micro-benchmark for access token verification.
+
+Compares python-jose and PyJWT decoding with the cached verify_token path.
+Run from the backend directory:
+
+    python -m benchmarks.bench_jwt [--iterations N]
+"""
+import argparse
+import timeit
+
+from auth import jwt_handler
+
+
+def _per_call_us(fn, iterations: int) -> float:
+    # Best of a few repeats to reduce scheduler noise
+    best = min(timeit.repeat(fn, number=iterations, repeat=5))
+    return best / iterations * 1e6
+
+
+def run(iterations: int) -> dict:
+    token = jwt_handler.create_access_token(data={"sub": "bench", "user_id": "bench-id"})
+    results = {}
+
+    original_backend = jwt_handler.JWT_BACKEND
+    try:
+        for backend in ("jose", "pyjwt"):
+            jwt_handler.JWT_BACKEND = backend
+            results[f"decode[{backend}]"] = _per_call_us(
+                lambda: jwt_handler.decode_token(token), iterations
+            )
+
+            # Uncached verify_token: clear the cache before every call
+            def uncached():
+                jwt_handler._token_cache.clear()
+                jwt_handler.verify_token(token)
+
+            results[f"verify_token[{backend}, uncached]"] = _per_call_us(uncached, iterations)
+    finally:
+        jwt_handler.JWT_BACKEND = original_backend
+
+    jwt_handler._token_cache.clear()
+    jwt_handler.verify_token(token)
+    results["verify_token[cached]"] = _per_call_us(lambda: jwt_handler.verify_token(token), iterations)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    results = run(args.iterations)
+    baseline = results["verify_token[jose, uncached]"]
+    print(f"{'path':<36}{'us/call':>10}{'vs jose':>10}")
+    for name, us in results.items():
+        print(f"{name:<36}{us:>10.2f}{baseline / us:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Throughput benchmark for the hot read endpoints, GET /api/status and GET /api/auth/me.
+
+Runs the FastAPI app in-process over ASGI. Status checks are served from a
+pre-built list instead of a Mongo stand-in, so the numbers are dominated by
+routing, validation and serialization cost.
+Run from the backend directory:
+
+    python -m benchmarks.bench_responses [--requests N] [--status-docs D]
+"""
+import argparse
+import asyncio
+import logging
+import time
+
+import httpx
+
+from benchmarks.harness import app_client, install_database, mock_database
+
+
+class ListCursor:
+    """Just enough of a Motor cursor to replay pre-built documents"""
+
+    def __init__(self, docs):
+        self._docs = docs
+
+    def sort(self, *args, **kwargs):
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def limit(self, limit):
+        return ListCursor(self._docs[:limit])
+
+    async def to_list(self, length):
+        return [dict(doc) for doc in self._docs[:length]]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self._docs:
+            yield dict(doc)
+
+
+class ListStatusChecks:
+    def __init__(self, docs):
+        self._docs = docs
+
+    def find(self, *args, **kwargs):
+        return ListCursor(self._docs)
+
+
+async def _measure(client: httpx.AsyncClient, path: str, requests: int, headers=None) -> float:
+    response = await client.get(path, headers=headers)  # Warm up caches
+    response.raise_for_status()
+    started = time.perf_counter()
+    for _ in range(requests):
+        response = await client.get(path, headers=headers)
+    elapsed = time.perf_counter() - started
+    response.raise_for_status()
+    return requests / elapsed
+
+
+async def run(requests: int, status_docs: int) -> dict:
+    from status_checks import routes as status_routes
+
+    db = mock_database()
+    install_database(db)
+
+    async with app_client() as client:
+        body = [{"client_name": f"agent-{i % 50}"} for i in range(status_docs)]
+        (await client.post("/api/status/bulk", json=body)).raise_for_status()
+        docs = await db.status_checks.find({}, {"_id": 0}).to_list(None)
+        status_routes.db = type("StatusDatabase", (), {"status_checks": ListStatusChecks(docs)})()
+
+        signup = await client.post("/api/auth/signup", json={
+            "username": "bench", "email": "bench@example.com", "password": "bench-password"
+        })
+        signup.raise_for_status()
+        auth = {"Authorization": f"Bearer {signup.json()['access_token']}"}
+
+        return {
+            f"GET /api/status ({status_docs} docs)": await _measure(
+                client, f"/api/status?limit={status_docs}", max(1, requests // 10)
+            ),
+            "GET /api/auth/me": await _measure(client, "/api/auth/me", requests, headers=auth),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--status-docs", type=int, default=1000)
+    args = parser.parse_args()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    results = asyncio.run(run(args.requests, args.status_docs))
+    print(f"{'endpoint':<36}{'req/s':>10}")
+    for name, rate in results.items():
+        print(f"{name:<36}{rate:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
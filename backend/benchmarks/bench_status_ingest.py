@@ -0,0 +1,113 @@
+"""
+Throughput benchmark for POST /api/status with and without the write buffer.
+
+Runs the FastAPI app in-process against an in-memory Mongo stand-in where each
+call holds one of a fixed number of pooled connections for a round-trip, so
+batching effects show up as they would against a real server. Run from the
+backend directory:
+
+    python -m benchmarks.bench_status_ingest [--requests N] [--concurrency C] [--rtt-ms MS] [--pool-size P]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "benchmark")
+
+import httpx
+from mongomock_motor import AsyncMongoMockClient
+
+
+class DelayedCollection:
+    """Wraps a mock collection; every write holds a pooled connection for one round-trip"""
+
+    def __init__(self, collection, rtt: float, pool: asyncio.Semaphore):
+        self._collection = collection
+        self._rtt = rtt
+        self._pool = pool
+
+    async def insert_one(self, doc):
+        async with self._pool:
+            await asyncio.sleep(self._rtt)
+            return await self._collection.insert_one(doc)
+
+    async def insert_many(self, docs, ordered=True):
+        async with self._pool:
+            await asyncio.sleep(self._rtt)
+            return await self._collection.insert_many(docs, ordered=ordered)
+
+    async def bulk_write(self, operations, ordered=True):
+        async with self._pool:
+            await asyncio.sleep(self._rtt)
+            return await self._collection.bulk_write(operations, ordered=ordered)
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+
+class DelayedDatabase:
+    def __init__(self, db, rtt: float, pool_size: int):
+        self._db = db
+        self._rtt = rtt
+        self._pool = asyncio.Semaphore(pool_size)
+
+    def __getitem__(self, name):
+        return DelayedCollection(self._db[name], self._rtt, self._pool)
+
+    def __getattr__(self, name):
+        return self[name]
+
+
+async def run_mode(buffered: bool, requests: int, concurrency: int, rtt: float, pool_size: int) -> float:
+    import server
+    from status_checks import routes as status_routes
+    from status_checks.write_buffer import write_buffer
+
+    db = DelayedDatabase(AsyncMongoMockClient()["benchmark"], rtt, pool_size)
+    status_routes.db = db
+    if buffered:
+        write_buffer.start(db)
+
+    remaining = iter(range(requests))
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def worker():
+            for i in remaining:
+                response = await client.post("/api/status", json={"client_name": f"agent-{i % 50}"})
+                response.raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    if buffered:
+        await write_buffer.stop()
+    inserted = await db.status_checks.count_documents({})
+    assert inserted == requests, f"expected {requests} documents, found {inserted}"
+    return requests / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--rtt-ms", type=float, default=2.0)
+    parser.add_argument("--pool-size", type=int, default=10)
+    args = parser.parse_args()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    rtt = args.rtt_ms / 1000
+    direct = asyncio.run(run_mode(False, args.requests, args.concurrency, rtt, args.pool_size))
+    buffered = asyncio.run(run_mode(True, args.requests, args.concurrency, rtt, args.pool_size))
+    print(f"{'mode':<22}{'inserts/s':>12}")
+    print(f"{'direct':<22}{direct:>12.0f}")
+    print(f"{'write buffer':<22}{buffered:>12.0f}")
+    print(f"speedup: {buffered / direct:.1f}x "
+          f"(rtt {args.rtt_ms} ms, pool {args.pool_size}, concurrency {args.concurrency})")
+
+
+if __name__ == "__main__":
+    main()
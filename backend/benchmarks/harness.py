@@ -0,0 +1,255 @@
+"""
+Shared helpers for booting the backend in-process for benchmarks
+"""
+import asyncio
+import functools
+import hashlib
+import os
+import re
+import uuid
+from typing import Callable, Dict, List, Optional
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "benchmark")
+# Benchmarks drive thousands of requests from one client address
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+
+import httpx
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+
+def install_database(db) -> None:
+    """Point the app and every module that holds a db reference at db"""
+    import server
+
+    server.app.state.db = db
+    server.bind_database(db)
+
+
+def mock_database(name: str = "benchmark"):
+    """A fresh in-memory Mongo stand-in"""
+    from mongomock_motor import AsyncMongoMockClient
+
+    return AsyncMongoMockClient()[name]
+
+
+class StubTokenServer:
+    """OAuth token endpoint stand-in that counts calls and adds a fixed latency"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = 0
+        self.app = Starlette(routes=[Route("/token", self.token, methods=["POST"])])
+
+    async def token(self, request: Request):
+        self.calls += 1
+        form = await request.form()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if form.get("grant_type") == "refresh_token" and form.get("refresh_token") == "invalid":
+            return JSONResponse({"error": "invalid_grant"}, status_code=400)
+        return JSONResponse({
+            "access_token": f"stub-access-{self.calls}",
+            "refresh_token": f"stub-refresh-{self.calls}",
+            "expires_in": 3600,
+            "scope": "drive",
+        })
+
+    def transport(self) -> httpx.ASGITransport:
+        return httpx.ASGITransport(app=self.app)
+
+
+class StubDriveServer:
+    """Provider file API stand-in speaking the resumable upload protocol.
+
+    Only the access token in `valid_token` is accepted, so tests can expire
+    it to exercise refresh-and-retry. Files live in `files` by id; every
+    upload and delete_file call is appended to the changes feed.
+    """
+
+    def __init__(self, valid_token: Optional[str] = None, list_latency: float = 0.0):
+        self.valid_token = valid_token
+        self.list_latency = list_latency
+        self.files: Dict[str, bytes] = {}
+        self.names: Dict[str, str] = {}
+        self.changes: list = []
+        self.sessions: Dict[str, dict] = {}
+        self.unauthorized = 0
+        self.list_calls = 0
+        self.change_calls = 0
+        self.download_calls = 0
+        self.app = Starlette(routes=[
+            Route("/drive/v3/files", self.list_files, methods=["GET"]),
+            Route("/drive/v3/changes/startPageToken", self.start_page_token, methods=["GET"]),
+            Route("/drive/v3/changes", self.list_changes, methods=["GET"]),
+            Route("/drive/v3/files/{file_id}", self.download, methods=["GET"]),
+            Route("/upload/drive/v3/files", self.create_session, methods=["POST"]),
+            Route("/sessions/{session_id}", self.upload, methods=["PUT", "DELETE"]),
+        ])
+
+    def _authorized(self, request: Request) -> bool:
+        if self.valid_token is None or request.headers.get("authorization") == f"Bearer {self.valid_token}":
+            return True
+        self.unauthorized += 1
+        return False
+
+    def add_file(self, name: str, data: bytes) -> str:
+        file_id = uuid.uuid4().hex
+        self.files[file_id] = data
+        self.names[file_id] = name
+        self.changes.append({"fileId": file_id, "removed": False})
+        return file_id
+
+    def delete_file(self, file_id: str) -> None:
+        del self.files[file_id], self.names[file_id]
+        self.changes.append({"fileId": file_id, "removed": True})
+
+    def _file_resource(self, file_id: str) -> dict:
+        data = self.files[file_id]
+        return {"id": file_id, "name": self.names[file_id], "mimeType": "application/octet-stream",
+                "size": str(len(data)), "md5Checksum": hashlib.md5(data).hexdigest()}
+
+    async def list_files(self, request: Request):
+        if not self._authorized(request):
+            return Response(status_code=401)
+        self.list_calls += 1
+        if self.list_latency:
+            await asyncio.sleep(self.list_latency)
+        ids = sorted(self.files)
+        start = int(request.query_params.get("pageToken", "0"))
+        page_size = int(request.query_params.get("pageSize", "100"))
+        body = {"files": [self._file_resource(file_id) for file_id in ids[start:start + page_size]]}
+        if start + page_size < len(ids):
+            body["nextPageToken"] = str(start + page_size)
+        return JSONResponse(body)
+
+    async def start_page_token(self, request: Request):
+        if not self._authorized(request):
+            return Response(status_code=401)
+        return JSONResponse({"startPageToken": str(len(self.changes))})
+
+    async def list_changes(self, request: Request):
+        if not self._authorized(request):
+            return Response(status_code=401)
+        self.change_calls += 1
+        start = int(request.query_params["pageToken"])
+        changes = []
+        for change in self.changes[start:]:
+            if not change["removed"] and change["fileId"] in self.files:
+                change = {**change, "file": self._file_resource(change["fileId"])}
+            changes.append(change)
+        return JSONResponse({"changes": changes, "newStartPageToken": str(len(self.changes))})
+
+    async def download(self, request: Request):
+        if not self._authorized(request):
+            return Response(status_code=401)
+        self.download_calls += 1
+        data = self.files.get(request.path_params["file_id"])
+        if data is None:
+            return Response(status_code=404)
+
+        match = re.match(r"bytes=(\d+)-(\d*)", request.headers.get("range", ""))
+        if not match:
+            return Response(data, media_type="application/octet-stream")
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else len(data) - 1
+        return Response(
+            data[start:end + 1],
+            status_code=206,
+            media_type="application/octet-stream",
+            headers={"Content-Range": f"bytes {start}-{end}/{len(data)}"},
+        )
+
+    async def create_session(self, request: Request):
+        if not self._authorized(request):
+            return Response(status_code=401)
+        metadata = await request.json()
+        session_id = uuid.uuid4().hex
+        self.sessions[session_id] = {"name": metadata["name"], "data": bytearray()}
+        return Response(status_code=200, headers={"Location": f"http://stub-drive/sessions/{session_id}"})
+
+    async def upload(self, request: Request):
+        if not self._authorized(request):
+            # Like a real provider, reject before reading the body
+            return Response(status_code=401)
+        session = self.sessions.get(request.path_params["session_id"])
+        if session is None:
+            return Response(status_code=404)
+        if request.method == "DELETE":
+            del self.sessions[request.path_params["session_id"]]
+            return Response(status_code=204)
+
+        content_range = request.headers["content-range"]
+        total = int(content_range.rsplit("/", 1)[1])
+        if not content_range.startswith("bytes */"):
+            start = int(content_range[6:].split("-", 1)[0])
+            body = await request.body()
+            if start == len(session["data"]):
+                session["data"] += body
+
+        if len(session["data"]) == total:
+            file_id = self.add_file(session["name"], bytes(session["data"]))
+            return JSONResponse({"id": file_id, "name": session["name"], "size": total})
+        headers = {"Range": f"bytes=0-{len(session['data']) - 1}"} if session["data"] else {}
+        return Response(status_code=308, headers=headers)
+
+
+class RoutingTransport(httpx.AsyncBaseTransport):
+    """Sends each outbound request to the stub app registered for its host"""
+
+    def __init__(self, hosts: Dict[str, httpx.AsyncBaseTransport]):
+        self.hosts = hosts
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self.hosts[request.url.host].handle_async_request(request)
+
+
+# Undo the stub URLs start_services put in place, newest first
+_restore: List[Callable[[], None]] = []
+
+
+async def start_services(
+    db,
+    token_server: Optional[StubTokenServer] = None,
+    drive_server: Optional[StubDriveServer] = None,
+) -> None:
+    """The parts of the startup hook that make sense in-process.
+
+    Provider URLs pointed at the stubs are put back by stop_services.
+    """
+    from auth.oauth_helpers import OAUTH_CONFIG
+    from core.http_client import start_http_client
+    from core.indexes import ensure_indexes
+    from providers.adapters import GoogleDriveAdapter
+
+    await ensure_indexes(db)
+    hosts = {}
+    if token_server is not None:
+        for config in OAUTH_CONFIG.values():
+            _restore.append(functools.partial(config.__setitem__, "token_url", config["token_url"]))
+            config["token_url"] = "http://stub-oauth/token"
+        hosts["stub-oauth"] = token_server.transport()
+    if drive_server is not None:
+        for attribute in ("api_url", "upload_url"):
+            _restore.append(functools.partial(setattr, GoogleDriveAdapter, attribute, getattr(GoogleDriveAdapter, attribute)))
+            setattr(GoogleDriveAdapter, attribute, "http://stub-drive")
+        hosts["stub-drive"] = httpx.ASGITransport(app=drive_server.app)
+    if hosts:
+        await start_http_client(RoutingTransport(hosts))
+
+
+async def stop_services() -> None:
+    from core.http_client import close_http_client
+
+    await close_http_client()
+    while _restore:
+        _restore.pop()()
+
+
+def app_client() -> httpx.AsyncClient:
+    import server
+
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://bench")
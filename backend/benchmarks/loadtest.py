@@ -0,0 +1,237 @@
+"""
+Reproducible load test for the backend, run fully in-process.
+
+Boots the FastAPI app over ASGI against an in-memory Mongo stand-in and a stub
+OAuth token server, drives a weighted mix of operations at fixed concurrency and
+reports req/s plus p50/p95/p99 latency per operation. Results are written as
+JSON so runs can be compared across commits. Run from the backend directory:
+
+    python -m benchmarks.loadtest --mix mixed --concurrency 50 --operations 5000 \\
+        --output results/loadtest.json [--compare results/previous.json]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import random
+import subprocess
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+from benchmarks.harness import (
+    StubTokenServer,
+    app_client,
+    install_database,
+    mock_database,
+    start_services,
+    stop_services,
+)
+
+# Operation weights for each mix
+MIXES: Dict[str, Dict[str, int]] = {
+    "login_storm": {"login": 1},
+    "me_polling": {"me": 1},
+    "status_ingest": {"status_ingest": 1},
+    "status_list": {"status_list": 1},
+    "oauth_refresh": {"oauth_refresh": 1},
+    "mixed": {"me": 60, "status_ingest": 20, "status_list": 10, "login": 5, "oauth_refresh": 5},
+}
+
+PASSWORD = "load-test-password"
+
+
+class LoadTest:
+    def __init__(self, client: httpx.AsyncClient, db, users: int, seed: int):
+        self.client = client
+        self.db = db
+        self.users = users
+        self.random = random.Random(seed)
+        self.tokens: List[str] = []
+        self.user_ids: List[str] = []
+
+    async def setup(self) -> None:
+        """Create users (through the API, so hashes are real) and status checks to list"""
+        for i in range(self.users):
+            response = await self.client.post("/api/auth/signup", json={
+                "username": f"load-{i}", "email": f"load-{i}@example.com", "password": PASSWORD,
+            })
+            response.raise_for_status()
+            body = response.json()
+            self.tokens.append(body["access_token"])
+            self.user_ids.append(body["user"]["id"])
+
+        body = [{"client_name": f"agent-{i % 20}"} for i in range(500)]
+        (await self.client.post("/api/status/bulk", json=body)).raise_for_status()
+
+    async def login(self) -> int:
+        i = self.random.randrange(self.users)
+        response = await self.client.post("/api/auth/login", json={"username": f"load-{i}", "password": PASSWORD})
+        return response.status_code
+
+    async def me(self) -> int:
+        token = self.random.choice(self.tokens)
+        response = await self.client.get("/api/auth/me", headers={"Authorization": f"Bearer {token}"})
+        return response.status_code
+
+    async def status_ingest(self) -> int:
+        response = await self.client.post("/api/status", json={"client_name": f"agent-{self.random.randrange(20)}"})
+        return response.status_code
+
+    async def status_list(self) -> int:
+        response = await self.client.get("/api/status", params={"limit": 100})
+        return response.status_code
+
+    async def oauth_refresh(self) -> int:
+        """Expire a user's gdrive token and fetch it through OAuthTokenManager"""
+        from auth.oauth_helpers import OAuthTokenManager
+        from auth.user_cache import invalidate_user
+
+        user_id = self.random.choice(self.user_ids)
+        await self.db.users.update_one({"id": user_id}, {"$set": {"oauth_providers.gdrive": {
+            "access_token": "expired",
+            "refresh_token": "stub-refresh",
+            "expires_at": datetime.utcnow() - timedelta(seconds=1),
+            "scope": [],
+        }}})
+        invalidate_user(user_id=user_id)
+        token = await OAuthTokenManager(self.db).get_valid_token(user_id, "gdrive")
+        return 200 if token and token != "expired" else 502
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile of already sorted samples"""
+    if not samples:
+        return 0.0
+    index = max(0, min(len(samples) - 1, int(round(pct / 100 * len(samples) + 0.5)) - 1))
+    return samples[index]
+
+
+async def drive(test: LoadTest, mix: Dict[str, int], concurrency: int, operations: int) -> Dict[str, dict]:
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    plan = test.random.choices(names, weights=weights, k=operations)
+    latencies: Dict[str, List[float]] = {name: [] for name in names}
+    errors: Dict[str, int] = {name: 0 for name in names}
+    queue = iter(plan)
+
+    async def worker():
+        for name in queue:
+            operation: Callable[[], Awaitable[int]] = getattr(test, name)
+            started = time.perf_counter()
+            try:
+                status_code = await operation()
+            except Exception:
+                status_code = 599
+            latencies[name].append(time.perf_counter() - started)
+            if status_code >= 400:
+                errors[name] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    results = {}
+    for name in names:
+        samples = sorted(latencies[name])
+        if not samples:
+            continue
+        results[name] = {
+            "requests": len(samples),
+            "errors": errors[name],
+            "rps": len(samples) / elapsed,
+            "p50_ms": percentile(samples, 50) * 1000,
+            "p95_ms": percentile(samples, 95) * 1000,
+            "p99_ms": percentile(samples, 99) * 1000,
+        }
+    results["_total"] = {"requests": len(plan), "elapsed_s": elapsed, "rps": len(plan) / elapsed}
+    return results
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> dict:
+    db = mock_database()
+    install_database(db)
+    token_server = StubTokenServer(latency=args.token_latency_ms / 1000)
+    await start_services(db, token_server)
+    try:
+        async with app_client() as client:
+            test = LoadTest(client, db, users=args.users, seed=args.seed)
+            await test.setup()
+            results = await drive(test, MIXES[args.mix], args.concurrency, args.operations)
+    finally:
+        await stop_services()
+
+    return {
+        "revision": git_revision(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "config": {
+            "mix": args.mix,
+            "concurrency": args.concurrency,
+            "operations": args.operations,
+            "users": args.users,
+            "seed": args.seed,
+            "token_latency_ms": args.token_latency_ms,
+        },
+        "token_server_calls": token_server.calls,
+        "results": results,
+    }
+
+
+def print_report(report: dict, baseline: Optional[dict] = None) -> None:
+    print(f"revision {report['revision']}  mix {report['config']['mix']}  "
+          f"concurrency {report['config']['concurrency']}")
+    header = f"{'operation':<16}{'requests':>9}{'errors':>8}{'req/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+    if baseline:
+        header += f"{'req/s vs base':>15}"
+    print(header)
+    for name, stats in report["results"].items():
+        if name == "_total":
+            continue
+        line = (f"{name:<16}{stats['requests']:>9}{stats['errors']:>8}{stats['rps']:>10.0f}"
+                f"{stats['p50_ms']:>9.2f}{stats['p95_ms']:>9.2f}{stats['p99_ms']:>9.2f}")
+        base = (baseline or {}).get("results", {}).get(name)
+        if base:
+            line += f"{(stats['rps'] / base['rps'] - 1) * 100:>+14.1f}%"
+        print(line)
+    total = report["results"]["_total"]
+    print(f"total {total['requests']} operations in {total['elapsed_s']:.2f}s ({total['rps']:.0f} req/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--mix", choices=sorted(MIXES), default="mixed")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--operations", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--token-latency-ms", type=float, default=20.0)
+    parser.add_argument("--output", type=Path, help="Write the JSON report here")
+    parser.add_argument("--compare", type=Path, help="Previous JSON report to compare against")
+    args = parser.parse_args()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    report = asyncio.run(run(args))
+    baseline = json.loads(args.compare.read_text()) if args.compare else None
+    print_report(report, baseline)
+
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Cold-start report for a backend worker.
+
+Imports server in fresh interpreters with -X importtime, then runs the app
+lifespan against an in-memory Mongo stand-in, and reports the median time
+to import, the time until the app is ready to serve, and the modules and
+packages that cost the most. Results are written as JSON so runs can be
+compared across commits. Run from the backend directory:
+
+    python -m benchmarks.startup_report [--runs N] [--top N] \\
+        --output results/startup.json [--compare results/previous.json]
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+from benchmarks.loadtest import git_revision
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+IMPORTED_MARKER = "-- server imported --"
+
+# Runs in the child interpreter; prints the phase timings as JSON on stdout
+CHILD = """
+import asyncio, json, logging, sys, time
+started = time.perf_counter()
+import server
+imported = time.perf_counter()
+sys.stderr.write(%r + "\\n")
+sys.stderr.flush()
+logging.disable(logging.CRITICAL)
+from benchmarks.harness import mock_database
+
+async def start():
+    server.app.state.db = mock_database()
+    lifespan_started = time.perf_counter()
+    async with server.app.router.lifespan_context(server.app):
+        return time.perf_counter() - lifespan_started
+
+lifespan = asyncio.run(start())
+print(json.dumps({"import_ms": (imported - started) * 1000, "lifespan_ms": lifespan * 1000}))
+""" % IMPORTED_MARKER
+
+
+def parse_importtime(stderr: str) -> Dict[str, Dict[str, float]]:
+    """{module: {"self_ms", "cumulative_ms"}} from -X importtime output, up to the end of import server"""
+    modules = {}
+    for line in stderr.splitlines():
+        if line == IMPORTED_MARKER:
+            break
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = {
+            "self_ms": int(self_us) / 1000,
+            "cumulative_ms": int(cumulative_us) / 1000,
+        }
+    return modules
+
+
+def measure_once() -> dict:
+    env = dict(os.environ)
+    env.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    env.setdefault("DB_NAME", "startup-report")
+    # Background services would otherwise start polling during the lifespan
+    env.setdefault("OAUTH_REFRESH_SCHEDULER_ENABLED", "false")
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHILD],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    timings = json.loads(completed.stdout.strip().splitlines()[-1])
+    timings["modules"] = parse_importtime(completed.stderr)
+    return timings
+
+
+def run(args) -> dict:
+    samples = [measure_once() for _ in range(args.runs)]
+
+    module_names = set(samples[0]["modules"])
+    modules = {}
+    for name in module_names:
+        cumulative = [s["modules"][name]["cumulative_ms"] for s in samples if name in s["modules"]]
+        own = [s["modules"][name]["self_ms"] for s in samples if name in s["modules"]]
+        modules[name] = {"self_ms": statistics.median(own), "cumulative_ms": statistics.median(cumulative)}
+
+    packages: Dict[str, float] = defaultdict(float)
+    for name, timing in modules.items():
+        packages[name.split(".")[0]] += timing["self_ms"]
+
+    import_ms = statistics.median(s["import_ms"] for s in samples)
+    lifespan_ms = statistics.median(s["lifespan_ms"] for s in samples)
+    top_modules = sorted(
+        (name for name in modules if name != "server"), key=lambda n: modules[n]["cumulative_ms"], reverse=True
+    )[:args.top]
+    top_packages = sorted(packages, key=packages.get, reverse=True)[:args.top]
+
+    return {
+        "revision": git_revision(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "config": {"runs": args.runs},
+        "results": {
+            "import_ms": import_ms,
+            "lifespan_ms": lifespan_ms,
+            "ready_ms": import_ms + lifespan_ms,
+            "modules_imported": len(modules),
+            "top_modules": {name: modules[name] for name in top_modules},
+            "top_packages": {name: packages[name] for name in top_packages},
+        },
+    }
+
+
+def print_report(report: dict, baseline: Optional[dict] = None) -> None:
+    results = report["results"]
+    base = (baseline or {}).get("results", {})
+    print(f"revision {report['revision']}  runs {report['config']['runs']}  (medians)")
+    for key in ("import_ms", "lifespan_ms", "ready_ms"):
+        line = f"{key:<16}{results[key]:>10.1f}"
+        if key in base:
+            line += f"{results[key] - base[key]:>+10.1f}"
+        print(line)
+    print(f"{'modules':<16}{results['modules_imported']:>10}")
+
+    print(f"\n{'module':<40}{'cumulative ms':>15}{'self ms':>10}")
+    for name, timing in results["top_modules"].items():
+        print(f"{name:<40}{timing['cumulative_ms']:>15.1f}{timing['self_ms']:>10.1f}")
+
+    print(f"\n{'package':<40}{'self ms':>15}")
+    for name, self_ms in results["top_packages"].items():
+        print(f"{name:<40}{self_ms:>15.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--output", type=Path, help="Write the JSON report here")
+    parser.add_argument("--compare", type=Path, help="Previous JSON report to compare against")
+    args = parser.parse_args()
+
+    report = run(args)
+    baseline = json.loads(args.compare.read_text()) if args.compare else None
+    print_report(report, baseline)
+
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+"""
+Cross-worker invalidation of in-process caches through Mongo change streams
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure, PyMongoError
+
+from core.indexes import register_index
+
+logger = logging.getLogger(__name__)
+
+CACHE_COHERENCE_ENABLED = os.environ.get("CACHE_COHERENCE_ENABLED", "true").lower() == "true"
+CACHE_COHERENCE_RETRY_SECONDS = float(os.environ.get("CACHE_COHERENCE_RETRY_SECONDS", "1"))
+CACHE_COHERENCE_MAX_RETRY_SECONDS = float(os.environ.get("CACHE_COHERENCE_MAX_RETRY_SECONDS", "30"))
+# Resume tokens are persisted at most this often, and once more on shutdown
+CACHE_COHERENCE_CHECKPOINT_SECONDS = float(os.environ.get("CACHE_COHERENCE_CHECKPOINT_SECONDS", "5"))
+# Identifies this worker's checkpoint; set it to something stable (e.g. pod
+# name plus worker index) for a restarted worker to resume its stream
+CACHE_COHERENCE_WORKER_ID = os.environ.get("CACHE_COHERENCE_WORKER_ID", f"{socket.gethostname()}:{os.getpid()}")
+# Checkpoints of workers that stopped writing them are deleted after this long
+CACHE_COHERENCE_CHECKPOINT_TTL_SECONDS = int(os.environ.get("CACHE_COHERENCE_CHECKPOINT_TTL_SECONDS", "86400"))
+
+CHECKPOINT_COLLECTION = "cache_coherence_checkpoints"
+
+# The resume token fell out of the oplog; events since then are gone
+_HISTORY_LOST_CODES = {136, 280, 286}
+
+register_index(
+    CHECKPOINT_COLLECTION,
+    [("updated_at", ASCENDING)],
+    expireAfterSeconds=CACHE_COHERENCE_CHECKPOINT_TTL_SECONDS,
+    name="updated_at_ttl",
+)
+
+
+class _Subscription:
+    def __init__(
+        self,
+        invalidate: Callable[[Dict[str, Any]], None],
+        clear: Callable[[], None],
+        fields: Sequence[str],
+        ignore_fields: Sequence[str],
+        on_coherence: Optional[Callable[[bool], None]],
+    ):
+        self.invalidate = invalidate
+        self.clear = clear
+        self.fields = tuple(fields)
+        self.ignore_fields = frozenset(ignore_fields)
+        self.on_coherence = on_coherence
+
+
+class CacheInvalidator:
+    """Publishes change events on watched collections to the local caches registered for them.
+
+    Caches register per collection with an invalidate callback, which gets
+    the change event (with fullDocument trimmed to the registered fields),
+    and a clear callback for when events may have been missed. A single
+    change stream covers every registered collection. Its resume token is
+    kept after each event, so a dropped stream picks up where it left off,
+    and persisted per worker (throttled) in cache_coherence_checkpoints, so
+    a restarted worker resumes too; if the history is gone, every cache is
+    cleared instead.
+
+    Without change streams (a standalone mongod, or a driver that lacks
+    them) caches fall back to their TTLs: on_coherence(False) tells them to
+    keep entries briefly, and on_coherence(True) that they may keep them
+    longer.
+    """
+
+    def __init__(
+        self,
+        retry_seconds: float = CACHE_COHERENCE_RETRY_SECONDS,
+        max_retry_seconds: float = CACHE_COHERENCE_MAX_RETRY_SECONDS,
+        checkpoint_seconds: float = CACHE_COHERENCE_CHECKPOINT_SECONDS,
+        worker_id: str = CACHE_COHERENCE_WORKER_ID,
+    ):
+        self.retry_seconds = retry_seconds
+        self.max_retry_seconds = max_retry_seconds
+        self.checkpoint_seconds = checkpoint_seconds
+        self.worker_id = worker_id
+        self._subscriptions: Dict[str, List[_Subscription]] = {}
+        self._resume_token: Optional[Dict[str, Any]] = None
+        self._saved_token: Optional[Dict[str, Any]] = None
+        self._saved_at = 0.0
+        self._db = None
+        self._task: Optional[asyncio.Task] = None
+        self.coherent = False
+        self.unavailable = False
+
+        # Metrics
+        self.events = 0
+        self.ignored = 0
+        self.invalidations = 0
+        self.resumes = 0
+        self.history_lost = 0
+        self.errors = 0
+        self.checkpoints = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def register(
+        self,
+        collection: str,
+        invalidate: Callable[[Dict[str, Any]], None],
+        clear: Callable[[], None],
+        fields: Sequence[str] = (),
+        ignore_fields: Sequence[str] = (),
+        on_coherence: Optional[Callable[[bool], None]] = None,
+    ) -> None:
+        """Subscribe a cache to collection.
+
+        fields are the document fields invalidate needs from fullDocument;
+        updates that only touch ignore_fields are not published.
+        """
+        self._subscriptions.setdefault(collection, []).append(
+            _Subscription(invalidate, clear, fields, ignore_fields, on_coherence)
+        )
+
+    def _pipeline(self) -> List[Dict[str, Any]]:
+        projection = {"operationType": 1, "ns": 1, "documentKey": 1, "updateDescription": 1}
+        for subscriptions in self._subscriptions.values():
+            for subscription in subscriptions:
+                for field in subscription.fields:
+                    projection[f"fullDocument.{field}"] = 1
+        return [
+            {"$match": {"ns.coll": {"$in": sorted(self._subscriptions)}}},
+            {"$project": projection},
+        ]
+
+    def _set_coherent(self, coherent: bool) -> None:
+        if coherent == self.coherent:
+            return
+        self.coherent = coherent
+        for subscriptions in self._subscriptions.values():
+            for subscription in subscriptions:
+                if subscription.on_coherence is not None:
+                    subscription.on_coherence(coherent)
+
+    def _clear_all(self) -> None:
+        for subscriptions in self._subscriptions.values():
+            for subscription in subscriptions:
+                subscription.clear()
+
+    def publish(self, change: Dict[str, Any]) -> None:
+        """Hand one change event to the caches subscribed to its collection"""
+        self.events += 1
+        subscriptions = self._subscriptions.get(change.get("ns", {}).get("coll"), ())
+        update = change.get("updateDescription") if change.get("operationType") == "update" else None
+        touched = None
+        if update is not None:
+            touched = {path.split(".", 1)[0] for path in update.get("updatedFields", {})}
+            touched.update(path.split(".", 1)[0] for path in update.get("removedFields", []))
+
+        for subscription in subscriptions:
+            if touched is not None and touched and touched <= subscription.ignore_fields:
+                self.ignored += 1
+                continue
+            try:
+                subscription.invalidate(change)
+                self.invalidations += 1
+            except Exception:
+                logger.exception("Cache invalidation for %s failed", change.get("ns"))
+                subscription.clear()
+
+    def start(self, db) -> None:
+        if not CACHE_COHERENCE_ENABLED or not self._subscriptions or self._task is not None:
+            return
+        self.unavailable = False
+        self._db = db
+        self._task = asyncio.create_task(self._run(db), name="cache-invalidator")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._set_coherent(False)
+        await self._checkpoint(self._db, force=True)
+
+    async def _load_checkpoint(self, db) -> None:
+        if self._resume_token is not None:
+            return
+        try:
+            checkpoint = await db[CHECKPOINT_COLLECTION].find_one({"_id": self.worker_id})
+        except PyMongoError as e:
+            logger.warning("Could not load change stream checkpoint: %s", e)
+            return
+        if checkpoint is not None:
+            self._resume_token = self._saved_token = checkpoint.get("resume_token")
+
+    async def _checkpoint(self, db, force: bool = False) -> None:
+        """Persist the resume token, at most once per checkpoint_seconds unless forced"""
+        if db is None or self._resume_token is None or self._resume_token == self._saved_token:
+            return
+        if not force and time.monotonic() - self._saved_at < self.checkpoint_seconds:
+            return
+        token = self._resume_token
+        self._saved_at = time.monotonic()
+        try:
+            await db[CHECKPOINT_COLLECTION].update_one(
+                {"_id": self.worker_id},
+                {"$set": {"resume_token": token, "updated_at": datetime.utcnow()}},
+                upsert=True,
+            )
+        except PyMongoError as e:
+            # Only a restart needs it; the stream itself resumes from memory
+            logger.warning("Could not save change stream checkpoint: %s", e)
+            return
+        self._saved_token = token
+        self.checkpoints += 1
+
+    async def _run(self, db) -> None:
+        delay = self.retry_seconds
+        await self._load_checkpoint(db)
+        while True:
+            try:
+                async with db.watch(
+                    self._pipeline(), full_document="updateLookup", resume_after=self._resume_token
+                ) as stream:
+                    if self._resume_token is None:
+                        # Nothing tells us what changed before the stream opened
+                        self._clear_all()
+                    self._resume_token = stream.resume_token or self._resume_token
+                    self._set_coherent(True)
+                    delay = self.retry_seconds
+                    # Replaces a checkpoint the history may no longer reach
+                    await self._checkpoint(db, force=True)
+                    async for change in stream:
+                        self._resume_token = stream.resume_token
+                        self.publish(change)
+                        await self._checkpoint(db)
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                if e.code in _HISTORY_LOST_CODES:
+                    self.history_lost += 1
+                    logger.warning("Change stream history lost, clearing caches: %s", e)
+                    self._clear_all()
+                    self._resume_token = None
+                    continue
+                self._fall_back(e)
+                return
+            except PyMongoError as e:
+                self.errors += 1
+                logger.warning("Change stream interrupted, resuming in %.0fs: %s", delay, e)
+            except Exception as e:
+                self._fall_back(e)
+                return
+
+            # Resuming replays what changed meanwhile, so caches can stay as they are
+            self.resumes += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_retry_seconds)
+
+    def _fall_back(self, error: Exception) -> None:
+        self.unavailable = True
+        logger.warning("Change streams unavailable, caches rely on their TTLs: %s", error)
+        self._set_coherent(False)
+        self._task = None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "running": self.running,
+            "coherent": self.coherent,
+            "unavailable": self.unavailable,
+            "events": self.events,
+            "ignored": self.ignored,
+            "invalidations": self.invalidations,
+            "resumes": self.resumes,
+            "history_lost": self.history_lost,
+            "errors": self.errors,
+            "checkpoints": self.checkpoints,
+        }
+
+
+cache_invalidator = CacheInvalidator()
@@ -0,0 +1,86 @@
+"""
+Shared, connection-pooled HTTP client for outbound provider calls
+"""
+import logging
+import os
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    import httpx
+
+logger = logging.getLogger(__name__)
+
+HTTP_CLIENT_TIMEOUT = float(os.environ.get("HTTP_CLIENT_TIMEOUT", "10"))
+HTTP_CLIENT_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CLIENT_CONNECT_TIMEOUT", "5"))
+HTTP_CLIENT_MAX_CONNECTIONS = int(os.environ.get("HTTP_CLIENT_MAX_CONNECTIONS", "100"))
+HTTP_CLIENT_MAX_KEEPALIVE = int(os.environ.get("HTTP_CLIENT_MAX_KEEPALIVE", "20"))
+HTTP_CLIENT_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_CLIENT_KEEPALIVE_EXPIRY", "30"))
+# Connection-level retries only (refused/reset before the request was sent),
+# so non-idempotent token requests are never sent twice
+HTTP_CLIENT_RETRIES = int(os.environ.get("HTTP_CLIENT_RETRIES", "2"))
+HTTP_CLIENT_HTTP2 = os.environ.get("HTTP_CLIENT_HTTP2", "false").lower() == "true"
+
+_client: Optional["httpx.AsyncClient"] = None
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def create_http_client(transport: Optional["httpx.AsyncBaseTransport"] = None) -> "httpx.AsyncClient":
+    """Build a client with the configured pool limits, timeouts and retries"""
+    # httpx is imported with the first client rather than at worker boot
+    import httpx
+
+    if transport is None:
+        http2 = HTTP_CLIENT_HTTP2
+        if http2 and not _http2_available():
+            logger.warning("HTTP_CLIENT_HTTP2 is set but the h2 package is not installed, using HTTP/1.1")
+            http2 = False
+
+        transport = httpx.AsyncHTTPTransport(
+            http2=http2,
+            retries=HTTP_CLIENT_RETRIES,
+            limits=httpx.Limits(
+                max_connections=HTTP_CLIENT_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_CLIENT_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_CLIENT_KEEPALIVE_EXPIRY,
+            ),
+        )
+
+    return httpx.AsyncClient(
+        transport=transport,
+        timeout=httpx.Timeout(HTTP_CLIENT_TIMEOUT, connect=HTTP_CLIENT_CONNECT_TIMEOUT),
+    )
+
+
+async def start_http_client(transport: Optional["httpx.AsyncBaseTransport"] = None) -> "httpx.AsyncClient":
+    """Create the shared client up front instead of on first use.
+
+    Passing a transport (e.g. httpx.ASGITransport around a stub token server)
+    routes every outbound call through it.
+    """
+    global _client
+    if _client is not None:
+        await _client.aclose()
+    _client = create_http_client(transport)
+    return _client
+
+
+def get_http_client() -> "httpx.AsyncClient":
+    """Return the shared client, creating it on first use"""
+    global _client
+    if _client is None:
+        _client = create_http_client()
+    return _client
+
+
+async def close_http_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
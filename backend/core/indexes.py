@@ -0,0 +1,165 @@
+"""
+Index bootstrap and query-shape audit for the Mongo collections used by the backend
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# Build indexes without blocking startup (and with the legacy background flag
+# for servers older than 4.2, which ignore it otherwise)
+MONGO_INDEX_BUILD_BACKGROUND = os.environ.get("MONGO_INDEX_BUILD_BACKGROUND", "false").lower() == "true"
+# Dev mode: explain() every registered query shape at startup and fail on COLLSCAN
+MONGO_QUERY_AUDIT = os.environ.get("MONGO_QUERY_AUDIT", "false").lower() == "true"
+
+# collection -> index models
+INDEXES: Dict[str, List[IndexModel]] = {}
+# collection -> index models the app is not safe to serve without
+REQUIRED_INDEXES: Dict[str, List[IndexModel]] = {}
+
+# Query shapes the backend issues, with representative values, for the audit
+QUERY_SHAPES: List[Dict[str, Any]] = []
+
+_bootstrap_task: Optional[asyncio.Task] = None
+
+
+def register_index(collection: str, keys, required: bool = False, **options) -> None:
+    """Declare an index that ensure_indexes must create.
+
+    Startup fails when a required index cannot be created, e.g. a unique
+    index that writes rely on to reject duplicates.
+    """
+    registry = REQUIRED_INDEXES if required else INDEXES
+    registry.setdefault(collection, []).append(IndexModel(keys, **options))
+
+
+def register_query_shape(
+    name: str,
+    collection: str,
+    filter: Dict[str, Any],
+    sort: Optional[List] = None,
+    projection: Optional[Dict[str, Any]] = None,
+) -> None:
+    """Declare a query shape that must be served by an index"""
+    QUERY_SHAPES.append({
+        "name": name,
+        "collection": collection,
+        "filter": filter,
+        "sort": sort,
+        "projection": projection,
+    })
+
+
+# Signup has no pre-check: these indexes are what rejects duplicate accounts
+register_index("users", [("username", ASCENDING)], required=True, unique=True, name="username_unique")
+register_index("users", [("email", ASCENDING)], required=True, unique=True, name="email_unique")
+register_index("users", [("id", ASCENDING)], required=True, unique=True, name="id_unique")
+register_index("status_checks", [("timestamp", ASCENDING), ("id", ASCENDING)], name="timestamp_id")
+
+register_query_shape("users by username", "users", {"username": "audit"})
+register_query_shape("users by id", "users", {"id": "audit"})
+register_query_shape(
+    "status checks page",
+    "status_checks",
+    {"$or": [
+        {"timestamp": {"$gt": datetime(2000, 1, 1)}},
+        {"timestamp": datetime(2000, 1, 1), "id": {"$gt": "audit"}},
+    ]},
+    sort=[("timestamp", ASCENDING), ("id", ASCENDING)],
+)
+
+
+async def ensure_required_indexes(db) -> None:
+    """Create the required indexes; raises if any of them cannot be built"""
+    for collection, models in REQUIRED_INDEXES.items():
+        try:
+            await db[collection].create_indexes(models)
+        except OperationFailure as e:
+            # Typically duplicates already in the data; serving would let more in
+            raise RuntimeError(
+                f"Required indexes on {collection} could not be created, fix the data and restart: {e}"
+            ) from e
+
+
+async def ensure_optional_indexes(db) -> None:
+    """Create the other registered indexes; failures are logged, not raised"""
+    for collection, models in INDEXES.items():
+        if MONGO_INDEX_BUILD_BACKGROUND:
+            for model in models:
+                model.document.setdefault("background", True)
+        try:
+            await db[collection].create_indexes(models)
+        except OperationFailure:
+            # The app works without them, only slower; let the operator fix the data
+            logger.exception("Failed to create indexes on %s", collection)
+
+
+async def ensure_indexes(db) -> None:
+    """Create every registered index; existing indexes are left untouched"""
+    await ensure_required_indexes(db)
+    await ensure_optional_indexes(db)
+
+
+def _plan_stages(plan: Dict[str, Any]):
+    yield plan.get("stage")
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from _plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _plan_stages(child)
+
+
+async def audit_query_shapes(db) -> None:
+    """Run explain() on every registered query shape and raise if any scans a collection"""
+    offenders = []
+    for shape in QUERY_SHAPES:
+        command = {"find": shape["collection"], "filter": shape["filter"]}
+        if shape["sort"]:
+            command["sort"] = dict(shape["sort"])
+        if shape["projection"]:
+            command["projection"] = shape["projection"]
+
+        explained = await db.command("explain", command, verbosity="queryPlanner")
+        winning_plan = explained["queryPlanner"]["winningPlan"]
+        if "COLLSCAN" in set(_plan_stages(winning_plan)):
+            offenders.append(f"{shape['name']} ({shape['collection']}: {shape['filter']})")
+
+    if offenders:
+        raise RuntimeError("Query shapes without a supporting index: " + "; ".join(offenders))
+    logger.info("Query audit passed for %d shapes", len(QUERY_SHAPES))
+
+
+async def bootstrap_indexes(db) -> Optional[asyncio.Task]:
+    """Startup entry point: create indexes (optionally in the background) and run the audit"""
+    global _bootstrap_task
+    if MONGO_INDEX_BUILD_BACKGROUND and not MONGO_QUERY_AUDIT:
+        # Only the required indexes hold up startup
+        await ensure_required_indexes(db)
+        _bootstrap_task = asyncio.create_task(ensure_optional_indexes(db), name="mongo-index-bootstrap")
+        return _bootstrap_task
+
+    await ensure_indexes(db)
+    if MONGO_QUERY_AUDIT:
+        await audit_query_shapes(db)
+    return None
+
+
+async def stop_index_bootstrap() -> None:
+    """Cancel a background index build still running at shutdown and wait for it"""
+    global _bootstrap_task
+    task, _bootstrap_task = _bootstrap_task, None
+    if task is None:
+        return
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    except Exception:
+        logger.exception("Background index build failed")
@@ -0,0 +1,259 @@
+"""
+Queued, structured logging: records are handed to a background thread for
+formatting and output, so logging never writes to the stream from the event loop
+"""
+import atexit
+import contextvars
+import logging
+import os
+import queue
+import re
+import time
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional, Tuple
+
+import orjson
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")  # json | text
+# Records waiting for the writer thread; beyond this they are dropped, never waited on
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+# Warnings and errors from one call site: LOG_SAMPLE_BURST per LOG_SAMPLE_WINDOW_SECONDS
+LOG_SAMPLE_BURST = int(os.environ.get("LOG_SAMPLE_BURST", "10"))
+LOG_SAMPLE_WINDOW_SECONDS = float(os.environ.get("LOG_SAMPLE_WINDOW_SECONDS", "60"))
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+REQUEST_ID_HEADER = b"x-request-id"
+
+# Client supplied request ids are echoed back and logged, so keep them tame
+_REQUEST_ID_RE = re.compile(r"[A-Za-z0-9._:-]{1,64}")
+
+# Attributes every LogRecord has; anything else was passed with extra=
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+_CONTEXT_FIELDS = ("request_id", "route", "latency_ms", "suppressed")
+
+
+class RequestContext:
+    __slots__ = ("request_id", "scope", "started")
+
+    def __init__(self, request_id: str, scope: Dict[str, Any], started: float):
+        self.request_id = request_id
+        self.scope = scope
+        self.started = started
+
+    @property
+    def route(self) -> str:
+        # The router sets the matched route on the scope; the template keeps logs groupable
+        route = self.scope.get("route")
+        return getattr(route, "path", None) or self.scope.get("path", "")
+
+
+_request_context: contextvars.ContextVar[Optional[RequestContext]] = contextvars.ContextVar("request_context", default=None)
+
+
+def current_request_id() -> Optional[str]:
+    context = _request_context.get()
+    return context.request_id if context is not None else None
+
+
+class RequestContextMiddleware:
+    """ASGI middleware giving each request an id, echoed in X-Request-ID.
+
+    The id comes from the client's X-Request-ID when it sends a sane one.
+    Records logged while the request is served carry its id, route and the
+    milliseconds elapsed since it arrived.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == REQUEST_ID_HEADER:
+                request_id = value.decode("latin-1")
+                break
+        if request_id is None or not _REQUEST_ID_RE.fullmatch(request_id):
+            request_id = uuid.uuid4().hex
+        header = (REQUEST_ID_HEADER, request_id.encode("latin-1"))
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": [*message.get("headers", ()), header]}
+            await send(message)
+
+        token = _request_context.set(RequestContext(request_id, scope, time.perf_counter()))
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_context.reset(token)
+
+
+class ErrorSampler(logging.Filter):
+    """Lets through burst records per call site every window seconds, at level and above.
+
+    Call sites are (file, line, level), so a provider outage logging the
+    same failure for every request costs a dict lookup per record once its
+    burst is spent. The first record of the next window carries how many
+    were suppressed. Records below level always pass.
+    """
+
+    def __init__(
+        self,
+        burst: int = LOG_SAMPLE_BURST,
+        window: float = LOG_SAMPLE_WINDOW_SECONDS,
+        level: int = logging.WARNING,
+        max_sites: int = 1024,
+    ):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.level = level
+        self.max_sites = max_sites
+        # call site -> [window start, records in window, suppressed in window]
+        self._sites: Dict[Tuple[str, int, int], list] = {}
+
+        # Metrics
+        self.suppressed = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < self.level or self.burst <= 0:
+            return True
+
+        now = time.monotonic()
+        key = (record.pathname, record.lineno, record.levelno)
+        site = self._sites.get(key)
+        if site is None:
+            if len(self._sites) >= self.max_sites:
+                self._sites = {k: s for k, s in self._sites.items() if now - s[0] < self.window}
+                if len(self._sites) >= self.max_sites:
+                    self._sites.clear()
+            self._sites[key] = [now, 1, 0]
+            return True
+
+        if now - site[0] >= self.window:
+            if site[2]:
+                record.suppressed = site[2]
+            site[:] = [now, 1, 0]
+            return True
+
+        if site[1] < self.burst:
+            site[1] += 1
+            return True
+
+        site[2] += 1
+        self.suppressed += 1
+        return False
+
+
+class BackgroundQueueHandler(QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread and never blocks.
+
+    The stock handler formats the message before queueing it; here the
+    record only picks up the request context, and getMessage runs on the
+    writer thread. Arguments must therefore not be mutated after logging
+    them, which holds for the ids and exceptions logged here. A full queue
+    drops the record.
+    """
+
+    def __init__(self, log_queue: "queue.Queue"):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        context = _request_context.get()
+        if context is not None:
+            record.request_id = context.request_id
+            record.route = context.route
+            record.latency_ms = round((time.perf_counter() - context.started) * 1000, 3)
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _Listener(QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # Only at shutdown: wait for room rather than lose the stop signal
+        self.queue.put(self._sentinel)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: timestamp, level, logger, message, request context and extra= fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in _CONTEXT_FIELDS:
+            value = record.__dict__.get(field)
+            if value is not None:
+                entry[field] = value
+        for field, value in record.__dict__.items():
+            if field not in _RECORD_ATTRIBUTES and field not in entry:
+                entry[field] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack_info"] = self.formatStack(record.stack_info)
+        return orjson.dumps(entry, default=str).decode()
+
+
+error_sampler = ErrorSampler()
+_handler: Optional[BackgroundQueueHandler] = None
+_listener: Optional[QueueListener] = None
+
+
+def configure_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT) -> None:
+    """Route the root logger through the background writer.
+
+    Like logging.basicConfig, does nothing when the root logger already has
+    handlers (e.g. configured by the process running the app).
+    """
+    global _handler, _listener
+    root = logging.getLogger()
+    if root.handlers:
+        return
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+
+    _handler = BackgroundQueueHandler(queue.Queue(maxsize=max(1, LOG_QUEUE_SIZE)))
+    _handler.addFilter(error_sampler)
+    _listener = _Listener(_handler.queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+    root.addHandler(_handler)
+    root.setLevel(level)
+    atexit.register(stop_logging)
+
+
+def stop_logging() -> None:
+    """Write out what is still queued and stop the writer thread"""
+    global _handler, _listener
+    if _listener is None:
+        return
+    logging.getLogger().removeHandler(_handler)
+    _listener.stop()
+    _listener = None
+    _handler = None
+
+
+def log_stats() -> Dict[str, int]:
+    return {
+        "queued": _handler.queue.qsize() if _handler is not None else 0,
+        "dropped": _handler.dropped if _handler is not None else 0,
+        "suppressed": error_sampler.suppressed,
+    }
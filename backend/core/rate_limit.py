@@ -0,0 +1,354 @@
+"""
+Token-bucket admission control for the auth and ingest endpoints
+"""
+import ipaddress
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import orjson
+from pymongo import ASCENDING, ReturnDocument
+
+from core.indexes import register_index
+from core.metrics import span
+
+logger = logging.getLogger(__name__)
+
+# Off unless enabled: behind a proxy not listed in RATE_LIMIT_TRUSTED_PROXIES,
+# every anonymous client would share the proxy's IP bucket
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "false").lower() == "true"
+RATE_LIMIT_STORE = os.environ.get("RATE_LIMIT_STORE", "memory")  # memory | mongo
+RATE_LIMIT_MAX_BUCKETS = int(os.environ.get("RATE_LIMIT_MAX_BUCKETS", "100000"))
+# Comma separated proxy addresses or networks (e.g. 10.0.0.0/8) whose
+# X-Forwarded-For is believed; the client IP is the last address not in the list
+RATE_LIMIT_TRUSTED_PROXIES = [
+    entry.strip() for entry in os.environ.get("RATE_LIMIT_TRUSTED_PROXIES", "").split(",") if entry.strip()
+]
+# Largest login body read to find the username before routing
+RATE_LIMIT_MAX_BODY_BYTES = 4096
+
+# Route class -> (tokens per second, burst)
+RATE_LIMITS: Dict[str, Tuple[float, int]] = {
+    "auth": (
+        float(os.environ.get("RATE_LIMIT_AUTH_RATE", "0.5")),
+        int(os.environ.get("RATE_LIMIT_AUTH_BURST", "10")),
+    ),
+    "refresh": (
+        float(os.environ.get("RATE_LIMIT_REFRESH_RATE", "1")),
+        int(os.environ.get("RATE_LIMIT_REFRESH_BURST", "20")),
+    ),
+    "ingest": (
+        float(os.environ.get("RATE_LIMIT_INGEST_RATE", "50")),
+        int(os.environ.get("RATE_LIMIT_INGEST_BURST", "200")),
+    ),
+}
+
+# (method, path) -> route class. Matched before routing, so paths are exact.
+LIMITED_ROUTES: Dict[Tuple[str, str], str] = {
+    ("POST", "/api/auth/login"): "auth",
+    ("POST", "/api/auth/signup"): "auth",
+    ("POST", "/api/auth/refresh"): "refresh",
+    ("POST", "/api/status"): "ingest",
+    ("POST", "/api/status/bulk"): "ingest",
+}
+
+# (method, path) -> JSON body field with a bucket of its own, checked on top of
+# the client's: logins are throttled per IP and per username
+BODY_KEYED_ROUTES: Dict[Tuple[str, str], str] = {
+    ("POST", "/api/auth/login"): "username",
+}
+
+Network = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+
+def parse_networks(entries: Sequence[str]) -> List[Network]:
+    networks = []
+    for entry in entries:
+        try:
+            networks.append(ipaddress.ip_network(entry, strict=False))
+        except ValueError:
+            logger.warning("Ignoring invalid trusted proxy %r", entry)
+    return networks
+
+# Database will be injected from main app
+db = None
+
+if RATE_LIMIT_STORE == "mongo":
+    register_index("rate_limits", [("expires_at", ASCENDING)], expireAfterSeconds=0, name="expires_at_ttl")
+
+
+class TokenBucketLimiter:
+    """In-process token buckets, one per (route class, key).
+
+    A bucket holds up to burst tokens and refills at rate tokens per second;
+    each request takes one. Buckets live in an LRU bounded to max_buckets. A
+    bucket idle for burst / rate seconds is full again, so dropping it loses
+    nothing; those are purged as new buckets come in.
+    """
+
+    def __init__(self, limits: Dict[str, Tuple[float, int]] = RATE_LIMITS, max_buckets: int = RATE_LIMIT_MAX_BUCKETS):
+        self.limits = limits
+        self.max_buckets = max(1, max_buckets)
+        # (route class, key) -> (tokens, last update), least recently used first
+        self._buckets: "OrderedDict[Tuple[str, str], Tuple[float, float]]" = OrderedDict()
+
+        # Metrics
+        self.allowed = 0
+        self.rejected = 0
+        self.evictions = 0
+
+    def acquire(self, route_class: str, key: str) -> float:
+        """Take a token; returns 0 when allowed, else the seconds until one is available"""
+        rate, burst = self.limits[route_class]
+        now = time.monotonic()
+        bucket_key = (route_class, key)
+        entry = self._buckets.get(bucket_key)
+        if entry is None:
+            tokens = float(burst)
+            self._purge(now)
+        else:
+            tokens = min(float(burst), entry[0] + (now - entry[1]) * rate)
+            self._buckets.move_to_end(bucket_key)
+
+        if tokens >= 1:
+            self._buckets[bucket_key] = (tokens - 1, now)
+            self.allowed += 1
+            return 0.0
+
+        self._buckets[bucket_key] = (tokens, now)
+        self.rejected += 1
+        return (1 - tokens) / rate if rate > 0 else float("inf")
+
+    def _purge(self, now: float) -> None:
+        """Drop refilled buckets from the LRU end, then the oldest if still over capacity"""
+        while self._buckets:
+            (route_class, _), (tokens, updated) = next(iter(self._buckets.items()))
+            rate, burst = self.limits[route_class]
+            if rate <= 0 or tokens + (now - updated) * rate < burst:
+                break
+            self._buckets.popitem(last=False)
+        while len(self._buckets) >= self.max_buckets:
+            self._buckets.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "buckets": len(self._buckets),
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+            "evictions": self.evictions,
+        }
+
+
+class MongoWindowLimiter:
+    """Limits shared by all workers, as fixed-window counters in the rate_limits collection.
+
+    A window lasts burst / rate seconds and admits burst requests, which is
+    the token bucket's long-run rate with the same burst. Each check is one
+    atomic upsert; expired windows are removed by a TTL index.
+    """
+
+    def __init__(self, limits: Dict[str, Tuple[float, int]] = RATE_LIMITS):
+        self.limits = limits
+
+        # Metrics
+        self.allowed = 0
+        self.rejected = 0
+        self.failures = 0
+
+    async def acquire(self, route_class: str, key: str) -> float:
+        rate, burst = self.limits[route_class]
+        if rate <= 0:
+            return float("inf")
+        window = burst / rate
+        now = time.time()
+        window_start = math.floor(now / window) * window
+        window_end = window_start + window
+
+        try:
+            with span("mongo.rate_limits.find_one_and_update"):
+                doc = await db.rate_limits.find_one_and_update(
+                    {"_id": f"{route_class}:{key}:{int(window_start)}"},
+                    {
+                        "$inc": {"count": 1},
+                        "$setOnInsert": {"expires_at": datetime.utcfromtimestamp(window_end) + timedelta(seconds=60)},
+                    },
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER,
+                )
+        except Exception:
+            # The local buckets still apply; do not turn a database hiccup into an outage
+            self.failures += 1
+            logger.exception("Shared rate limit check failed")
+            return 0.0
+
+        if doc["count"] <= burst:
+            self.allowed += 1
+            return 0.0
+        self.rejected += 1
+        return window_end - now
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "shared_allowed": self.allowed,
+            "shared_rejected": self.rejected,
+            "shared_failures": self.failures,
+        }
+
+
+class RateLimitMiddleware:
+    """ASGI middleware answering 429 with Retry-After before the request reaches a route.
+
+    Requests are keyed by the JWT subject when their bearer token was
+    already verified (subject_resolver looks it up without decoding), else
+    by client IP. The client IP is taken from X-Forwarded-For only when the
+    connection comes from a trusted proxy. Routes in body_keyed also take a
+    token from a bucket keyed by a field of their JSON body: logins count
+    per IP and per username, so cycling usernames does not earn a client
+    fresh bursts and spreading guesses over addresses does not either.
+    Rejections cost a dict lookup, so overload is shed before any hashing or
+    database work. In shared mode the local bucket is checked first, then
+    the cross-worker window in Mongo.
+    """
+
+    def __init__(
+        self,
+        app,
+        limiter: TokenBucketLimiter,
+        shared: Optional[MongoWindowLimiter] = None,
+        subject_resolver: Optional[Callable[[str], Optional[str]]] = None,
+        routes: Dict[Tuple[str, str], str] = LIMITED_ROUTES,
+        body_keyed: Dict[Tuple[str, str], str] = BODY_KEYED_ROUTES,
+        trusted_proxies: Sequence[str] = RATE_LIMIT_TRUSTED_PROXIES,
+    ):
+        self.app = app
+        self.limiter = limiter
+        self.shared = shared
+        self.subject_resolver = subject_resolver
+        self.routes = routes
+        self.body_keyed = body_keyed
+        self.trusted_proxies = parse_networks(trusted_proxies)
+
+    def _is_trusted(self, address: str) -> bool:
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        return any(ip in network for network in self.trusted_proxies)
+
+    def _client_ip(self, scope, forwarded: Optional[str]) -> str:
+        client = scope.get("client")
+        peer = client[0] if client else "unknown"
+        if not forwarded or not self.trusted_proxies or not self._is_trusted(peer):
+            return peer
+        # Proxies append; walk back past our own to the address that reached them
+        hops = [hop.strip() for hop in forwarded.split(",") if hop.strip()]
+        for hop in reversed(hops):
+            if not self._is_trusted(hop):
+                return hop
+        return hops[0] if hops else peer
+
+    def _key(self, scope) -> str:
+        authorization = None
+        forwarded = None
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                authorization = value.decode("latin-1")
+            elif name == b"x-forwarded-for":
+                forwarded = value.decode("latin-1")
+
+        if authorization and self.subject_resolver is not None and authorization[:7].lower() == "bearer ":
+            subject = self.subject_resolver(authorization[7:])
+            if subject is not None:
+                return f"user:{subject}"
+
+        return f"ip:{self._client_ip(scope, forwarded)}"
+
+    @staticmethod
+    async def _read_body(receive) -> Tuple[bytes, List[dict]]:
+        """Read the request body, keeping the messages so the app can receive them again"""
+        messages = []
+        body = b""
+        while True:
+            message = await receive()
+            messages.append(message)
+            if message["type"] != "http.request":
+                break
+            body += message.get("body", b"")
+            if not message.get("more_body") or len(body) > RATE_LIMIT_MAX_BODY_BYTES:
+                break
+        return body, messages
+
+    @staticmethod
+    def _body_field(body: bytes, field: str) -> Optional[str]:
+        if len(body) > RATE_LIMIT_MAX_BODY_BYTES:
+            return None
+        try:
+            value = orjson.loads(body).get(field)
+        except (orjson.JSONDecodeError, AttributeError):
+            return None
+        return value.lower() if isinstance(value, str) else None
+
+    async def _acquire(self, route_class: str, key: str) -> float:
+        retry_after = self.limiter.acquire(route_class, key)
+        if not retry_after and self.shared is not None:
+            retry_after = await self.shared.acquire(route_class, key)
+        return retry_after
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        route_class = self.routes.get((scope["method"], scope["path"].rstrip("/") or "/"))
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        keys = [self._key(scope)]
+        body_field = self.body_keyed.get((scope["method"], scope["path"].rstrip("/") or "/"))
+        if body_field is not None:
+            receive_body = receive
+            body, messages = await self._read_body(receive_body)
+            value = self._body_field(body, body_field)
+            if value is not None:
+                keys.append(f"{body_field}:{value}")
+
+            async def receive():
+                return messages.pop(0) if messages else await receive_body()
+
+        retry_after = 0.0
+        for key in keys:
+            retry_after = await self._acquire(route_class, key)
+            if retry_after:
+                break
+        if not retry_after:
+            await self.app(scope, receive, send)
+            return
+
+        body = orjson.dumps({"detail": "Muitas requisições, tente novamente em instantes"})
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(min(retry_after, 3600)))).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+rate_limiter = TokenBucketLimiter()
+shared_rate_limiter = MongoWindowLimiter() if RATE_LIMIT_STORE == "mongo" else None
+
+
+def rate_limit_stats() -> Dict[str, int]:
+    stats = rate_limiter.stats()
+    if shared_rate_limiter is not None:
+        stats.update(shared_rate_limiter.stats())
+    return stats
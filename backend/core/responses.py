@@ -0,0 +1,44 @@
+"""
+Fast JSON responses: orjson for plain content, Pydantic's own serializer for models
+"""
+from typing import Any, Dict, Optional
+
+from fastapi.responses import ORJSONResponse, Response
+from pydantic import BaseModel
+
+# App-wide default response class; orjson handles datetime and UUID natively
+FastJSONResponse = ORJSONResponse
+
+
+class PreSerializedJSONResponse(Response):
+    """JSON response whose body was already serialized (e.g. by model_dump_json)"""
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return content if isinstance(content, bytes) else content.encode("utf-8")
+
+
+def model_response(
+    model: BaseModel, status_code: int = 200, headers: Optional[Dict[str, str]] = None
+) -> PreSerializedJSONResponse:
+    """Serialize a model we just built without response_model re-validating it"""
+    return PreSerializedJSONResponse(model.__pydantic_serializer__.to_json(model), status_code=status_code, headers=headers)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header covers etag (weak comparison, as RFC 9110 asks for GET)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    return any(
+        (candidate[2:] if candidate.startswith("W/") else candidate) == opaque
+        for candidate in (part.strip() for part in if_none_match.split(","))
+    )
+
+
+def not_modified(etag: str, headers: Optional[Dict[str, str]] = None) -> Response:
+    """304 for a conditional GET, skipping serialization of the body entirely"""
+    return Response(status_code=304, headers={**(headers or {}), "ETag": etag})
@@ -0,0 +1,193 @@
+"""
+Provider adapters and credential lookup for connected accounts
+"""
+import os
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple, Type
+from urllib.parse import quote
+
+from auth.models import User
+from core.metrics import span
+from .base import Authorization, ProviderAdapter, ProviderError
+
+if TYPE_CHECKING:
+    from auth.oauth_helpers import OAuthTokenManager
+
+# Base URLs are configurable so tests can point them at local fake servers
+GDRIVE_API_URL = os.environ.get("GDRIVE_API_URL", "https://www.googleapis.com")
+GDRIVE_UPLOAD_URL = os.environ.get("GDRIVE_UPLOAD_URL", "https://www.googleapis.com")
+PROTON_API_URL = os.environ.get("PROTON_API_URL", "https://drive-api.proton.me")  # Placeholder URL
+TERABOX_API_URL = os.environ.get("TERABOX_API_URL", "https://terabox.com")  # Placeholder URL
+# Providers whose file routes are served. The Proton and Terabox adapters call
+# placeholder endpoints, so they stay off until pointed at a working API.
+FILE_PROVIDERS = [
+    name.strip() for name in os.environ.get("FILE_PROVIDERS", "gdrive").split(",") if name.strip()
+]
+
+GDRIVE_FILE_FIELDS = "id,name,mimeType,size,modifiedTime,md5Checksum,trashed"
+GDRIVE_PAGE_SIZE = 1000
+
+
+class GoogleDriveAdapter(ProviderAdapter):
+    """Listings are kept current with the Drive changes feed instead of ETags"""
+
+    name = "gdrive"
+    api_url = GDRIVE_API_URL
+    upload_url = GDRIVE_UPLOAD_URL
+
+    def download_url(self, file_id: str) -> str:
+        return f"{self.api_url}/drive/v3/files/{quote(file_id, safe='')}?alt=media"
+
+    def list_request(self, page_token: Optional[str]) -> Tuple[str, Dict[str, Any]]:
+        params = {
+            "pageSize": GDRIVE_PAGE_SIZE,
+            "q": "trashed = false",
+            "fields": f"nextPageToken,files({GDRIVE_FILE_FIELDS})",
+        }
+        if page_token:
+            params["pageToken"] = page_token
+        return f"{self.api_url}/drive/v3/files", params
+
+    def parse_listing(self, body: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        return body.get("files", []), body.get("nextPageToken")
+
+    def normalize_file(self, raw: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "id": raw["id"],
+            "name": raw.get("name"),
+            "mime_type": raw.get("mimeType"),
+            "size": int(raw["size"]) if raw.get("size") is not None else None,
+            "modified_at": raw.get("modifiedTime"),
+            "md5": raw.get("md5Checksum"),
+        }
+
+    async def sync_listing(self, listing: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        if listing and listing.get("changes_token"):
+            try:
+                return await self._apply_changes(listing)
+            except ProviderError as e:
+                if e.status_code not in (400, 404, 410):
+                    raise
+                # The changes token is no longer valid; start over
+
+        # Take the token before listing so changes made meanwhile are replayed
+        response = await self._send("GET", f"{self.api_url}/drive/v3/changes/startPageToken")
+        changes_token = (await self._read_json(response, "iniciar sincronização"))["startPageToken"]
+        full = await super().sync_listing(None)
+        return {**full, "changes_token": changes_token}
+
+    async def _apply_changes(self, listing: Dict[str, Any]) -> Dict[str, Any]:
+        files = {file["id"]: file for file in listing["files"]}
+        page_token = listing["changes_token"]
+        with span("http.gdrive.list_changes"):
+            while True:
+                params = {
+                    "pageToken": page_token,
+                    "pageSize": GDRIVE_PAGE_SIZE,
+                    "fields": f"nextPageToken,newStartPageToken,changes(fileId,removed,file({GDRIVE_FILE_FIELDS}))",
+                }
+                response = await self._send("GET", f"{self.api_url}/drive/v3/changes", params=params)
+                body = await self._read_json(response, "sincronizar alterações")
+
+                for change in body.get("changes", []):
+                    file = change.get("file") or {}
+                    if change.get("removed") or file.get("trashed"):
+                        files.pop(change["fileId"], None)
+                    elif file:
+                        files[change["fileId"]] = self.normalize_file(file)
+
+                if body.get("newStartPageToken"):
+                    changes_token = body["newStartPageToken"]
+                    break
+                page_token = body["nextPageToken"]
+
+        return {"files": list(files.values()), "changes_token": changes_token, "sync": "delta"}
+
+    def upload_session_request(
+        self, name: str, size: int, mime_type: str, parent_id: Optional[str]
+    ) -> Tuple[str, Dict[str, Any]]:
+        metadata = {"name": name, "mimeType": mime_type}
+        if parent_id:
+            metadata["parents"] = [parent_id]
+        return f"{self.upload_url}/upload/drive/v3/files?uploadType=resumable", metadata
+
+
+class ProtonDriveAdapter(ProviderAdapter):
+    """Placeholder - adjust the endpoints to Proton's actual Drive API"""
+
+    name = "proton"
+    api_url = PROTON_API_URL
+
+    def download_url(self, file_id: str) -> str:
+        return f"{self.api_url}/drive/files/{quote(file_id, safe='')}/content"
+
+    def list_request(self, page_token: Optional[str]) -> Tuple[str, Dict[str, Any]]:
+        return f"{self.api_url}/drive/files", {"page_token": page_token} if page_token else {}
+
+    def upload_session_request(
+        self, name: str, size: int, mime_type: str, parent_id: Optional[str]
+    ) -> Tuple[str, Dict[str, Any]]:
+        return f"{self.api_url}/drive/uploads", {"name": name, "size": size, "mime_type": mime_type, "parent_id": parent_id}
+
+
+class TeraboxAdapter(ProviderAdapter):
+    """Placeholder - adjust the endpoints to Terabox's actual API"""
+
+    name = "terabox"
+    api_url = TERABOX_API_URL
+
+    def download_url(self, file_id: str) -> str:
+        return f"{self.api_url}/api/files/{quote(file_id, safe='')}/download"
+
+    def list_request(self, page_token: Optional[str]) -> Tuple[str, Dict[str, Any]]:
+        return f"{self.api_url}/api/files", {"page_token": page_token} if page_token else {}
+
+    def upload_session_request(
+        self, name: str, size: int, mime_type: str, parent_id: Optional[str]
+    ) -> Tuple[str, Dict[str, Any]]:
+        return f"{self.api_url}/api/uploads", {"name": name, "size": size, "mime_type": mime_type, "parent_id": parent_id}
+
+
+AVAILABLE_ADAPTERS: Dict[str, Type[ProviderAdapter]] = {
+    "gdrive": GoogleDriveAdapter,
+    "proton": ProtonDriveAdapter,
+    "terabox": TeraboxAdapter,
+}
+# The adapters routed to, as configured by FILE_PROVIDERS
+ADAPTERS: Dict[str, Type[ProviderAdapter]] = {
+    name: adapter for name, adapter in AVAILABLE_ADAPTERS.items() if name in FILE_PROVIDERS
+}
+
+
+def oauth_authorization(token_manager: "OAuthTokenManager", user_id: str, provider: str) -> Authorization:
+    """Bearer tokens from OAuthTokenManager, refreshed when expiring or rejected"""
+
+    async def authorization(force_refresh: bool = False) -> Optional[str]:
+        token = await token_manager.get_valid_token(user_id, provider, force_refresh=force_refresh)
+        return f"Bearer {token}" if token else None
+
+    return authorization
+
+
+def terabox_authorization(provider_data: Dict[str, Any]) -> Authorization:
+    """Stored basic auth header; there is nothing to refresh"""
+
+    async def authorization(force_refresh: bool = False) -> Optional[str]:
+        return None if force_refresh else provider_data.get("auth_header")
+
+    return authorization
+
+
+def is_connected(user: User, provider: str) -> bool:
+    provider_data = (user.oauth_providers or {}).get(provider) or {}
+    return bool(provider_data.get("auth_header" if provider == "terabox" else "access_token"))
+
+
+def get_adapter(db, user: User, provider: str) -> ProviderAdapter:
+    """Adapter acting as user; the caller checks the provider exists and is connected"""
+    if provider == "terabox":
+        authorization = terabox_authorization(user.oauth_providers["terabox"])
+    else:
+        from auth.oauth_helpers import OAuthTokenManager
+
+        authorization = oauth_authorization(OAuthTokenManager(db), user.id, provider)
+    return ADAPTERS[provider](authorization)
@@ -0,0 +1,240 @@
+"""
+Base adapter for cloud storage providers: authenticated requests, file
+listings, streaming downloads and resumable chunked uploads
+"""
+import re
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from core.http_client import get_http_client
+from core.metrics import span
+
+# Returns the Authorization header value for the provider, or None when no
+# usable credentials exist; force_refresh=True is called after a 401
+Authorization = Callable[[bool], Awaitable[Optional[str]]]
+
+_RANGE_RE = re.compile(r"bytes=(\d+)-(\d+)")
+
+if TYPE_CHECKING:
+    import httpx
+
+
+class ProviderError(Exception):
+    """A provider call failed; status_code is the provider's HTTP status when known"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class ProviderAuthError(ProviderError):
+    """The provider rejected the credentials even after a refresh"""
+
+
+class UploadSessionExpired(ProviderError):
+    """The provider no longer knows the resumable upload session"""
+
+
+class ProviderAdapter(ABC):
+    """Talks to one provider on behalf of one user.
+
+    Uploads use the resumable protocol popularised by Google Drive: a session
+    URL is created first, then byte ranges are PUT with Content-Range. A 308
+    answer carries the received range; 200/201 carries the finished file.
+    Listings are paginated and revalidated with ETag/If-None-Match.
+    Subclasses describe their endpoints and can override sync_listing when
+    the provider offers a changes feed.
+    """
+
+    name: str = ""
+
+    def __init__(self, authorization: Authorization, http_client: Optional["httpx.AsyncClient"] = None):
+        self.authorization = authorization
+        self._http_client = http_client
+
+    @property
+    def http_client(self) -> "httpx.AsyncClient":
+        return self._http_client or get_http_client()
+
+    @abstractmethod
+    def download_url(self, file_id: str) -> str:
+        """URL that returns the raw bytes of file_id"""
+
+    @abstractmethod
+    def upload_session_request(
+        self, name: str, size: int, mime_type: str, parent_id: Optional[str]
+    ) -> Tuple[str, Dict[str, Any]]:
+        """URL and JSON metadata body that create a resumable upload session"""
+
+    @abstractmethod
+    def list_request(self, page_token: Optional[str]) -> Tuple[str, Dict[str, Any]]:
+        """URL and query parameters for one page of the file listing"""
+
+    def parse_listing(self, body: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Raw file entries and the next page token of a listing page"""
+        return body.get("files", []), body.get("next_page_token")
+
+    def normalize_file(self, raw: Dict[str, Any]) -> Dict[str, Any]:
+        """Provider file entry in the shape returned by GET /files"""
+        return {
+            "id": str(raw["id"]),
+            "name": raw.get("name"),
+            "mime_type": raw.get("mime_type"),
+            "size": int(raw["size"]) if raw.get("size") is not None else None,
+            "modified_at": raw.get("modified_at"),
+            "md5": raw.get("md5"),
+        }
+
+    async def _headers(self, force_refresh: bool = False, headers: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+        authorization = await self.authorization(force_refresh)
+        if not authorization:
+            raise ProviderAuthError(f"{self.name} não conectado ou credenciais inválidas", 401)
+        return {**(headers or {}), "Authorization": authorization}
+
+    async def _send(
+        self,
+        method: str,
+        url: str,
+        headers: Optional[Dict[str, str]] = None,
+        replayable: bool = True,
+        **kwargs: Any,
+    ) -> "httpx.Response":
+        """Send a request with the user's credentials and return the unread, streaming response.
+
+        A 401 refreshes the credentials once. Replayable requests are retried
+        with the new credentials; for streamed bodies the closed 401 response
+        is returned so the caller can resume from the provider's offset.
+        """
+        response = await self._send_once(method, url, await self._headers(headers=headers), **kwargs)
+        if response.status_code != 401:
+            return response
+
+        await response.aclose()
+        refreshed = await self._headers(force_refresh=True, headers=headers)
+        if not replayable:
+            return response
+
+        response = await self._send_once(method, url, refreshed, **kwargs)
+        if response.status_code == 401:
+            await response.aclose()
+            raise ProviderAuthError(f"{self.name} rejeitou as credenciais", 401)
+        return response
+
+    async def _send_once(self, method: str, url: str, headers: Dict[str, str], **kwargs: Any) -> "httpx.Response":
+        # Already loaded by the shared client; imported here to keep it off worker boot
+        import httpx
+
+        request = self.http_client.build_request(method, url, headers=headers, **kwargs)
+        try:
+            return await self.http_client.send(request, stream=True)
+        except httpx.HTTPError as e:
+            raise ProviderError(f"{self.name} indisponível: {e.__class__.__name__}")
+
+    async def _read_json(self, response: "httpx.Response", action: str) -> Dict[str, Any]:
+        try:
+            if response.status_code != 200:
+                raise ProviderError(f"Falha ao {action} no {self.name}", response.status_code)
+            await response.aread()
+            return response.json()
+        except ValueError:
+            raise ProviderError(f"Resposta inválida do {self.name}", response.status_code)
+        finally:
+            await response.aclose()
+
+    async def sync_listing(self, listing: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Bring a cached listing up to date, or build one when listing is None.
+
+        Returns {"files": [...], "etag": ..., "sync": "full" | "not_modified"}.
+        Only the first page is revalidated: providers change the ETag of the
+        whole listing when anything in it changes.
+        """
+        etag = listing.get("etag") if listing else None
+        files = []
+        page_token = None
+        new_etag = None
+        with span(f"http.{self.name}.list_files"):
+            while True:
+                url, params = self.list_request(page_token)
+                headers = {"If-None-Match": etag} if etag and page_token is None else {}
+                response = await self._send("GET", url, headers=headers, params=params)
+                if response.status_code == 304:
+                    await response.aclose()
+                    return {**listing, "sync": "not_modified"}
+                if page_token is None:
+                    new_etag = response.headers.get("ETag")
+
+                raw_files, page_token = self.parse_listing(await self._read_json(response, "listar arquivos"))
+                files.extend(self.normalize_file(raw) for raw in raw_files)
+                if not page_token:
+                    break
+
+        return {"files": files, "etag": new_etag, "sync": "full"}
+
+    async def open_download(self, file_id: str, range_header: Optional[str] = None) -> "httpx.Response":
+        """Start a download; the caller streams the body and must close the response"""
+        headers = {"Range": range_header} if range_header else {}
+        with span(f"http.{self.name}.download"):
+            response = await self._send("GET", self.download_url(file_id), headers=headers)
+
+        if response.status_code not in (200, 206):
+            await response.aclose()
+            raise ProviderError(f"Falha ao baixar arquivo do {self.name}", response.status_code)
+        return response
+
+    async def create_upload_session(self, name: str, size: int, mime_type: str, parent_id: Optional[str] = None) -> str:
+        """Create a resumable upload session and return its URL"""
+        url, metadata = self.upload_session_request(name, size, mime_type, parent_id)
+        headers = {"X-Upload-Content-Type": mime_type, "X-Upload-Content-Length": str(size)}
+        with span(f"http.{self.name}.upload_session"):
+            response = await self._send("POST", url, headers=headers, json=metadata)
+            await response.aclose()
+
+        session_url = response.headers.get("Location")
+        if response.status_code != 200 or not session_url:
+            raise ProviderError(f"Falha ao iniciar upload no {self.name}", response.status_code)
+        return session_url
+
+    async def upload_chunk(
+        self, session_url: str, chunks: AsyncIterator[bytes], start: int, end: int, total: int
+    ) -> Tuple[int, Optional[Dict[str, Any]]]:
+        """Stream bytes start..end (inclusive) to the session.
+
+        Returns (bytes the provider has, finished file metadata or None).
+        """
+        headers = {
+            "Content-Length": str(end - start + 1),
+            "Content-Range": f"bytes {start}-{end}/{total}",
+        }
+        with span(f"http.{self.name}.upload_chunk"):
+            response = await self._send("PUT", session_url, headers=headers, content=chunks, replayable=False)
+            if response.status_code == 401:
+                # The body is gone; the credentials were refreshed, so report
+                # where the provider stands and let the client resend from there
+                return await self.upload_status(session_url, total)
+            return await self._upload_progress(response, total)
+
+    async def upload_status(self, session_url: str, total: int) -> Tuple[int, Optional[Dict[str, Any]]]:
+        """Ask the provider how much of the session it has received"""
+        headers = {"Content-Length": "0", "Content-Range": f"bytes */{total}"}
+        with span(f"http.{self.name}.upload_status"):
+            response = await self._send("PUT", session_url, headers=headers)
+            return await self._upload_progress(response, total)
+
+    async def cancel_upload(self, session_url: str) -> None:
+        with span(f"http.{self.name}.upload_cancel"):
+            response = await self._send("DELETE", session_url)
+            await response.aclose()
+
+    async def _upload_progress(self, response: "httpx.Response", total: int) -> Tuple[int, Optional[Dict[str, Any]]]:
+        try:
+            if response.status_code in (200, 201):
+                await response.aread()
+                return total, response.json()
+            if response.status_code == 308:
+                match = _RANGE_RE.match(response.headers.get("Range", ""))
+                return (int(match.group(2)) + 1 if match else 0), None
+            if response.status_code in (404, 410):
+                raise UploadSessionExpired(f"Sessão de upload do {self.name} expirou", response.status_code)
+            raise ProviderError(f"Falha no upload para o {self.name}", response.status_code)
+        finally:
+            await response.aclose()
@@ -0,0 +1,369 @@
+"""
+Content-addressed local disk cache for provider file contents
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import mmap
+import operator
+import os
+import re
+import tempfile
+import uuid
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+FILE_CHUNK_CACHE_ENABLED = os.environ.get("FILE_CHUNK_CACHE_ENABLED", "false").lower() == "true"
+FILE_CHUNK_CACHE_DIR = os.environ.get("FILE_CHUNK_CACHE_DIR", os.path.join(tempfile.gettempdir(), "symbios-chunk-cache"))
+FILE_CHUNK_CACHE_MAX_BYTES = int(os.environ.get("FILE_CHUNK_CACHE_MAX_BYTES", str(1024 ** 3)))
+FILE_CHUNK_SIZE = int(os.environ.get("FILE_CHUNK_SIZE", str(4 * 1024 * 1024)))
+# Slice size when streaming cached chunks to the client
+FILE_CHUNK_SEND_SIZE = int(os.environ.get("FILE_CHUNK_SEND_SIZE", str(256 * 1024)))
+
+_RANGE_RE = re.compile(r"bytes=(\d*)-(\d*)$")
+
+
+def content_key(user_id: str, provider: str, file_id: str, file: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Identity of a file's content, from its listing entry.
+
+    An MD5 identifies the content itself, so identical files on different
+    providers share one manifest. Without one, the file's id plus its size and
+    modification time identify a version. Files missing from the cached
+    listing have no key and are not cached.
+
+    Keys are per user, so a crafted MD5 collision cannot serve one user's
+    bytes to another; chunks are still shared through their SHA-256.
+    """
+    if not file:
+        return None
+    if file.get("md5"):
+        return f"{user_id}:md5:{file['md5'].lower()}"
+    if file.get("modified_at") and file.get("size") is not None:
+        return f"{user_id}:{provider}:{file_id}:{file['modified_at']}:{file['size']}"
+    return None
+
+
+def parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """(start, end) inclusive of a single-range header; None for the whole file.
+
+    Raises ValueError for ranges that cannot be satisfied.
+    """
+    if not range_header:
+        return None
+    match = _RANGE_RE.match(range_header.strip())
+    if not match or match.groups() == ("", ""):
+        raise ValueError(range_header)
+
+    first, last = match.groups()
+    if first == "":
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start > end or start >= size:
+        raise ValueError(range_header)
+    return start, end
+
+
+class ChunkCache:
+    """Files split into fixed-size chunks stored once per SHA-256.
+
+    A manifest maps a content key to its chunk hashes, so files with the same
+    content (on one provider or several) share chunks on disk. Chunks are
+    evicted least recently used once the cache exceeds max_bytes, and with
+    them every manifest that uses them. Cached reads are served from
+    memory-mapped chunk files. Disk access (manifests, mapping, copying out
+    of the maps) runs in worker threads; the bookkeeping stays on the event
+    loop.
+    """
+
+    def __init__(
+        self,
+        directory: str = FILE_CHUNK_CACHE_DIR,
+        max_bytes: int = FILE_CHUNK_CACHE_MAX_BYTES,
+        chunk_size: int = FILE_CHUNK_SIZE,
+        enabled: bool = FILE_CHUNK_CACHE_ENABLED,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.chunk_size = max(1, chunk_size)
+        self.enabled = enabled
+        # chunk hash -> size, least recently used first
+        self._chunks: "OrderedDict[str, int]" = OrderedDict()
+        # chunk hash -> manifest paths using it, and manifest path -> its chunk hashes
+        self._chunk_manifests: Dict[str, Set[str]] = {}
+        self._manifests: Dict[str, List[str]] = {}
+        self.size_bytes = 0
+        self._loaded = False
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_served = 0
+        self.bytes_stored = 0
+        self.chunks_deduplicated = 0
+
+    def _chunk_path(self, digest: str) -> str:
+        return os.path.join(self.directory, "chunks", digest[:2], digest)
+
+    def _manifest_path(self, key: str) -> str:
+        return os.path.join(self.directory, "manifests", hashlib.sha256(key.encode()).hexdigest() + ".json")
+
+    async def start(self) -> None:
+        """Index the chunks already on disk, oldest first"""
+        if self.enabled and not self._loaded:
+            await asyncio.to_thread(self._load)
+
+    def _load(self) -> None:
+        manifests_dir = os.path.join(self.directory, "manifests")
+        os.makedirs(os.path.join(self.directory, "chunks"), exist_ok=True)
+        os.makedirs(manifests_dir, exist_ok=True)
+        found = []
+        for root, _, names in os.walk(os.path.join(self.directory, "chunks")):
+            for name in names:
+                path = os.path.join(root, name)
+                if name.endswith(".tmp"):
+                    os.unlink(path)
+                    continue
+                stat = os.stat(path)
+                found.append((stat.st_mtime, name, stat.st_size))
+        for _, digest, size in sorted(found):
+            self._chunks[digest] = size
+            self.size_bytes += size
+
+        for name in os.listdir(manifests_dir):
+            path = os.path.join(manifests_dir, name)
+            manifest = self._read_manifest_file(path) if name.endswith(".json") else None
+            if manifest is None:
+                self._unlink([path])
+                continue
+            self._unlink(self._add_manifest(path, [digest for digest, _ in manifest["chunks"]]))
+
+        self._loaded = True
+        self._unlink(self._evict())
+
+    @staticmethod
+    def _unlink(paths: Iterable[str]) -> None:
+        for path in paths:
+            try:
+                # Readers that already mapped a chunk keep their mapping
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def _add_manifest(self, path: str, digests: List[str]) -> List[str]:
+        """Index a written manifest; returns it for deletion if a chunk is already gone"""
+        if any(digest not in self._chunks for digest in digests):
+            self._forget_manifest(path)
+            return [path]
+        self._manifests[path] = digests
+        for digest in digests:
+            self._chunk_manifests.setdefault(digest, set()).add(path)
+        return []
+
+    def _forget_manifest(self, path: str) -> None:
+        for digest in self._manifests.pop(path, ()):
+            users = self._chunk_manifests.get(digest)
+            if users is not None:
+                users.discard(path)
+                if not users:
+                    del self._chunk_manifests[digest]
+
+    def _evict(self) -> List[str]:
+        """Drop chunks until the cache fits, with the manifests using them; returns the files to delete"""
+        doomed = []
+        while self.size_bytes > self.max_bytes and self._chunks:
+            digest, size = self._chunks.popitem(last=False)
+            self.size_bytes -= size
+            self.evictions += 1
+            doomed.append(self._chunk_path(digest))
+            for path in list(self._chunk_manifests.get(digest, ())):
+                self._forget_manifest(path)
+                doomed.append(path)
+        return doomed
+
+    def _store_chunk(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        if digest in self._chunks:
+            self.chunks_deduplicated += 1
+            return digest
+
+        path = self._chunk_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return digest
+
+    async def _add_chunk(self, digest: str, size: int) -> None:
+        """Account for a stored chunk; the bookkeeping runs on the event loop thread"""
+        if digest not in self._chunks:
+            self._chunks[digest] = size
+            self.size_bytes += size
+            self.bytes_stored += size
+            doomed = self._evict()
+            if doomed:
+                await asyncio.to_thread(self._unlink, doomed)
+
+    @staticmethod
+    def _read_manifest_file(path: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    async def lookup(self, key: str) -> Optional[Tuple[Dict[str, Any], List[mmap.mmap]]]:
+        """Manifest for key plus a map of each of its chunks, or None on a miss.
+
+        Mapping everything up front means a chunk evicted mid-read stays
+        readable: unlinking a file does not invalidate existing maps.
+        """
+        if not self.enabled:
+            return None
+        path = self._manifest_path(key)
+        digests = self._manifests.get(path)
+        if digests is None:
+            self.misses += 1
+            return None
+
+        manifest = await asyncio.to_thread(self._read_manifest_file, path)
+        if manifest is None or manifest.get("key") != key:
+            self.misses += 1
+            return None
+
+        maps = await asyncio.to_thread(self._map_all, digests)
+        if maps is None:
+            self.misses += 1
+            return None
+        for digest in digests:
+            if digest in self._chunks:
+                self._chunks.move_to_end(digest)
+
+        self.hits += 1
+        return manifest, maps
+
+    def admits(self, size: Optional[int]) -> bool:
+        """Whether a file of this size is worth caching; huge files would flush everything else"""
+        return self.enabled and size is not None and size <= self.max_bytes // 4
+
+    def _write_manifest(self, manifest: Dict[str, Any]) -> None:
+        path = self._manifest_path(manifest["key"])
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, path)
+
+    async def tee(self, key: str, stream: AsyncIterator[bytes], content_type: Optional[str], md5: Optional[str] = None) -> AsyncIterator[bytes]:
+        """Pass stream through while storing it; the manifest is written only
+        once the whole stream was read (and matched md5, when given)"""
+        chunks: List[Tuple[str, int]] = []
+        buffer = bytearray()
+        checksum = hashlib.md5() if md5 else None
+        total = 0
+
+        async def store(data: bytes) -> None:
+            digest = await asyncio.to_thread(self._store_chunk, data)
+            await self._add_chunk(digest, len(data))
+            chunks.append((digest, len(data)))
+
+        async for data in stream:
+            yield data
+            buffer += data
+            total += len(data)
+            if checksum is not None:
+                checksum.update(data)
+            while len(buffer) >= self.chunk_size:
+                await store(bytes(buffer[:self.chunk_size]))
+                del buffer[:self.chunk_size]
+
+        if buffer:
+            await store(bytes(buffer))
+        if checksum is not None and checksum.hexdigest() != md5.lower():
+            logger.warning("Not caching %s: content does not match its md5", key)
+            return
+
+        manifest = {
+            "key": key,
+            "size": total,
+            "content_type": content_type,
+            "chunks": chunks,
+        }
+        await asyncio.to_thread(self._write_manifest, manifest)
+        path = self._manifest_path(key)
+        # Replaces any earlier version of the manifest
+        self._forget_manifest(path)
+        # Chunks evicted by concurrent downloads meanwhile make the manifest useless
+        doomed = self._add_manifest(path, [digest for digest, _ in chunks])
+        if doomed:
+            await asyncio.to_thread(self._unlink, doomed)
+
+    def _mapped(self, digest: str) -> Optional[mmap.mmap]:
+        try:
+            with open(self._chunk_path(digest), "rb") as f:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _map_all(self, digests: List[str]) -> Optional[List[mmap.mmap]]:
+        maps = []
+        for digest in digests:
+            mapped = self._mapped(digest)
+            if mapped is None:
+                for opened in maps:
+                    opened.close()
+                return None
+            maps.append(mapped)
+        return maps
+
+    async def read(self, manifest: Dict[str, Any], maps: List[mmap.mmap], start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        """Stream bytes start..end (inclusive) of a cached file from its mapped chunks.
+
+        Each slice is copied once, straight from the page cache, in a worker
+        thread so page faults never stall the event loop; ASGI bodies must be
+        bytes, so this is as close to sendfile as the stack allows.
+        """
+        end = manifest["size"] - 1 if end is None else end
+        offset = 0
+        try:
+            for mapped, (_, size) in zip(maps, manifest["chunks"]):
+                if offset + size <= start:
+                    offset += size
+                    continue
+                if offset > end:
+                    break
+
+                position = max(start - offset, 0)
+                stop = min(end - offset + 1, size)
+                while position < stop:
+                    piece = await asyncio.to_thread(operator.getitem, mapped, slice(position, min(position + FILE_CHUNK_SEND_SIZE, stop)))
+                    self.bytes_served += len(piece)
+                    yield piece
+                    position += len(piece)
+                offset += size
+        finally:
+            for mapped in maps:
+                mapped.close()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "enabled": self.enabled,
+            "size_bytes": self.size_bytes,
+            "max_bytes": self.max_bytes,
+            "chunks": len(self._chunks),
+            "manifests": len(self._manifests),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "bytes_served": self.bytes_served,
+            "bytes_stored": self.bytes_stored,
+            "chunks_deduplicated": self.chunks_deduplicated,
+        }
+
+
+chunk_cache = ChunkCache()
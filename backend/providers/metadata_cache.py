@@ -0,0 +1,158 @@
+"""
+Per-user cache of provider file listings, kept current with incremental syncs
+"""
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from pymongo import ASCENDING, ReturnDocument
+
+from core.cache import TTLCache
+from core.indexes import register_index, register_query_shape
+
+# "memory" for a single worker, "mongo" to share listings between workers
+FILE_METADATA_CACHE = os.environ.get("FILE_METADATA_CACHE", "memory")
+# How long a listing is kept as the base for delta syncs
+FILE_METADATA_CACHE_TTL_SECONDS = int(os.environ.get("FILE_METADATA_CACHE_TTL_SECONDS", "86400"))
+FILE_METADATA_CACHE_MAX_ENTRIES = int(os.environ.get("FILE_METADATA_CACHE_MAX_ENTRIES", "10000"))
+# File entries per insert_many when the Mongo store saves a listing
+FILE_METADATA_WRITE_BATCH = int(os.environ.get("FILE_METADATA_WRITE_BATCH", "1000"))
+
+# Database will be injected from main app (only used by the Mongo store)
+db = None
+
+
+class InMemoryFileMetadataCache:
+    """Listings in a bounded TTL cache keyed by (user id, provider)"""
+
+    def __init__(self, max_size: int = FILE_METADATA_CACHE_MAX_ENTRIES, ttl: float = FILE_METADATA_CACHE_TTL_SECONDS):
+        self._listings = TTLCache(max_size=max_size, ttl=ttl)
+
+    async def get(self, user_id: str, provider: str) -> Optional[Dict[str, Any]]:
+        return self._listings.get((user_id, provider))
+
+    async def get_file(self, user_id: str, provider: str, file_id: str) -> Optional[Dict[str, Any]]:
+        listing = self._listings.get((user_id, provider))
+        for file in listing["files"] if listing else ():
+            if file["id"] == file_id:
+                return file
+        return None
+
+    async def set(self, user_id: str, provider: str, listing: Dict[str, Any]) -> None:
+        self._listings.set((user_id, provider), listing)
+
+    async def expire(self, user_id: str, provider: str) -> None:
+        """Keep the listing as a sync base but force the next read to sync"""
+        listing = self._listings.peek((user_id, provider))
+        if listing is not None:
+            self._listings.set((user_id, provider), {**listing, "synced_at": None})
+
+    async def forget(self, user_id: str, provider: str) -> None:
+        self._listings.pop((user_id, provider))
+
+    def stats(self) -> Dict[str, int]:
+        return self._listings.stats()
+
+
+class MongoFileMetadataCache:
+    """Listings in Mongo, one document per file so no listing hits the 16MB document limit.
+
+    file_metadata holds a header per (user, provider) with everything but
+    the files; file_metadata_entries holds the files, tagged with the
+    generation of the sync that wrote them. A sync writes a new generation
+    first and then points the header at it, so readers never see a partial
+    listing, and deletes the generation it replaced. Both collections are
+    cleaned up by TTL indexes, which also catch entries orphaned by a
+    failed sync.
+    """
+
+    def __init__(self, ttl: float = FILE_METADATA_CACHE_TTL_SECONDS, write_batch: int = FILE_METADATA_WRITE_BATCH):
+        self.ttl = timedelta(seconds=ttl)
+        self.write_batch = max(1, write_batch)
+
+    async def _header(self, owner: str, projection: Dict[str, int]) -> Optional[Dict[str, Any]]:
+        return await db.file_metadata.find_one({"_id": owner, "expires_at": {"$gt": datetime.utcnow()}}, projection)
+
+    async def get(self, user_id: str, provider: str) -> Optional[Dict[str, Any]]:
+        owner = f"{user_id}:{provider}"
+        header = await self._header(owner, {"_id": 0, "expires_at": 0})
+        if header is None:
+            return None
+        generation = header.pop("generation", None)
+        entries = await db.file_metadata_entries.find(
+            {"owner": owner, "generation": generation}, {"_id": 0, "file": 1}
+        ).sort("position", ASCENDING).to_list(None)
+        return {**header, "files": [entry["file"] for entry in entries]}
+
+    async def get_file(self, user_id: str, provider: str, file_id: str) -> Optional[Dict[str, Any]]:
+        owner = f"{user_id}:{provider}"
+        header = await self._header(owner, {"generation": 1})
+        if header is None:
+            return None
+        entry = await db.file_metadata_entries.find_one(
+            {"_id": f"{owner}:{header.get('generation')}:{file_id}"}, {"file": 1}
+        )
+        return entry["file"] if entry else None
+
+    async def set(self, user_id: str, provider: str, listing: Dict[str, Any]) -> None:
+        owner = f"{user_id}:{provider}"
+        generation = uuid.uuid4().hex
+        expires_at = datetime.utcnow() + self.ttl
+        # Keyed by file id below, so a provider listing a file twice keeps one entry
+        files = list({file["id"]: file for file in listing.get("files", [])}.values())
+        for start in range(0, len(files), self.write_batch):
+            await db.file_metadata_entries.insert_many([
+                {
+                    "_id": f"{owner}:{generation}:{file['id']}",
+                    "owner": owner,
+                    "generation": generation,
+                    "position": position,
+                    "file": file,
+                    "expires_at": expires_at,
+                }
+                for position, file in enumerate(files[start:start + self.write_batch], start)
+            ], ordered=False)
+
+        header = {key: value for key, value in listing.items() if key != "files"}
+        previous = await db.file_metadata.find_one_and_replace(
+            {"_id": owner},
+            {**header, "generation": generation, "expires_at": expires_at},
+            projection={"generation": 1},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE,
+        )
+        # Only the generation replaced here: a concurrent sync's entries are left alone
+        if previous is not None and previous.get("generation") is not None:
+            await db.file_metadata_entries.delete_many({"owner": owner, "generation": previous["generation"]})
+
+    async def expire(self, user_id: str, provider: str) -> None:
+        await db.file_metadata.update_one({"_id": f"{user_id}:{provider}"}, {"$set": {"synced_at": None}})
+
+    async def forget(self, user_id: str, provider: str) -> None:
+        owner = f"{user_id}:{provider}"
+        await db.file_metadata.delete_one({"_id": owner})
+        await db.file_metadata_entries.delete_many({"owner": owner})
+
+    def stats(self) -> Dict[str, int]:
+        return {}
+
+
+if FILE_METADATA_CACHE == "mongo":
+    register_index("file_metadata", [("expires_at", ASCENDING)], expireAfterSeconds=0, name="expires_at_ttl")
+    register_index("file_metadata_entries", [("expires_at", ASCENDING)], expireAfterSeconds=0, name="expires_at_ttl")
+    register_index(
+        "file_metadata_entries",
+        [("owner", ASCENDING), ("generation", ASCENDING), ("position", ASCENDING)],
+        name="owner_generation_position",
+    )
+    register_query_shape("file metadata by user and provider", "file_metadata", {"_id": "audit", "expires_at": {"$gt": datetime(2000, 1, 1)}})
+    register_query_shape(
+        "file metadata entries of a listing",
+        "file_metadata_entries",
+        {"owner": "audit", "generation": "audit"},
+        sort=[("position", ASCENDING)],
+    )
+    file_metadata_cache = MongoFileMetadataCache()
+else:
+    file_metadata_cache = InMemoryFileMetadataCache()
@@ -0,0 +1,17 @@
+from pydantic import BaseModel, Field
+from typing import Any, Dict, Optional
+
+class UploadSessionCreate(BaseModel):
+    name: str
+    size: int = Field(..., ge=1)
+    mime_type: str = "application/octet-stream"
+    parent_id: Optional[str] = None
+
+class UploadProgress(BaseModel):
+    upload_id: str
+    provider: str
+    size: int
+    received: int
+    complete: bool = False
+    chunk_size: Optional[int] = None
+    file: Optional[Dict[str, Any]] = None
@@ -0,0 +1,394 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+import asyncio
+import logging
+import os
+import re
+import secrets
+
+from auth.dependencies import get_active_principal, load_principal_user
+from auth.models import User
+from auth.principal import Principal
+from core.responses import FastJSONResponse, model_response
+from core.singleflight import SingleFlight
+from .adapters import ADAPTERS, get_adapter, is_connected
+from .base import ProviderAdapter, ProviderAuthError, ProviderError, UploadSessionExpired
+from .chunk_cache import chunk_cache, content_key, parse_range
+from .metadata_cache import file_metadata_cache
+from .models import UploadProgress, UploadSessionCreate
+from .transfers import (
+    FILE_TRANSFER_CHUNK_SIZE,
+    FILE_UPLOAD_CHUNK_SIZE,
+    FILE_UPLOAD_MAX_SIZE,
+    transfer_limiter,
+    upload_session_store,
+)
+
+router = APIRouter(prefix="/files", tags=["files"])
+
+# Database will be injected from main app
+db = None
+
+logger = logging.getLogger(__name__)
+
+FILE_LISTING_TIMEOUT = float(os.environ.get("FILE_LISTING_TIMEOUT", "5"))
+# Listings synced more recently than this are served without asking the provider
+FILE_LISTING_FRESH_SECONDS = float(os.environ.get("FILE_LISTING_FRESH_SECONDS", "30"))
+
+# One sync per (user, provider) at a time; a sync that outlives the request
+# timeout keeps running and fills the cache for the next listing
+_listing_flights = SingleFlight()
+
+CONTENT_RANGE_RE = re.compile(r"bytes (\d+)-(\d+)/(\d+)$")
+# Provider response headers forwarded to the client on downloads; the body is
+# passed through undecoded, so Content-Encoding/Length stay valid
+DOWNLOAD_HEADERS = (
+    "content-type",
+    "content-length",
+    "content-encoding",
+    "content-range",
+    "content-disposition",
+    "accept-ranges",
+    "etag",
+    "last-modified",
+)
+
+
+def provider_adapter(provider: str, user: User) -> ProviderAdapter:
+    if provider not in ADAPTERS:
+        raise HTTPException(status_code=400, detail="Provider não suportado")
+    if not is_connected(user, provider):
+        raise HTTPException(status_code=400, detail=f"{provider} não está conectado")
+    return get_adapter(db, user, provider)
+
+
+def provider_http_error(error: ProviderError) -> HTTPException:
+    """Map a provider failure to the response for our client.
+
+    Credential problems are 403, not 401: the user's own session is fine and
+    the frontend treats 401 as "log in again".
+    """
+    if isinstance(error, ProviderAuthError):
+        return HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=str(error))
+    if isinstance(error, UploadSessionExpired):
+        return HTTPException(status_code=status.HTTP_410_GONE, detail=str(error))
+    if error.status_code == 404:
+        return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Arquivo não encontrado")
+    return HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=str(error))
+
+
+def parse_content_range(request: Request, size: int) -> Tuple[int, int]:
+    """Validated (start, end) of an upload chunk from its Content-Range header"""
+    match = CONTENT_RANGE_RE.match(request.headers.get("content-range", ""))
+    if not match:
+        raise HTTPException(status_code=400, detail="Content-Range obrigatório: bytes início-fim/total")
+
+    start, end, total = (int(value) for value in match.groups())
+    if total != size or start > end or end >= total:
+        raise HTTPException(status_code=416, detail="Content-Range fora do tamanho do upload")
+
+    content_length = request.headers.get("content-length")
+    if content_length is not None and not content_length.strip().isdigit():
+        raise HTTPException(status_code=400, detail="Content-Length inválido")
+    if content_length is not None and int(content_length) != end - start + 1:
+        raise HTTPException(status_code=400, detail="Content-Length não corresponde ao Content-Range")
+    return start, end
+
+
+async def get_upload_session(upload_id: str, user: Principal) -> Dict[str, Any]:
+    session = await upload_session_store.get(upload_id)
+    if session is None or session["user_id"] != user.id:
+        raise HTTPException(status_code=404, detail="Upload não encontrado ou expirado")
+    return session
+
+
+async def upload_progress(upload_id: str, session: Dict[str, Any], received: int, file: Optional[Dict[str, Any]]):
+    if file is not None:
+        await upload_session_store.delete(upload_id)
+        await file_metadata_cache.expire(session["user_id"], session["provider"])
+    else:
+        await upload_session_store.update(upload_id, received)
+
+    return model_response(UploadProgress(
+        upload_id=upload_id,
+        provider=session["provider"],
+        size=session["size"],
+        received=received,
+        complete=file is not None,
+        file=file,
+    ))
+
+
+def is_fresh(listing: Dict[str, Any]) -> bool:
+    synced_at = listing.get("synced_at")
+    return synced_at is not None and (datetime.utcnow() - synced_at).total_seconds() < FILE_LISTING_FRESH_SECONDS
+
+
+async def sync_provider_listing(user: User, provider: str, cached: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    listing = await get_adapter(db, user, provider).sync_listing(cached)
+    listing["synced_at"] = datetime.utcnow()
+    await file_metadata_cache.set(user.id, provider, listing)
+    return listing
+
+
+async def provider_listing(user: User, provider: str, refresh: bool) -> Tuple[Optional[Dict[str, Any]], str]:
+    """(listing, status) for one provider; never raises so one provider cannot fail the rest"""
+    cached = await file_metadata_cache.get(user.id, provider)
+    if cached is not None and not refresh and is_fresh(cached):
+        return cached, "cached"
+
+    try:
+        listing = await asyncio.wait_for(
+            _listing_flights.do((user.id, provider), lambda: sync_provider_listing(user, provider, cached)),
+            timeout=FILE_LISTING_TIMEOUT,
+        )
+        return listing, listing["sync"]
+    except asyncio.TimeoutError:
+        state = "timeout"
+    except ProviderAuthError:
+        state = "unauthorized"
+    except ProviderError as e:
+        logger.warning("Listing %s files failed: %s", provider, e)
+        state = "error"
+
+    # Serve what we had rather than nothing
+    return cached, f"stale_{state}" if cached is not None else state
+
+
+@router.get("")
+async def list_files(
+    providers: Optional[str] = Query(None, description="Comma separated providers; defaults to every connected one"),
+    refresh: bool = Query(False, description="Sync with the providers even if the cached listing is fresh"),
+    principal: Principal = Depends(get_active_principal),
+):
+    """Files of every connected provider, fetched concurrently.
+
+    Each provider has FILE_LISTING_TIMEOUT to answer; slow or failing ones are
+    reported in `providers` (served from the last cached listing when there is
+    one) and `partial` is set.
+    """
+    if providers:
+        names = [name.strip() for name in providers.split(",") if name.strip()]
+        unknown = [name for name in names if name not in ADAPTERS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Providers não suportados: {', '.join(unknown)}")
+    else:
+        names = list(ADAPTERS)
+    current_user = await load_principal_user(principal)
+    names = [name for name in names if is_connected(current_user, name)]
+
+    results = await asyncio.gather(*(provider_listing(current_user, name, refresh) for name in names))
+
+    files = []
+    provider_status = {}
+    for name, (listing, state) in zip(names, results):
+        provider_status[name] = {
+            "status": state,
+            "count": len(listing["files"]) if listing else 0,
+            "synced_at": listing.get("synced_at") if listing else None,
+        }
+        if listing:
+            files.extend({**file, "provider": name} for file in listing["files"])
+
+    return FastJSONResponse({
+        "files": files,
+        "providers": provider_status,
+        "partial": any(entry["status"] not in ("cached", "full", "delta", "not_modified") for entry in provider_status.values()),
+    })
+
+
+async def cached_file_entry(user_id: str, provider: str, file_id: str) -> Optional[Dict[str, Any]]:
+    """The file's entry in the cached listing, without syncing"""
+    return await file_metadata_cache.get_file(user_id, provider, file_id)
+
+
+def cached_file_response(manifest: Dict[str, Any], maps: list, range_header: Optional[str]) -> StreamingResponse:
+    size = manifest["size"]
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError:
+        for mapped in maps:
+            mapped.close()
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            detail="Intervalo inválido",
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+
+    start, end = byte_range or (0, size - 1)
+    headers = {
+        "Content-Type": manifest["content_type"] or "application/octet-stream",
+        "Content-Length": str(end - start + 1),
+        "Accept-Ranges": "bytes",
+    }
+    if byte_range is not None:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    return StreamingResponse(
+        chunk_cache.read(manifest, maps, start, end),
+        status_code=206 if byte_range is not None else 200,
+        headers=headers,
+    )
+
+
+@router.get("/{provider}/{file_id}/content")
+async def download_file(provider: str, file_id: str, request: Request, current_user: Principal = Depends(get_active_principal)):
+    """Stream a file, from the local chunk cache when its content is known
+    there, otherwise from the provider; Range requests are supported either way"""
+    if provider not in ADAPTERS:
+        raise HTTPException(status_code=400, detail="Provider não suportado")
+    range_header = request.headers.get("range")
+
+    file = None
+    key = None
+    if chunk_cache.enabled:
+        file = await cached_file_entry(current_user.id, provider, file_id)
+        key = content_key(current_user.id, provider, file_id, file)
+        cached = await chunk_cache.lookup(key) if key else None
+        if cached is not None:
+            return cached_file_response(*cached, range_header)
+
+    # Only the provider needs the full user (its credentials); cache hits never load it
+    adapter = provider_adapter(provider, await load_principal_user(current_user))
+    await transfer_limiter.acquire(current_user.id)
+    try:
+        upstream = await adapter.open_download(file_id, range_header)
+    except ProviderError as e:
+        transfer_limiter.release(current_user.id)
+        raise provider_http_error(e)
+    except BaseException:
+        transfer_limiter.release(current_user.id)
+        raise
+
+    closed = False
+
+    async def close():
+        # Runs from the body's finally and again as a background task, which
+        # covers clients that disconnect before the body starts
+        nonlocal closed
+        if closed:
+            return
+        closed = True
+        transfer_limiter.release(current_user.id)
+        await upstream.aclose()
+
+    stream = upstream.aiter_raw(FILE_TRANSFER_CHUNK_SIZE)
+    # Only whole, unencoded bodies are cached; ranges go straight through
+    if (
+        key is not None
+        and upstream.status_code == 200
+        and "content-encoding" not in upstream.headers
+        and chunk_cache.admits(file.get("size"))
+    ):
+        stream = chunk_cache.tee(key, stream, upstream.headers.get("content-type"), file.get("md5"))
+
+    async def body():
+        try:
+            async for chunk in stream:
+                transfer_limiter.bytes_downloaded += len(chunk)
+                yield chunk
+        finally:
+            await close()
+
+    headers = {name: upstream.headers[name] for name in DOWNLOAD_HEADERS if name in upstream.headers}
+    return StreamingResponse(
+        body(),
+        status_code=upstream.status_code,
+        headers=headers,
+        background=BackgroundTask(close),
+    )
+
+
+@router.post("/{provider}/uploads", response_model=UploadProgress)
+async def create_upload(provider: str, upload: UploadSessionCreate, current_user: Principal = Depends(get_active_principal)):
+    """Start a resumable upload; send the bytes with PUT /files/uploads/{upload_id}"""
+    if upload.size > FILE_UPLOAD_MAX_SIZE:
+        raise HTTPException(status_code=413, detail="Arquivo maior que o permitido")
+    adapter = provider_adapter(provider, await load_principal_user(current_user))
+
+    try:
+        session_url = await adapter.create_upload_session(upload.name, upload.size, upload.mime_type, upload.parent_id)
+    except ProviderError as e:
+        raise provider_http_error(e)
+
+    upload_id = secrets.token_urlsafe(24)
+    await upload_session_store.save(upload_id, {
+        "user_id": current_user.id,
+        "provider": provider,
+        "session_url": session_url,
+        "name": upload.name,
+        "size": upload.size,
+        "received": 0,
+    })
+
+    return model_response(UploadProgress(
+        upload_id=upload_id,
+        provider=provider,
+        size=upload.size,
+        received=0,
+        chunk_size=FILE_UPLOAD_CHUNK_SIZE,
+    ))
+
+
+@router.put("/uploads/{upload_id}", response_model=UploadProgress)
+async def upload_chunk(upload_id: str, request: Request, current_user: Principal = Depends(get_active_principal)):
+    """Stream one byte range of an upload to the provider.
+
+    The response carries how many bytes the provider has; when that is less
+    than the range sent (e.g. the token was refreshed mid-chunk), the client
+    continues from `received`.
+    """
+    session = await get_upload_session(upload_id, current_user)
+    start, end = parse_content_range(request, session["size"])
+    adapter = provider_adapter(session["provider"], await load_principal_user(current_user))
+
+    async def chunks():
+        async for chunk in request.stream():
+            transfer_limiter.bytes_uploaded += len(chunk)
+            yield chunk
+
+    async with transfer_limiter.slot(current_user.id):
+        try:
+            received, file = await adapter.upload_chunk(session["session_url"], chunks(), start, end, session["size"])
+        except UploadSessionExpired as e:
+            await upload_session_store.delete(upload_id)
+            raise provider_http_error(e)
+        except ProviderError as e:
+            raise provider_http_error(e)
+
+    return await upload_progress(upload_id, session, received, file)
+
+
+@router.get("/uploads/{upload_id}", response_model=UploadProgress)
+async def get_upload_status(upload_id: str, current_user: Principal = Depends(get_active_principal)):
+    """Ask the provider how much of the upload it has, to resume after a failure"""
+    session = await get_upload_session(upload_id, current_user)
+    adapter = provider_adapter(session["provider"], await load_principal_user(current_user))
+
+    try:
+        received, file = await adapter.upload_status(session["session_url"], session["size"])
+    except UploadSessionExpired as e:
+        await upload_session_store.delete(upload_id)
+        raise provider_http_error(e)
+    except ProviderError as e:
+        raise provider_http_error(e)
+
+    return await upload_progress(upload_id, session, received, file)
+
+
+@router.delete("/uploads/{upload_id}")
+async def cancel_upload(upload_id: str, current_user: Principal = Depends(get_active_principal)):
+    session = await get_upload_session(upload_id, current_user)
+    await upload_session_store.delete(upload_id)
+
+    try:
+        user = await load_principal_user(current_user)
+        await provider_adapter(session["provider"], user).cancel_upload(session["session_url"])
+    except (ProviderError, HTTPException):
+        # The session is forgotten either way; providers expire abandoned sessions
+        pass
+
+    return {"message": "Upload cancelado"}
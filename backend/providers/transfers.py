@@ -0,0 +1,159 @@
+"""
+Per-user transfer limits and storage for resumable upload sessions
+"""
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from fastapi import HTTPException, status
+from pymongo import ASCENDING
+
+from core.cache import TTLCache
+from core.indexes import register_index, register_query_shape
+
+FILE_TRANSFERS_PER_USER = int(os.environ.get("FILE_TRANSFERS_PER_USER", "4"))
+FILE_TRANSFER_QUEUE_TIMEOUT = float(os.environ.get("FILE_TRANSFER_QUEUE_TIMEOUT", "5"))
+FILE_TRANSFER_RETRY_AFTER = int(os.environ.get("FILE_TRANSFER_RETRY_AFTER", "2"))
+FILE_TRANSFER_CHUNK_SIZE = int(os.environ.get("FILE_TRANSFER_CHUNK_SIZE", str(256 * 1024)))
+# Chunk size suggested to clients; Google Drive wants multiples of 256 KiB
+FILE_UPLOAD_CHUNK_SIZE = int(os.environ.get("FILE_UPLOAD_CHUNK_SIZE", str(8 * 1024 * 1024)))
+FILE_UPLOAD_MAX_SIZE = int(os.environ.get("FILE_UPLOAD_MAX_SIZE", str(5 * 1024 ** 4)))
+# "memory" for a single worker, "mongo" when several workers serve the same uploads
+UPLOAD_SESSION_STORE = os.environ.get("UPLOAD_SESSION_STORE", "memory")
+UPLOAD_SESSION_TTL_SECONDS = int(os.environ.get("UPLOAD_SESSION_TTL_SECONDS", "86400"))
+UPLOAD_SESSION_MAX_PENDING = int(os.environ.get("UPLOAD_SESSION_MAX_PENDING", "10000"))
+
+# Database will be injected from main app (only used by the Mongo store)
+db = None
+
+
+class TransferLimiter:
+    """Caps concurrent transfers per user.
+
+    A transfer waits up to queue_timeout for a free slot, then gets a 429 so
+    one user cannot tie up the provider connection pool.
+    """
+
+    def __init__(
+        self,
+        per_user: int = FILE_TRANSFERS_PER_USER,
+        queue_timeout: float = FILE_TRANSFER_QUEUE_TIMEOUT,
+        retry_after: int = FILE_TRANSFER_RETRY_AFTER,
+    ):
+        self.per_user = max(1, per_user)
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        # user id -> [semaphore, holders + waiters]; dropped when unused
+        self._slots: Dict[str, List[Any]] = {}
+
+        # Metrics
+        self.active = 0
+        self.rejected = 0
+        self.bytes_downloaded = 0
+        self.bytes_uploaded = 0
+
+    async def acquire(self, user_id: str) -> None:
+        entry = self._slots.get(user_id)
+        if entry is None:
+            entry = self._slots[user_id] = [asyncio.Semaphore(self.per_user), 0]
+        entry[1] += 1
+        try:
+            await asyncio.wait_for(entry[0].acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._forget(user_id, entry)
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Muitas transferências simultâneas, tente novamente em instantes",
+                headers={"Retry-After": str(self.retry_after)},
+            )
+        except BaseException:
+            self._forget(user_id, entry)
+            raise
+        self.active += 1
+
+    def release(self, user_id: str) -> None:
+        entry = self._slots[user_id]
+        entry[0].release()
+        self.active -= 1
+        self._forget(user_id, entry)
+
+    def _forget(self, user_id: str, entry: List[Any]) -> None:
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._slots[user_id]
+
+    @asynccontextmanager
+    async def slot(self, user_id: str):
+        await self.acquire(user_id)
+        try:
+            yield
+        finally:
+            self.release(user_id)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "active": self.active,
+            "users": len(self._slots),
+            "rejected": self.rejected,
+            "bytes_downloaded": self.bytes_downloaded,
+            "bytes_uploaded": self.bytes_uploaded,
+        }
+
+
+class InMemoryUploadSessionStore:
+    """Upload sessions in a bounded TTL cache"""
+
+    def __init__(self, max_size: int = UPLOAD_SESSION_MAX_PENDING, ttl: float = UPLOAD_SESSION_TTL_SECONDS):
+        self._sessions = TTLCache(max_size=max_size, ttl=ttl)
+
+    async def save(self, upload_id: str, session: Dict[str, Any]) -> None:
+        self._sessions.set(upload_id, dict(session))
+
+    async def get(self, upload_id: str) -> Optional[Dict[str, Any]]:
+        session = self._sessions.get(upload_id)
+        return dict(session) if session is not None else None
+
+    async def update(self, upload_id: str, received: int) -> None:
+        session = self._sessions.peek(upload_id)
+        if session is not None:
+            session["received"] = received
+
+    async def delete(self, upload_id: str) -> None:
+        self._sessions.pop(upload_id)
+
+
+class MongoUploadSessionStore:
+    """Upload sessions in the upload_sessions collection, cleaned up by a TTL index"""
+
+    def __init__(self, ttl: float = UPLOAD_SESSION_TTL_SECONDS):
+        self.ttl = timedelta(seconds=ttl)
+
+    async def save(self, upload_id: str, session: Dict[str, Any]) -> None:
+        now = datetime.utcnow()
+        await db.upload_sessions.insert_one({"_id": upload_id, **session, "created_at": now, "expires_at": now + self.ttl})
+
+    async def get(self, upload_id: str) -> Optional[Dict[str, Any]]:
+        # The TTL monitor only runs every minute, so check expiry here as well
+        return await db.upload_sessions.find_one(
+            {"_id": upload_id, "expires_at": {"$gt": datetime.utcnow()}},
+            {"_id": 0, "created_at": 0, "expires_at": 0},
+        )
+
+    async def update(self, upload_id: str, received: int) -> None:
+        await db.upload_sessions.update_one({"_id": upload_id}, {"$set": {"received": received}})
+
+    async def delete(self, upload_id: str) -> None:
+        await db.upload_sessions.delete_one({"_id": upload_id})
+
+
+transfer_limiter = TransferLimiter()
+
+if UPLOAD_SESSION_STORE == "mongo":
+    register_index("upload_sessions", [("expires_at", ASCENDING)], expireAfterSeconds=0, name="expires_at_ttl")
+    register_query_shape("upload session by id", "upload_sessions", {"_id": "audit", "expires_at": {"$gt": datetime(2000, 1, 1)}})
+    upload_session_store = MongoUploadSessionStore()
+else:
+    upload_session_store = InMemoryUploadSessionStore()
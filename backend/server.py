@@ -1,85 +1,198 @@
-from fastapi import FastAPI, APIRouter
+from pathlib import Path
 from dotenv import load_dotenv
+
+# Load .env before importing anything that reads configuration at import time
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, APIRouter, HTTPException, Request, status
+from fastapi.responses import PlainTextResponse
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
 import os
 import logging
-from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List
-import uuid
-from datetime import datetime
 
 # Import auth routes
 from auth.routes import router as auth_router
+from status_checks.routes import router as status_router
+from providers.routes import router as files_router
+from core.responses import FastJSONResponse
+from core.metrics import METRICS_ENABLED, MetricsMiddleware, metrics_authorized, registry, render_metrics
+from core import rate_limit
+from core.rate_limit import RATE_LIMIT_ENABLED, RateLimitMiddleware
+
+from auth import dependencies, routes, oauth_state, revocation, rotation
+from status_checks import routes as status_routes
+from providers import routes as files_routes, transfers, metadata_cache
+from providers.chunk_cache import chunk_cache
+from status_checks.write_buffer import write_buffer, STATUS_WRITE_BUFFER_ENABLED
+from status_checks.rollups import rollup_job, STATUS_ROLLUP_MODE
+from auth.hashing_pool import hashing_pool
+from core.http_client import close_http_client
+from core.cache_coherence import cache_invalidator
+from core.indexes import bootstrap_indexes, stop_index_bootstrap
+from core.log import RequestContextMiddleware, configure_logging, log_stats
+from auth.user_cache import user_cache
+from auth.activity import activity_recorder
+from auth.jwt_handler import _token_cache, cached_token_subject
+
+# Configure logging; records are written by a background thread (see core.log)
+configure_logging()
+logger = logging.getLogger(__name__)
 
-
-ROOT_DIR = Path(__file__).parent
-load_dotenv(ROOT_DIR / '.env')
-
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
-
-# Create the main app without a prefix
-app = FastAPI()
-
-# Create a router with the /api prefix
-api_router = APIRouter(prefix="/api")
-
-
-# Define Models
-class StatusCheck(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    client_name: str
-    timestamp: datetime = Field(default_factory=datetime.utcnow)
-
-class StatusCheckCreate(BaseModel):
-    client_name: str
-
-# Add your routes to the router instead of directly to app
-@api_router.get("/")
-async def root():
-    return {"message": "Hello World"}
-
-@api_router.post("/status", response_model=StatusCheck)
-async def create_status_check(input: StatusCheckCreate):
-    status_dict = input.dict()
-    status_obj = StatusCheck(**status_dict)
-    _ = await db.status_checks.insert_one(status_obj.dict())
-    return status_obj
-
-@api_router.get("/status", response_model=List[StatusCheck])
-async def get_status_checks():
-    status_checks = await db.status_checks.find().to_list(1000)
-    return [StatusCheck(**status_check) for status_check in status_checks]
-
-# Include the router in the main app
-app.include_router(api_router)
-
-# Set up database dependency injection for auth module
-from auth import dependencies, routes
-dependencies.db = db
-routes.db = db
-
-app.include_router(auth_router, prefix="/api")
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
-    allow_methods=["*"],
-    allow_headers=["*"],
+# Modules that reach the database through a module-level db reference
+DATABASE_MODULES = (
+    dependencies, routes, oauth_state, revocation, rotation,
+    status_routes, files_routes, transfers, metadata_cache, rate_limit,
 )
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
+def bind_database(db) -> None:
+    """Point every module that holds a db reference at db"""
+    for module in DATABASE_MODULES:
+        module.db = db
+
+
+def _register_component_stats() -> None:
+    """Component stats exposed on /metrics"""
+    registry.register_stats("user_cache", user_cache.stats)
+    registry.register_stats("token_cache", _token_cache.stats)
+    registry.register_stats("password_hash_pool", hashing_pool.stats)
+    registry.register_stats("status_write_buffer", write_buffer.stats)
+    registry.register_stats("activity_recorder", activity_recorder.stats)
+    registry.register_stats("token_revocation", revocation.revocation_list.stats)
+    registry.register_stats("refresh_rotation", rotation.refresh_rotator.stats)
+    registry.register_stats("file_transfers", transfers.transfer_limiter.stats)
+    registry.register_stats("file_metadata_cache", metadata_cache.file_metadata_cache.stats)
+    registry.register_stats("file_chunk_cache", chunk_cache.stats)
+    registry.register_stats("rate_limit", rate_limit.rate_limit_stats)
+    registry.register_stats("cache_coherence", cache_invalidator.stats)
+    registry.register_stats("logging", log_stats)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open the Mongo client and start background services for the life of the app.
+
+    An app built with create_app(db=...) uses that database and leaves its
+    client alone.
+    """
+    client = None
+    db = app.state.db
+    if db is None:
+        # Motor is only needed once the app starts serving
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+        db = client[os.environ['DB_NAME']]
+        app.state.db = db
+    app.state.mongo_client = client
+    bind_database(db)
+
+    token_refresher = None
+    from auth.token_refresher import OAUTH_REFRESH_SCHEDULER_ENABLED
+    if OAUTH_REFRESH_SCHEDULER_ENABLED:
+        # Imported before bootstrap_indexes so its indexes get created
+        from auth.token_refresher import TokenRefreshScheduler
+
+        token_refresher = TokenRefreshScheduler(db)
+        registry.register_stats("oauth_token_refresher", token_refresher.stats)
+
+    # The shared HTTP client is created on the first outbound call
+    await bootstrap_indexes(db)
+    cache_invalidator.start(db)
+    activity_recorder.start(db)
+    await revocation.revocation_list.start()
+    rotation.refresh_rotator.start()
+    await chunk_cache.start()
+    if token_refresher is not None:
+        token_refresher.start()
+    if STATUS_WRITE_BUFFER_ENABLED:
+        write_buffer.start(db)
+    if STATUS_ROLLUP_MODE == "job":
+        rollup_job.start(db)
+
+    try:
+        yield
+    finally:
+        if token_refresher is not None:
+            await token_refresher.stop()
+        await write_buffer.stop()
+        await rollup_job.stop()
+        await activity_recorder.stop()
+        await rotation.refresh_rotator.stop()
+        await revocation.revocation_list.stop()
+        await cache_invalidator.stop()
+        await stop_index_bootstrap()
+        await close_http_client()
+        hashing_pool.shutdown()
+        if client is not None:
+            client.close()
+            app.state.mongo_client = None
+            app.state.db = None
+
+
+def create_app(db=None) -> FastAPI:
+    """Build the API app; the Mongo client is opened by its lifespan unless db is given"""
+
+    # Create the main app without a prefix
+    app = FastAPI(default_response_class=FastJSONResponse, lifespan=lifespan)
+    app.state.db = db
+    app.state.mongo_client = None
+    if db is not None:
+        bind_database(db)
+
+    # Create a router with the /api prefix
+    api_router = APIRouter(prefix="/api")
+
+    # Add your routes to the router instead of directly to app
+    @api_router.get("/")
+    async def root():
+        return {"message": "Hello World"}
+
+    # Include the router in the main app
+    api_router.include_router(status_router)
+    api_router.include_router(files_router)
+    app.include_router(api_router)
+    app.include_router(auth_router, prefix="/api")
+
+    _register_component_stats()
+
+    # Added first so it runs inside CORS and metrics: 429s get CORS headers and are counted
+    if RATE_LIMIT_ENABLED:
+        app.add_middleware(
+            RateLimitMiddleware,
+            limiter=rate_limit.rate_limiter,
+            shared=rate_limit.shared_rate_limiter,
+            subject_resolver=cached_token_subject,
+        )
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["X-Next-Cursor", "Link", "X-Request-ID"],
+    )
+
+    if METRICS_ENABLED:
+        app.add_middleware(MetricsMiddleware)
+
+        @app.get("/metrics", include_in_schema=False)
+        async def metrics(request: Request):
+            if not metrics_authorized(request.headers.get("authorization")):
+                raise HTTPException(
+                    status_code=status.HTTP_401_UNAUTHORIZED,
+                    detail="Não autorizado",
+                    headers={"WWW-Authenticate": "Bearer"},
+                )
+            return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+    # Outermost, so every record logged while serving a request carries its id
+    app.add_middleware(RequestContextMiddleware)
+
+    return app
+
+
+app = create_app()
@@ -0,0 +1,183 @@
+"""
+Per-client, per-minute and per-hour counters for status checks
+"""
+import asyncio
+import logging
+import os
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, Optional
+
+from pymongo import ASCENDING, UpdateOne
+
+from core.indexes import register_index, register_query_shape
+
+logger = logging.getLogger(__name__)
+
+# "job": periodic aggregation pipeline over recent raw documents; "incremental":
+# update counters on every insert, at the cost of a second bulk_write per
+# ingest; "off": no rollups
+STATUS_ROLLUP_MODE = os.environ.get("STATUS_ROLLUP_MODE", "job")
+STATUS_ROLLUP_JOB_INTERVAL_SECONDS = float(os.environ.get("STATUS_ROLLUP_JOB_INTERVAL_SECONDS", "60"))
+# Raw status checks older than this are deleted by a TTL index (unset keeps them forever)
+STATUS_CHECK_RAW_TTL_SECONDS = os.environ.get("STATUS_CHECK_RAW_TTL_SECONDS")
+
+ROLLUP_COLLECTION = "status_check_rollups"
+GRANULARITIES = {
+    "minute": timedelta(minutes=1),
+    "hour": timedelta(hours=1),
+}
+
+register_index(
+    ROLLUP_COLLECTION,
+    [("granularity", ASCENDING), ("client_name", ASCENDING), ("bucket", ASCENDING)],
+    unique=True,
+    name="granularity_client_bucket",
+)
+register_index(ROLLUP_COLLECTION, [("granularity", ASCENDING), ("bucket", ASCENDING)], name="granularity_bucket")
+register_query_shape(
+    "rollups by range",
+    ROLLUP_COLLECTION,
+    {"granularity": "hour", "bucket": {"$gte": datetime(2000, 1, 1), "$lt": datetime(2000, 1, 2)}},
+    sort=[("bucket", ASCENDING)],
+)
+if STATUS_CHECK_RAW_TTL_SECONDS:
+    register_index(
+        "status_checks",
+        [("timestamp", ASCENDING)],
+        expireAfterSeconds=int(STATUS_CHECK_RAW_TTL_SECONDS),
+        name="timestamp_ttl",
+    )
+
+
+def naive_utc(timestamp: datetime) -> datetime:
+    """timestamp as the naive UTC datetime buckets are stored with"""
+    if timestamp.tzinfo is None:
+        return timestamp
+    return timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def truncate(timestamp: datetime, granularity: str) -> datetime:
+    """Start of the bucket containing timestamp"""
+    if granularity == "hour":
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(second=0, microsecond=0)
+
+
+async def record_rollups(db, docs: Iterable[Dict[str, Any]]) -> None:
+    """Increment the counters of every bucket touched by docs in one bulk write"""
+    counts: Counter = Counter()
+    for doc in docs:
+        for granularity in GRANULARITIES:
+            counts[(granularity, doc["client_name"], truncate(doc["timestamp"], granularity))] += 1
+    if not counts:
+        return
+
+    operations = [
+        UpdateOne(
+            {"granularity": granularity, "client_name": client_name, "bucket": bucket},
+            {"$inc": {"count": count}},
+            upsert=True,
+        )
+        for (granularity, client_name, bucket), count in counts.items()
+    ]
+    await db[ROLLUP_COLLECTION].bulk_write(operations, ordered=False)
+
+
+async def rebuild_rollups(db, since: datetime) -> None:
+    """Recompute every bucket from since onwards with an aggregation pipeline.
+
+    Buckets are replaced rather than incremented, so reruns are idempotent.
+    """
+    for granularity in GRANULARITIES:
+        start = truncate(since, granularity)
+        pipeline = [
+            {"$match": {"timestamp": {"$gte": start}}},
+            {"$group": {
+                "_id": {
+                    "client_name": "$client_name",
+                    "bucket": {"$dateTrunc": {"date": "$timestamp", "unit": granularity}},
+                },
+                "count": {"$sum": 1},
+            }},
+            {"$project": {
+                "_id": 0,
+                "granularity": {"$literal": granularity},
+                "client_name": "$_id.client_name",
+                "bucket": "$_id.bucket",
+                "count": 1,
+            }},
+            {"$merge": {
+                "into": ROLLUP_COLLECTION,
+                "on": ["granularity", "client_name", "bucket"],
+                "whenMatched": "replace",
+                "whenNotMatched": "insert",
+            }},
+        ]
+        async for _ in db.status_checks.aggregate(pipeline):
+            pass
+
+
+class RollupJob:
+    """Periodically rebuilds the current and previous hour of rollups.
+
+    The rebuild replaces buckets with counts of the raw documents still
+    present, so it refuses to start when the raw TTL would delete documents
+    of a bucket it still rebuilds.
+    """
+
+    def __init__(
+        self,
+        interval: float = STATUS_ROLLUP_JOB_INTERVAL_SECONDS,
+        raw_ttl: Optional[float] = float(STATUS_CHECK_RAW_TTL_SECONDS) if STATUS_CHECK_RAW_TTL_SECONDS else None,
+    ):
+        self.interval = interval
+        self.raw_ttl = raw_ttl
+        self.db = None
+        self._task: Optional[asyncio.Task] = None
+        self.runs = 0
+
+    @property
+    def window(self) -> timedelta:
+        """How far back the oldest rebuilt bucket can start"""
+        # since() reaches an hour and an interval back, then truncates to the start of that hour
+        return timedelta(hours=2, seconds=self.interval)
+
+    def since(self) -> datetime:
+        # Reach back past the interval so late inserts into the previous bucket are counted
+        return datetime.utcnow() - timedelta(hours=1, seconds=self.interval)
+
+    def start(self, db) -> None:
+        if self.raw_ttl is not None and timedelta(seconds=self.raw_ttl) < self.window:
+            raise RuntimeError(
+                f"STATUS_CHECK_RAW_TTL_SECONDS={self.raw_ttl:g} is shorter than the rollup job window "
+                f"of {self.window.total_seconds():g}s; the job would overwrite buckets with partial counts. "
+                "Raise the TTL or use STATUS_ROLLUP_MODE=incremental"
+            )
+        self.db = db
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="status-rollup-job")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await rebuild_rollups(self.db, self.since())
+                self.runs += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Status check rollup job failed")
+            await asyncio.sleep(self.interval)
+
+
+rollup_job = RollupJob()
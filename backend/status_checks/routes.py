@@ -0,0 +1,201 @@
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from datetime import datetime
+from typing import List, Optional
+import base64
+import json
+import os
+
+import orjson
+
+from core.responses import FastJSONResponse, model_response
+from .models import StatusCheck, StatusCheckCreate
+from .rollups import GRANULARITIES, ROLLUP_COLLECTION, naive_utc
+from .write_buffer import insert_status_checks, write_buffer
+
+router = APIRouter(prefix="/status", tags=["status"])
+
+# Database will be injected from main app
+db = None
+
+STATUS_LIST_DEFAULT_LIMIT = int(os.environ.get("STATUS_LIST_DEFAULT_LIMIT", "1000"))
+STATUS_LIST_MAX_LIMIT = int(os.environ.get("STATUS_LIST_MAX_LIMIT", "10000"))
+STATUS_STREAM_BATCH_SIZE = int(os.environ.get("STATUS_STREAM_BATCH_SIZE", "500"))
+STATUS_BULK_MAX_ITEMS = int(os.environ.get("STATUS_BULK_MAX_ITEMS", "10000"))
+STATUS_BULK_CHUNK_SIZE = int(os.environ.get("STATUS_BULK_CHUNK_SIZE", "1000"))
+STATUS_ROLLUP_MAX_POINTS = int(os.environ.get("STATUS_ROLLUP_MAX_POINTS", "10000"))
+
+STATUS_FIELDS = tuple(StatusCheck.model_fields)
+# Keyset pagination order; also the order of the supporting compound index
+SORT_ORDER = [("timestamp", 1), ("id", 1)]
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def encode_cursor(doc: dict) -> str:
+    """Opaque cursor pointing just past doc in (timestamp, id) order"""
+    raw = json.dumps([doc["timestamp"].isoformat(), doc["id"]])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> dict:
+    """Mongo filter selecting documents after the cursor position"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        timestamp, last_id = json.loads(base64.urlsafe_b64decode(padded))
+        timestamp = datetime.fromisoformat(timestamp)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+    return {"$or": [
+        {"timestamp": {"$gt": timestamp}},
+        {"timestamp": timestamp, "id": {"$gt": last_id}},
+    ]}
+
+
+def parse_fields(fields: Optional[str]) -> dict:
+    """Projection for the requested fields; id and timestamp are always kept for the cursor"""
+    projection = {"_id": 0}
+    if not fields:
+        return projection
+
+    requested = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = requested - set(STATUS_FIELDS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Campos desconhecidos: {', '.join(sorted(unknown))}")
+
+    for name in requested | {"id", "timestamp"}:
+        projection[name] = 1
+    return projection
+
+
+async def stream_ndjson(cursor):
+    """Yield one JSON document per line, a Motor batch at a time"""
+    lines = []
+    async for doc in cursor:
+        lines.append(orjson.dumps(doc))
+        if len(lines) >= STATUS_STREAM_BATCH_SIZE:
+            yield b"\n".join(lines) + b"\n"
+            lines = []
+    if lines:
+        yield b"\n".join(lines) + b"\n"
+
+
+def parse_bulk_body(body: bytes, content_type: str) -> list:
+    """Items of a bulk request: a JSON array, or one JSON object per line for NDJSON"""
+    try:
+        if NDJSON_MEDIA_TYPE in content_type:
+            return [orjson.loads(line) for line in body.splitlines() if line.strip()]
+        items = orjson.loads(body)
+    except orjson.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Corpo da requisição inválido")
+
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Esperado um array JSON ou NDJSON")
+    return items
+
+
+@router.post("", response_model=StatusCheck)
+async def create_status_check(input: StatusCheckCreate):
+    status_dict = input.model_dump()
+    status_obj = StatusCheck(**status_dict)
+    if write_buffer.running:
+        await write_buffer.add(status_obj.model_dump())
+    else:
+        # Same write path as the buffer and bulk endpoint, so rollups stay in step
+        error, = await insert_status_checks(db, [status_obj.model_dump()])
+        if error is not None:
+            raise error
+    return model_response(status_obj)
+
+
+@router.post("/bulk")
+async def create_status_checks_bulk(request: Request):
+    """Insert many status checks from a JSON array or an NDJSON body with unordered insert_many"""
+    items = parse_bulk_body(await request.body(), request.headers.get("content-type", ""))
+    if len(items) > STATUS_BULK_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Máximo de {STATUS_BULK_MAX_ITEMS} itens por requisição")
+
+    docs = []
+    for index, item in enumerate(items):
+        try:
+            docs.append(StatusCheck(**StatusCheckCreate.model_validate(item).model_dump()).model_dump())
+        except (ValidationError, TypeError) as e:
+            raise HTTPException(status_code=422, detail=f"Item {index} inválido: {e}")
+
+    failed = 0
+    for start in range(0, len(docs), STATUS_BULK_CHUNK_SIZE):
+        results = await insert_status_checks(db, docs[start:start + STATUS_BULK_CHUNK_SIZE])
+        failed += sum(1 for error in results if error is not None)
+
+    return {"inserted": len(docs) - failed, "failed": failed}
+
+
+@router.get("", response_model=List[StatusCheck])
+async def get_status_checks(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=STATUS_LIST_MAX_LIMIT),
+    after: Optional[str] = Query(None, description="Cursor from the previous page's X-Next-Cursor header"),
+    fields: Optional[str] = Query(None, description="Comma separated subset of fields to return"),
+    format: Optional[str] = Query(None, pattern="^(json|ndjson)$"),
+    batch_size: int = Query(STATUS_STREAM_BATCH_SIZE, ge=1, le=STATUS_LIST_MAX_LIMIT),
+):
+    """List status checks in (timestamp, id) order using keyset pagination.
+
+    JSON pages carry the next page cursor in X-Next-Cursor/Link headers. NDJSON
+    (format=ndjson or Accept: application/x-ndjson) streams the whole range in
+    constant memory unless a limit is given.
+    """
+    query = decode_cursor(after) if after else {}
+    projection = parse_fields(fields)
+    ndjson = format == "ndjson" or (format is None and NDJSON_MEDIA_TYPE in request.headers.get("accept", ""))
+
+    cursor = db.status_checks.find(query, projection).sort(SORT_ORDER).batch_size(batch_size)
+
+    if ndjson:
+        if limit is not None:
+            cursor = cursor.limit(limit)
+        return StreamingResponse(stream_ndjson(cursor), media_type=NDJSON_MEDIA_TYPE)
+
+    limit = limit or STATUS_LIST_DEFAULT_LIMIT
+    status_checks = await cursor.limit(limit).to_list(limit)
+
+    headers = {}
+    if len(status_checks) == limit:
+        next_cursor = encode_cursor(status_checks[-1])
+        headers["X-Next-Cursor"] = next_cursor
+        next_url = request.url.include_query_params(after=next_cursor)
+        headers["Link"] = f'<{next_url}>; rel="next"'
+
+    return FastJSONResponse(content=status_checks, headers=headers)
+
+
+@router.get("/rollups")
+async def get_status_rollups(
+    granularity: str = Query("hour", pattern="^(minute|hour)$"),
+    start: Optional[datetime] = Query(None, description="Inclusive start (UTC); defaults to 60 buckets ago"),
+    end: Optional[datetime] = Query(None, description="Exclusive end (UTC); defaults to now"),
+    client_name: Optional[str] = None,
+):
+    """Status check counts per client and time bucket, served from the rollup collection"""
+    # Buckets are naive UTC; an offset in the query would not compare with them
+    end = naive_utc(end) if end is not None else datetime.utcnow()
+    start = naive_utc(start) if start is not None else end - 60 * GRANULARITIES[granularity]
+    if start >= end:
+        raise HTTPException(status_code=400, detail="Intervalo inválido")
+
+    query = {"granularity": granularity, "bucket": {"$gte": start, "$lt": end}}
+    if client_name is not None:
+        query["client_name"] = client_name
+
+    cursor = db[ROLLUP_COLLECTION].find(
+        query, {"_id": 0, "client_name": 1, "bucket": 1, "count": 1}
+    ).sort([("bucket", 1), ("client_name", 1)])
+    rollups = await cursor.to_list(STATUS_ROLLUP_MAX_POINTS)
+
+    return FastJSONResponse(content={
+        "granularity": granularity,
+        "start": start,
+        "end": end,
+        "buckets": rollups,
+    })
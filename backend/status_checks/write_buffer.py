@@ -0,0 +1,202 @@
+"""
+In-process write buffer that coalesces single status check inserts into insert_many batches
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+from pymongo.errors import BulkWriteError
+
+from .rollups import STATUS_ROLLUP_MODE, record_rollups
+
+logger = logging.getLogger(__name__)
+
+STATUS_WRITE_BUFFER_ENABLED = os.environ.get("STATUS_WRITE_BUFFER_ENABLED", "false").lower() == "true"
+STATUS_WRITE_BUFFER_MAX_BATCH = int(os.environ.get("STATUS_WRITE_BUFFER_MAX_BATCH", "500"))
+STATUS_WRITE_BUFFER_FLUSH_INTERVAL = float(os.environ.get("STATUS_WRITE_BUFFER_FLUSH_INTERVAL", "0.05"))
+STATUS_WRITE_BUFFER_MAX_PENDING = int(os.environ.get("STATUS_WRITE_BUFFER_MAX_PENDING", "20000"))
+# "after_flush": respond once the batch is in Mongo; "before_flush": respond once queued
+STATUS_WRITE_BUFFER_DURABILITY = os.environ.get("STATUS_WRITE_BUFFER_DURABILITY", "after_flush")
+STATUS_WRITE_BUFFER_RETRY_AFTER = int(os.environ.get("STATUS_WRITE_BUFFER_RETRY_AFTER", "1"))
+
+
+async def insert_status_checks(db, docs: List[Dict[str, Any]]) -> List[Optional[Exception]]:
+    """Unordered insert_many; returns one entry per doc, None if it was written"""
+    results: List[Optional[Exception]] = [None] * len(docs)
+    if not docs:
+        return results
+    try:
+        await db.status_checks.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        for error in e.details.get("writeErrors", []):
+            results[error["index"]] = RuntimeError(error.get("errmsg", "write error"))
+
+    if STATUS_ROLLUP_MODE == "incremental":
+        try:
+            await record_rollups(db, [doc for doc, error in zip(docs, results) if error is None])
+        except Exception:
+            # The raw documents are written; the periodic job can rebuild the counters
+            logger.exception("Failed to update status check rollups")
+    return results
+
+
+class StatusWriteBuffer:
+    """Groups inserts into batches flushed on size or time.
+
+    With after_flush durability add() resolves once its batch is acknowledged
+    by Mongo; with before_flush it returns as soon as the document is queued
+    and a failed flush loses the batch (it is logged and counted).
+    """
+
+    def __init__(
+        self,
+        max_batch: int = STATUS_WRITE_BUFFER_MAX_BATCH,
+        flush_interval: float = STATUS_WRITE_BUFFER_FLUSH_INTERVAL,
+        max_pending: int = STATUS_WRITE_BUFFER_MAX_PENDING,
+        durability: str = STATUS_WRITE_BUFFER_DURABILITY,
+        retry_after: int = STATUS_WRITE_BUFFER_RETRY_AFTER,
+    ):
+        if durability not in ("after_flush", "before_flush"):
+            raise ValueError(f"Unknown write buffer durability: {durability}")
+        self.max_batch = max(1, max_batch)
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.durability = durability
+        self.retry_after = retry_after
+        self.db = None
+        self._pending: List[Tuple[Dict[str, Any], Optional[asyncio.Future]]] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+        # Metrics
+        self.rejected = 0
+        self.flushes = 0
+        self.flushed_docs = 0
+        self.failed_docs = 0
+        self.flush_latency_total = 0.0
+        self.flush_latency_max = 0.0
+        self.last_batch_size = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def start(self, db) -> None:
+        self.db = db
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(), name="status-write-buffer")
+
+    async def stop(self) -> None:
+        """Stop the flush loop and drain everything still queued.
+
+        The loop is asked to stop rather than cancelled, so a batch being
+        written is never abandoned halfway.
+        """
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        try:
+            await self._task
+        finally:
+            self._task = None
+            self._stopping = False
+        while self._pending:
+            await self.flush()
+
+    async def add(self, doc: Dict[str, Any]) -> None:
+        if len(self._pending) >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Fila de escrita cheia, tente novamente em instantes",
+                headers={"Retry-After": str(self.retry_after)},
+            )
+
+        future = None
+        if self.durability == "after_flush":
+            future = asyncio.get_running_loop().create_future()
+        self._pending.append((doc, future))
+        if len(self._pending) >= self.max_batch:
+            self._wakeup.set()
+
+        if future is not None:
+            await future
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            while self._pending:
+                await self.flush()
+                if len(self._pending) < self.max_batch and not self._stopping:
+                    break
+
+    async def flush(self) -> None:
+        """Write one batch of queued documents"""
+        batch = self._pending[:self.max_batch]
+        del self._pending[:self.max_batch]
+        if not batch:
+            return
+
+        started = time.perf_counter()
+        try:
+            results = await insert_status_checks(self.db, [doc for doc, _ in batch])
+        except asyncio.CancelledError:
+            # Whether the batch was written is unknown; its callers must not wait forever
+            self.failed_docs += len(batch)
+            error = RuntimeError("Status check flush cancelled")
+            for _, future in batch:
+                if future is not None and not future.done():
+                    future.set_exception(error)
+            raise
+        except Exception as e:
+            logger.exception("Status check flush of %d documents failed", len(batch))
+            results = [e] * len(batch)
+
+        elapsed = time.perf_counter() - started
+        self.flushes += 1
+        self.last_batch_size = len(batch)
+        self.flush_latency_total += elapsed
+        self.flush_latency_max = max(self.flush_latency_max, elapsed)
+
+        for (_, future), error in zip(batch, results):
+            if error is None:
+                self.flushed_docs += 1
+            else:
+                self.failed_docs += 1
+            if future is not None and not future.done():
+                if error is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(error)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "durability": self.durability,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "rejected": self.rejected,
+            "flushes": self.flushes,
+            "flushed_docs": self.flushed_docs,
+            "failed_docs": self.failed_docs,
+            "last_batch_size": self.last_batch_size,
+            "flush_latency_seconds_total": self.flush_latency_total,
+            "flush_latency_seconds_max": self.flush_latency_max,
+        }
+
+
+write_buffer = StatusWriteBuffer()
@@ -26,26 +26,42 @@ export const AuthProvider = ({ children }) => {
       axios.defaults.headers.common['Authorization'] = `Bearer ${token}`;
     }
 
+    // Refresh tokens are single use: requests failing together share one refresh
+    let refreshPromise = null;
+    const refreshTokens = (refreshToken) => {
+      if (!refreshPromise) {
+        refreshPromise = axios.post(`${API}/auth/refresh`, { refresh_token: refreshToken })
+          .then((response) => {
+            const { access_token, refresh_token } = response.data;
+            localStorage.setItem('access_token', access_token);
+            localStorage.setItem('refresh_token', refresh_token);
+            axios.defaults.headers.common['Authorization'] = `Bearer ${access_token}`;
+            return access_token;
+          })
+          .finally(() => {
+            refreshPromise = null;
+          });
+      }
+      return refreshPromise;
+    };
+
     // Add response interceptor to handle token expiry
     const responseInterceptor = axios.interceptors.response.use(
       (response) => response,
       async (error) => {
-        if (error.response?.status === 401) {
+        const config = error.config;
+        const isAuthCall = config?.url?.includes('/auth/refresh') || config?.url?.includes('/auth/logout');
+        if (error.response?.status === 401 && config && !config._retry && !isAuthCall) {
           // Token expired, try to refresh
           const refreshToken = localStorage.getItem('refresh_token');
           if (refreshToken) {
             try {
-              const response = await axios.post(`${API}/auth/refresh`, {
-                refresh_token: refreshToken
-              });
+              const access_token = await refreshTokens(refreshToken);
               
-              const { access_token } = response.data;
-              localStorage.setItem('access_token', access_token);
-              axios.defaults.headers.common['Authorization'] = `Bearer ${access_token}`;
-              
-              // Retry original request
-              error.config.headers['Authorization'] = `Bearer ${access_token}`;
-              return axios.request(error.config);
+              // Retry original request once
+              config._retry = true;
+              config.headers['Authorization'] = `Bearer ${access_token}`;
+              return axios.request(config);
             } catch (refreshError) {
               // Refresh failed, logout user
               logout();
@@ -132,6 +148,17 @@ export const AuthProvider = ({ children }) => {
   };
 
   const logout = () => {
+    // Revoke tokens on the server (best effort; local state is cleared regardless)
+    const accessToken = localStorage.getItem('access_token');
+    const refreshToken = localStorage.getItem('refresh_token');
+    if (accessToken) {
+      axios.post(
+        `${API}/auth/logout`,
+        { refresh_token: refreshToken },
+        { headers: { Authorization: `Bearer ${accessToken}` } }
+      ).catch(() => {});
+    }
+
     // Clear tokens
     localStorage.removeItem('access_token');
     localStorage.removeItem('refresh_token');
@@ -0,0 +1,79 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+# Sets test-friendly environment defaults before the app reads its configuration
+from benchmarks.harness import (  # noqa: E402
+    StubDriveServer,
+    StubTokenServer,
+    app_client,
+    install_database,
+    mock_database,
+    start_services,
+    stop_services,
+)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def db():
+    from auth.user_cache import user_cache
+
+    database = mock_database(f"test_{id(object())}")
+    install_database(database)
+    # Users cached by an earlier test's database would shadow this one's
+    user_cache.clear()
+    return database
+
+
+@pytest.fixture
+def token_server():
+    return StubTokenServer()
+
+
+@pytest.fixture
+def drive_server():
+    return StubDriveServer()
+
+
+@pytest.fixture
+async def services(db, token_server, drive_server):
+    await start_services(db, token_server, drive_server)
+    yield
+    await stop_services()
+
+
+@pytest.fixture
+async def client(services):
+    async with app_client() as http_client:
+        yield http_client
+
+
+async def signup(client, username: str) -> dict:
+    response = await client.post(
+        "/api/auth/signup",
+        json={"username": username, "email": f"{username}@example.com", "password": "secret"},
+    )
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def bearer(token: str) -> dict:
+    return {"Authorization": f"Bearer {token}"}
+
+
+async def connect_gdrive(client, headers: dict, token_server, drive_server) -> None:
+    """Run the OAuth flow against the stubs; the drive accepts the token issued"""
+    response = await client.get("/api/auth/oauth/gdrive", headers=headers)
+    state = response.json()["state"]
+    response = await client.get("/api/auth/callback/gdrive", params={"code": "code", "state": state})
+    assert response.status_code == 200, response.text
+    drive_server.valid_token = f"stub-access-{token_server.calls}"
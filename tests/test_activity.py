@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from auth.activity import ActivityRecorder
+
+pytestmark = pytest.mark.anyio
+
+
+async def add_users(db, *user_ids: str):
+    await db.users.insert_many([
+        {"id": user_id, "username": user_id, "email": f"{user_id}@example.com", "version": 0}
+        for user_id in user_ids
+    ])
+
+
+async def test_updates_are_deduplicated_per_user_and_flushed_together(db):
+    await add_users(db, "u1", "u2")
+    recorder = ActivityRecorder(flush_interval=60)
+    recorder.start(db)
+    base = datetime(2026, 1, 1)
+
+    for minutes in (3, 1, 2):
+        recorder.record_seen("u1", base + timedelta(minutes=minutes))
+    await recorder.record_login(db, "u2", base)
+    recorder.record_seen("u2", base + timedelta(minutes=5))
+    assert recorder.pending == 2
+
+    await recorder.stop()
+
+    u1, u2 = [await db.users.find_one({"id": user_id}) for user_id in ("u1", "u2")]
+    # The latest timestamp wins, whatever order they were recorded in
+    assert u1["last_seen"] == base + timedelta(minutes=3)
+    assert u2["last_login"] == base
+    assert u2["last_seen"] == base + timedelta(minutes=5)
+    # Only logins change the document version
+    assert (u1["version"], u2["version"]) == (0, 1)
+    assert recorder.stats()["flushes"] == 1
+    assert recorder.stats()["flushed_users"] == 2
+
+
+async def test_full_queue_drops_last_seen_and_writes_logins_directly(db):
+    await add_users(db, "u1", "u2", "u3")
+    recorder = ActivityRecorder(flush_interval=60, max_pending=1)
+    recorder.start(db)
+
+    recorder.record_seen("u1")
+    recorder.record_seen("u2")
+    await recorder.record_login(db, "u3")
+
+    assert recorder.stats()["dropped"] == 1
+    assert recorder.pending == 1
+    assert "last_login" in await db.users.find_one({"id": "u3"})
+    await recorder.stop()
+    assert "last_seen" not in await db.users.find_one({"id": "u2"})
+
+
+async def test_failed_flush_keeps_the_batch(db, monkeypatch):
+    await add_users(db, "u1")
+    recorder = ActivityRecorder(flush_interval=60)
+    recorder.start(db)
+    recorder.record_seen("u1")
+
+    async def failing_bulk_write(self, *args, **kwargs):
+        raise RuntimeError("primary stepped down")
+
+    bulk_write = type(db.users).bulk_write
+    monkeypatch.setattr(type(db.users), "bulk_write", failing_bulk_write)
+    assert await recorder.flush() is False
+    assert recorder.pending == 1
+
+    monkeypatch.setattr(type(db.users), "bulk_write", bulk_write)
+    assert await recorder.flush() is True
+    assert recorder.pending == 0
+    assert "last_seen" in await db.users.find_one({"id": "u1"})
+    await recorder.stop()
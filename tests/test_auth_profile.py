@@ -0,0 +1,40 @@
+import pytest
+
+from auth.user_cache import invalidate_user
+
+from .conftest import bearer, signup
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_me_hides_provider_tokens_and_credentials(client, db):
+    tokens = await signup(client, "profile")
+    await db.users.update_one({"username": "profile"}, {"$set": {
+        "oauth_providers": {
+            "gdrive": {"access_token": "ya29.secret", "refresh_token": "1//secret", "scope": ["drive"]},
+            "terabox": {"username": "me", "auth_header": "Basic bWU6cGFzcw=="},
+        },
+    }, "$inc": {"version": 1}})
+    invalidate_user(username="profile")
+
+    response = await client.get("/api/auth/me", headers=bearer(tokens["access_token"]))
+
+    assert response.status_code == 200, response.text
+    assert "secret" not in response.text and "Basic" not in response.text
+    providers = response.json()["oauth_providers"]
+    assert providers["gdrive"]["connected"] is True
+    assert providers["gdrive"]["scope"] == ["drive"]
+    assert providers["terabox"]["connected"] is True
+    assert set(providers["terabox"]) == {"connected", "expires_at", "scope", "connected_at"}
+
+
+async def test_placeholder_providers_are_off_by_default(client):
+    tokens = await signup(client, "placeholders")
+    headers = bearer(tokens["access_token"])
+
+    response = await client.post("/api/auth/terabox/connect", headers=headers, json={"username": "me", "password": "pass"})
+    assert response.status_code == 400
+
+    for provider in ("proton", "terabox"):
+        assert (await client.get("/api/files", params={"providers": provider}, headers=headers)).status_code == 400
+        assert (await client.get(f"/api/files/{provider}/f1/content", headers=headers)).status_code == 400
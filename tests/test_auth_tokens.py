@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+from auth.rotation import refresh_rotator
+
+from .conftest import bearer, signup
+
+pytestmark = pytest.mark.anyio
+
+
+async def refresh(client, refresh_token: str):
+    return await client.post("/api/auth/refresh", json={"refresh_token": refresh_token})
+
+
+async def test_concurrent_refresh_of_one_token_returns_a_single_pair(client):
+    tokens = await signup(client, "concurrent")
+
+    responses = await asyncio.gather(*(refresh(client, tokens["refresh_token"]) for _ in range(5)))
+
+    assert [response.status_code for response in responses] == [200] * 5
+    pairs = {(response.json()["access_token"], response.json()["refresh_token"]) for response in responses}
+    assert len(pairs) == 1
+    (access_token, _), = pairs
+    assert (await client.get("/api/auth/me", headers=bearer(access_token))).status_code == 200
+
+
+async def test_refresh_reuse_after_grace_window_revokes_the_family(client, monkeypatch):
+    monkeypatch.setattr(refresh_rotator, "grace_seconds", 0.0)
+    monkeypatch.setattr(refresh_rotator._grace, "ttl", 0.0)
+    tokens = await signup(client, "reuse")
+
+    rotated = await refresh(client, tokens["refresh_token"])
+    assert rotated.status_code == 200
+    rotated = rotated.json()
+
+    reused = await refresh(client, tokens["refresh_token"])
+    assert reused.status_code == 401
+
+    # Every token of the login session is dead, including the newest pair
+    assert (await refresh(client, rotated["refresh_token"])).status_code == 401
+    assert (await client.get("/api/auth/me", headers=bearer(rotated["access_token"]))).status_code == 401
+    assert (await client.get("/api/auth/me", headers=bearer(tokens["access_token"]))).status_code == 401
+
+
+async def test_reuse_within_grace_window_does_not_revoke_the_family(client):
+    tokens = await signup(client, "grace")
+
+    first = await refresh(client, tokens["refresh_token"])
+    again = await refresh(client, tokens["refresh_token"])
+
+    assert first.status_code == again.status_code == 200
+    assert first.json() == again.json()
+    assert (await client.get("/api/auth/me", headers=bearer(first.json()["access_token"]))).status_code == 200
+
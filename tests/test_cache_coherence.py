@@ -0,0 +1,154 @@
+import asyncio
+from typing import Any, Dict, List, Optional
+
+import pytest
+from pymongo.errors import OperationFailure
+
+from auth.models import User
+from auth.user_cache import UserCache
+from core.cache_coherence import CHECKPOINT_COLLECTION, CacheInvalidator
+
+pytestmark = pytest.mark.anyio
+
+
+class StubStream:
+    """Change stream fed from a queue; queued exceptions are raised to the reader"""
+
+    def __init__(self, queue: "asyncio.Queue", resume_after: Optional[Dict[str, Any]]):
+        self.queue = queue
+        self.resume_token = resume_after or {"_data": "open"}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        item = await self.queue.get()
+        if isinstance(item, Exception):
+            raise item
+        self.resume_token = {"_data": item.pop("token")}
+        return item
+
+
+class ChangeStreamDatabase:
+    """The mock database plus a watch() served by StubStream"""
+
+    def __init__(self, db):
+        self.db = db
+        self.queue: "asyncio.Queue" = asyncio.Queue()
+        self.opened: List[Optional[Dict[str, Any]]] = []
+
+    def __getitem__(self, name: str):
+        return self.db[name]
+
+    def watch(self, pipeline, full_document=None, resume_after=None):
+        self.opened.append(resume_after)
+        return StubStream(self.queue, resume_after)
+
+    async def settle(self) -> None:
+        while not self.queue.empty():
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.01)
+
+
+def user_change(token: str, user: User, operation: str = "update") -> Dict[str, Any]:
+    return {
+        "token": token,
+        "operationType": operation,
+        "ns": {"db": "test", "coll": "users"},
+        "fullDocument": {"id": user.id, "username": user.username},
+        "updateDescription": {"updatedFields": {"email": "new@example.com"}, "removedFields": []},
+    }
+
+
+@pytest.fixture
+def users():
+    return UserCache()
+
+
+@pytest.fixture
+def invalidator(users):
+    invalidator = CacheInvalidator(retry_seconds=0.01, checkpoint_seconds=0, worker_id="worker-1")
+    invalidator.register("users", users.invalidate_change, users.clear, fields=("id", "username"))
+    return invalidator
+
+
+async def test_change_event_invalidates_the_cached_user(db, users, invalidator):
+    database = ChangeStreamDatabase(db)
+    alice = User(username="alice", email="alice@example.com")
+    bob = User(username="bob", email="bob@example.com")
+    invalidator.start(database)
+    await database.settle()
+    users.set(alice)
+    users.set(bob)
+
+    database.queue.put_nowait(user_change("t1", alice))
+    await database.settle()
+
+    assert invalidator.coherent is True
+    assert users.get("alice") is None
+    assert users.get("bob") is bob
+    await invalidator.stop()
+
+
+async def test_resume_token_is_persisted_and_resumed_after_a_restart(db, users, invalidator):
+    database = ChangeStreamDatabase(db)
+    alice = User(username="alice", email="alice@example.com")
+    invalidator.start(database)
+    database.queue.put_nowait(user_change("t1", alice))
+    await database.settle()
+    await invalidator.stop()
+
+    checkpoint = await db[CHECKPOINT_COLLECTION].find_one({"_id": "worker-1"})
+    assert checkpoint["resume_token"] == {"_data": "t1"}
+
+    restarted = CacheInvalidator(retry_seconds=0.01, checkpoint_seconds=0, worker_id="worker-1")
+    restarted.register("users", users.invalidate_change, users.clear)
+    users.set(alice)
+    restarted.start(database)
+    await database.settle()
+
+    assert database.opened == [None, {"_data": "t1"}]
+    # Resuming replays the missed events, so nothing had to be cleared
+    assert users.get("alice") is alice
+    await restarted.stop()
+
+
+async def test_checkpoints_are_throttled(db, invalidator):
+    database = ChangeStreamDatabase(db)
+    invalidator.checkpoint_seconds = 60
+    alice = User(username="alice", email="alice@example.com")
+    invalidator.start(database)
+    for token in ("t1", "t2", "t3"):
+        database.queue.put_nowait(user_change(token, alice))
+    await database.settle()
+
+    # Only the checkpoint taken when the stream opened
+    assert invalidator.checkpoints == 1
+    await invalidator.stop()
+    assert invalidator.checkpoints == 2
+    assert (await db[CHECKPOINT_COLLECTION].find_one({"_id": "worker-1"}))["resume_token"] == {"_data": "t3"}
+
+
+async def test_lost_history_clears_every_cache(db, users, invalidator):
+    database = ChangeStreamDatabase(db)
+    await db[CHECKPOINT_COLLECTION].insert_one({"_id": "worker-1", "resume_token": {"_data": "gone"}})
+    alice = User(username="alice", email="alice@example.com")
+    invalidator.start(database)
+    await database.settle()
+    users.set(alice)
+
+    database.queue.put_nowait(OperationFailure("ChangeStreamHistoryLost", code=286))
+    await database.settle()
+
+    assert invalidator.history_lost == 1
+    assert users.get("alice") is None
+    # Reopened from now, without the lost token
+    assert database.opened == [{"_data": "gone"}, None]
+    await invalidator.stop()
+    assert (await db[CHECKPOINT_COLLECTION].find_one({"_id": "worker-1"}))["resume_token"] == {"_data": "open"}
@@ -0,0 +1,118 @@
+import os
+
+import pytest
+
+import providers.routes as file_routes
+from providers.chunk_cache import ChunkCache
+
+from .conftest import bearer, connect_gdrive, signup
+
+pytestmark = pytest.mark.anyio
+
+CHUNK_SIZE = 1000
+
+
+@pytest.fixture
+async def cache(tmp_path, monkeypatch):
+    # Files up to max_bytes / 4 are admitted: 2000 bytes here
+    cache = ChunkCache(directory=str(tmp_path), max_bytes=8 * CHUNK_SIZE, chunk_size=CHUNK_SIZE, enabled=True)
+    await cache.start()
+    monkeypatch.setattr(file_routes, "chunk_cache", cache)
+    return cache
+
+
+@pytest.fixture
+async def headers(client, token_server, drive_server, cache):
+    tokens = await signup(client, "chunks")
+    headers = bearer(tokens["access_token"])
+    await connect_gdrive(client, headers, token_server, drive_server)
+    return headers
+
+
+async def add_listed_file(client, headers, drive_server, data: bytes) -> str:
+    """A file the cached listing knows, so its content has a key"""
+    file_id = drive_server.add_file(f"{len(drive_server.files)}.bin", data)
+    response = await client.get("/api/files", headers=headers, params={"refresh": "true"})
+    assert response.status_code == 200, response.text
+    return file_id
+
+
+async def download(client, headers, file_id: str, **extra):
+    return await client.get(f"/api/files/gdrive/{file_id}/content", headers={**headers, **extra})
+
+
+async def test_second_download_is_served_from_the_cache(client, headers, drive_server, cache):
+    data = os.urandom(1500)
+    file_id = await add_listed_file(client, headers, drive_server, data)
+
+    first = await download(client, headers, file_id)
+    second = await download(client, headers, file_id)
+
+    assert first.content == second.content == data
+    assert second.headers["content-length"] == str(len(data))
+    assert drive_server.download_calls == 1
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["chunks"] == 2
+
+
+async def test_range_is_served_from_cached_chunks(client, headers, drive_server):
+    data = os.urandom(2000)
+    file_id = await add_listed_file(client, headers, drive_server, data)
+    await download(client, headers, file_id)
+
+    # Spans the boundary between the two chunks
+    response = await download(client, headers, file_id, Range="bytes=900-1099")
+
+    assert response.status_code == 206
+    assert response.content == data[900:1100]
+    assert response.headers["content-range"] == "bytes 900-1099/2000"
+    assert drive_server.download_calls == 1
+
+    response = await download(client, headers, file_id, Range="bytes=5000-")
+    assert response.status_code == 416
+
+
+async def test_content_not_matching_its_md5_is_not_cached(client, headers, drive_server, cache):
+    file_id = await add_listed_file(client, headers, drive_server, b"listed content")
+    # The provider now serves other bytes than the listing's md5 describes
+    drive_server.files[file_id] = b"changed content"
+
+    first = await download(client, headers, file_id)
+    second = await download(client, headers, file_id)
+
+    assert first.content == second.content == b"changed content"
+    assert drive_server.download_calls == 2
+    assert cache.stats()["manifests"] == 0
+
+
+async def test_least_recently_used_files_are_evicted(client, headers, drive_server, cache):
+    contents = [os.urandom(2000) for _ in range(4)]
+    file_ids = [await add_listed_file(client, headers, drive_server, data) for data in contents]
+    for file_id in file_ids:
+        await download(client, headers, file_id)
+    assert cache.stats()["size_bytes"] == 8000
+
+    # Touch the oldest so the second becomes least recently used
+    assert (await download(client, headers, file_ids[0])).content == contents[0]
+    fifth = await add_listed_file(client, headers, drive_server, os.urandom(2000))
+    await download(client, headers, fifth)
+    calls = drive_server.download_calls
+
+    assert cache.stats()["evictions"] == 2
+    assert cache.stats()["size_bytes"] == 8000
+    assert (await download(client, headers, file_ids[0])).content == contents[0]
+    assert drive_server.download_calls == calls
+    assert (await download(client, headers, file_ids[1])).content == contents[1]
+    assert drive_server.download_calls == calls + 1
+
+
+async def test_identical_content_shares_chunks(client, headers, drive_server, cache):
+    data = os.urandom(1000)
+    first = await add_listed_file(client, headers, drive_server, data)
+    second = await add_listed_file(client, headers, drive_server, data)
+
+    await download(client, headers, first)
+    # Same md5, same content key: served from the cache without a download
+    assert (await download(client, headers, second)).content == data
+    assert drive_server.download_calls == 1
+    assert cache.stats()["chunks"] == 1
@@ -0,0 +1,46 @@
+import pytest
+
+from core.responses import etag_matches
+
+from .conftest import bearer, signup
+
+pytestmark = pytest.mark.anyio
+
+
+def test_if_none_match_uses_weak_comparison():
+    assert etag_matches('"a"', '"a"')
+    assert etag_matches('W/"a"', '"a"')
+    assert etag_matches('"b", W/"a"', '"a"')
+    assert etag_matches("*", '"a"')
+    assert not etag_matches('"b"', '"a"')
+    assert not etag_matches(None, '"a"')
+
+
+@pytest.mark.parametrize("path", ["/api/auth/me", "/api/auth/oauth/status"])
+async def test_unchanged_resource_is_revalidated_with_304(client, path):
+    tokens = await signup(client, "etag")
+    headers = bearer(tokens["access_token"])
+
+    first = await client.get(path, headers=headers)
+    etag = first.headers["etag"]
+    revalidated = await client.get(path, headers={**headers, "If-None-Match": etag})
+
+    assert first.status_code == 200
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+    assert revalidated.headers["etag"] == etag
+    assert revalidated.headers["cache-control"] == first.headers["cache-control"]
+
+
+@pytest.mark.parametrize("path", ["/api/auth/me", "/api/auth/oauth/status"])
+async def test_a_write_changes_the_etag(client, path):
+    tokens = await signup(client, "etag")
+    headers = bearer(tokens["access_token"])
+    etag = (await client.get(path, headers=headers)).headers["etag"]
+
+    # Bumps the user's version, like every write to the document
+    assert (await client.delete("/api/auth/oauth/gdrive", headers=headers)).status_code == 200
+    response = await client.get(path, headers={**headers, "If-None-Match": etag})
+
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
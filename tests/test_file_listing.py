@@ -0,0 +1,170 @@
+import asyncio
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+import pytest
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+import providers.routes as file_routes
+from providers.base import ProviderAdapter
+
+from .conftest import bearer, connect_gdrive, signup
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def headers(client, token_server, drive_server):
+    tokens = await signup(client, "listing")
+    headers = bearer(tokens["access_token"])
+    await connect_gdrive(client, headers, token_server, drive_server)
+    return headers
+
+
+async def list_files(client, headers, **params) -> Dict[str, Any]:
+    response = await client.get("/api/files", headers=headers, params=params)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+async def test_listing_is_synced_then_served_from_cache(client, headers, drive_server):
+    drive_server.add_file("a.txt", b"a")
+    drive_server.add_file("b.txt", b"bb")
+
+    first = await list_files(client, headers)
+    second = await list_files(client, headers)
+
+    assert first["providers"]["gdrive"]["status"] == "full"
+    assert sorted(file["name"] for file in first["files"]) == ["a.txt", "b.txt"]
+    assert all(file["provider"] == "gdrive" for file in first["files"])
+    assert second["providers"]["gdrive"]["status"] == "cached"
+    assert second["files"] == first["files"]
+    assert drive_server.list_calls == 1
+    assert first["partial"] is False
+
+
+async def test_changes_feed_applies_deltas(client, headers, drive_server):
+    keep = drive_server.add_file("keep.txt", b"k")
+    gone = drive_server.add_file("gone.txt", b"g")
+    await list_files(client, headers)
+
+    drive_server.delete_file(gone)
+    drive_server.add_file("new.txt", b"n")
+    listing = await list_files(client, headers, refresh="true")
+
+    assert listing["providers"]["gdrive"]["status"] == "delta"
+    assert sorted(file["name"] for file in listing["files"]) == ["keep.txt", "new.txt"]
+    assert keep in {file["id"] for file in listing["files"]}
+    assert drive_server.list_calls == 1
+    assert drive_server.change_calls == 1
+
+
+async def test_slow_provider_times_out_and_fills_the_cache_later(client, headers, drive_server, monkeypatch):
+    monkeypatch.setattr(file_routes, "FILE_LISTING_TIMEOUT", 0.05)
+    drive_server.list_latency = 0.2
+    drive_server.add_file("a.txt", b"a")
+
+    listing = await list_files(client, headers)
+
+    assert listing["partial"] is True
+    assert listing["providers"]["gdrive"]["status"] == "timeout"
+    assert listing["files"] == []
+
+    # The sync kept running past the request and cached its result
+    await asyncio.sleep(0.3)
+    listing = await list_files(client, headers)
+    assert listing["providers"]["gdrive"]["status"] == "cached"
+    assert [file["name"] for file in listing["files"]] == ["a.txt"]
+
+
+async def test_slow_provider_falls_back_to_the_stale_listing(client, headers, drive_server, monkeypatch):
+    drive_server.add_file("a.txt", b"a")
+    await list_files(client, headers)
+
+    monkeypatch.setattr(file_routes, "FILE_LISTING_TIMEOUT", 0.05)
+    monkeypatch.setattr(file_routes, "FILE_LISTING_FRESH_SECONDS", 0)
+    drive_server.list_latency = 0.2
+    # Without a changes token the refresh has to relist, which is slow
+    owner = (await client.get("/api/auth/me", headers=headers)).json()["id"]
+    cached = await file_routes.file_metadata_cache.get(owner, "gdrive")
+    await file_routes.file_metadata_cache.set(owner, "gdrive", {**cached, "changes_token": None})
+
+    listing = await list_files(client, headers)
+
+    assert listing["partial"] is True
+    assert listing["providers"]["gdrive"]["status"] == "stale_timeout"
+    assert [file["name"] for file in listing["files"]] == ["a.txt"]
+    # Let the sync finish before the stubs go away
+    await asyncio.sleep(0.3)
+
+
+async def test_unknown_provider_is_rejected(client, headers):
+    response = await client.get("/api/files", headers=headers, params={"providers": "gdrive,dropbox"})
+    assert response.status_code == 400
+
+
+class ETagAdapter(ProviderAdapter):
+    name = "etag"
+
+    def download_url(self, file_id: str) -> str:
+        return f"http://etag/files/{file_id}"
+
+    def list_request(self, page_token: Optional[str]) -> Tuple[str, Dict[str, Any]]:
+        return "http://etag/files", {"page_token": page_token} if page_token else {}
+
+    def upload_session_request(self, name, size, mime_type, parent_id):
+        return "http://etag/uploads", {}
+
+
+async def test_listing_is_revalidated_with_if_none_match():
+    seen = []
+
+    async def files(request: Request):
+        seen.append(request.headers.get("if-none-match"))
+        if request.headers.get("if-none-match") == '"v1"':
+            return Response(status_code=304)
+        if request.query_params.get("page_token") == "2":
+            return JSONResponse({"files": [{"id": 2, "name": "two"}]})
+        return JSONResponse({"files": [{"id": 1, "name": "one"}], "next_page_token": "2"}, headers={"ETag": '"v1"'})
+
+    async def authorization(force_refresh: bool = False) -> str:
+        return "Bearer token"
+
+    transport = httpx.ASGITransport(app=Starlette(routes=[Route("/files", files)]))
+    async with httpx.AsyncClient(transport=transport) as http_client:
+        adapter = ETagAdapter(authorization, http_client)
+        listing = await adapter.sync_listing(None)
+        revalidated = await adapter.sync_listing(listing)
+
+    assert listing["sync"] == "full"
+    assert listing["etag"] == '"v1"'
+    assert [file["id"] for file in listing["files"]] == ["1", "2"]
+    assert revalidated == {**listing, "sync": "not_modified"}
+    # Only the first page is revalidated
+    assert seen == [None, None, '"v1"']
+
+
+async def test_mongo_listing_store_keeps_one_document_per_file(db):
+    from providers.metadata_cache import MongoFileMetadataCache
+
+    store = MongoFileMetadataCache(write_batch=2)
+    files = [{"id": f"f{i}", "name": f"{i}.txt"} for i in range(5)]
+    await store.set("u1", "gdrive", {"files": files, "changes_token": "t1", "sync": "full"})
+
+    listing = await store.get("u1", "gdrive")
+    assert listing == {"files": files, "changes_token": "t1", "sync": "full"}
+    assert await store.get_file("u1", "gdrive", "f3") == files[3]
+    assert await db.file_metadata_entries.count_documents({}) == 5
+
+    # A new sync replaces the previous generation of entries
+    await store.set("u1", "gdrive", {"files": files[:2], "changes_token": "t2", "sync": "delta"})
+    assert (await store.get("u1", "gdrive"))["files"] == files[:2]
+    assert await store.get_file("u1", "gdrive", "f3") is None
+    assert await db.file_metadata_entries.count_documents({}) == 2
+
+    await store.forget("u1", "gdrive")
+    assert await store.get("u1", "gdrive") is None
+    assert await db.file_metadata_entries.count_documents({}) == 0
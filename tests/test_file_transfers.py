@@ -0,0 +1,183 @@
+import os
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from providers.routes import parse_content_range
+from providers.transfers import transfer_limiter
+
+from .conftest import bearer, connect_gdrive, signup
+
+
+def upload_request(headers: dict) -> Request:
+    return Request({
+        "type": "http",
+        "method": "PUT",
+        "path": "/api/files/uploads/u1",
+        "headers": [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+    })
+
+
+def test_content_range_of_a_chunk():
+    request = upload_request({"Content-Range": "bytes 10-19/100", "Content-Length": "10"})
+    assert parse_content_range(request, 100) == (10, 19)
+
+
+@pytest.mark.parametrize("headers, status", [
+    ({}, 400),
+    ({"Content-Range": "bytes 0-9/50"}, 416),
+    ({"Content-Range": "bytes 0-9/100", "Content-Length": "11"}, 400),
+    ({"Content-Range": "bytes 0-9/100", "Content-Length": "ten"}, 400),
+    ({"Content-Range": "bytes 0-9/100", "Content-Length": "-10"}, 400),
+])
+def test_bad_chunk_headers_are_rejected(headers, status):
+    with pytest.raises(HTTPException) as error:
+        parse_content_range(upload_request(headers), 100)
+    assert error.value.status_code == status
+
+
+@pytest.fixture
+async def headers(client, token_server, drive_server):
+    tokens = await signup(client, "transfers")
+    headers = bearer(tokens["access_token"])
+    await connect_gdrive(client, headers, token_server, drive_server)
+    return headers
+
+
+async def user_id(client, headers) -> str:
+    return (await client.get("/api/auth/me", headers=headers)).json()["id"]
+
+
+@pytest.mark.anyio
+async def test_download_streams_the_file(client, headers, drive_server):
+    data = os.urandom(300_000)
+    file_id = drive_server.add_file("a.bin", data)
+
+    response = await client.get(f"/api/files/gdrive/{file_id}/content", headers=headers)
+
+    assert response.status_code == 200
+    assert response.content == data
+    assert response.headers["content-length"] == str(len(data))
+    assert transfer_limiter.active == 0
+
+
+@pytest.mark.anyio
+async def test_download_passes_range_through(client, headers, drive_server):
+    data = os.urandom(5000)
+    file_id = drive_server.add_file("a.bin", data)
+
+    response = await client.get(f"/api/files/gdrive/{file_id}/content", headers={**headers, "Range": "bytes=100-199"})
+
+    assert response.status_code == 206
+    assert response.content == data[100:200]
+    assert response.headers["content-range"] == f"bytes 100-199/{len(data)}"
+
+
+@pytest.mark.anyio
+async def test_download_refreshes_a_rejected_token_and_retries(client, headers, token_server, drive_server):
+    file_id = drive_server.add_file("a.bin", b"payload")
+    calls = token_server.calls
+    # The provider revokes the token; the next one the token server issues works
+    drive_server.valid_token = f"stub-access-{calls + 1}"
+
+    response = await client.get(f"/api/files/gdrive/{file_id}/content", headers=headers)
+
+    assert response.status_code == 200
+    assert response.content == b"payload"
+    assert token_server.calls == calls + 1
+    assert drive_server.unauthorized == 1
+
+
+@pytest.mark.anyio
+async def test_missing_file_is_404(client, headers):
+    response = await client.get("/api/files/gdrive/nope/content", headers=headers)
+    assert response.status_code == 404
+
+
+async def create_upload(client, headers, size: int) -> str:
+    response = await client.post("/api/files/gdrive/uploads", headers=headers, json={"name": "up.bin", "size": size})
+    assert response.status_code == 200, response.text
+    assert response.json()["received"] == 0
+    return response.json()["upload_id"]
+
+
+async def send_chunk(client, headers, upload_id: str, data: bytes, start: int, end: int):
+    return await client.put(
+        f"/api/files/uploads/{upload_id}",
+        headers={**headers, "Content-Range": f"bytes {start}-{end}/{len(data)}"},
+        content=data[start:end + 1],
+    )
+
+
+@pytest.mark.anyio
+async def test_resumable_upload_in_chunks(client, headers, drive_server):
+    data = os.urandom(2500)
+    upload_id = await create_upload(client, headers, len(data))
+
+    response = await send_chunk(client, headers, upload_id, data, 0, 999)
+    assert response.status_code == 200
+    assert response.json()["received"] == 1000
+    assert response.json()["complete"] is False
+
+    status = await client.get(f"/api/files/uploads/{upload_id}", headers=headers)
+    assert status.json()["received"] == 1000
+
+    response = await send_chunk(client, headers, upload_id, data, 1000, len(data) - 1)
+    assert response.json()["complete"] is True
+    assert drive_server.files[response.json()["file"]["id"]] == data
+
+    # The session is gone once the file exists
+    assert (await client.get(f"/api/files/uploads/{upload_id}", headers=headers)).status_code == 404
+
+
+@pytest.mark.anyio
+async def test_token_rejected_mid_upload_is_refreshed_and_resumed(client, headers, token_server, drive_server):
+    data = os.urandom(3000)
+    upload_id = await create_upload(client, headers, len(data))
+    assert (await send_chunk(client, headers, upload_id, data, 0, 999)).json()["received"] == 1000
+
+    calls = token_server.calls
+    drive_server.valid_token = f"stub-access-{calls + 1}"
+    response = await send_chunk(client, headers, upload_id, data, 1000, 1999)
+
+    # The streamed body cannot be replayed: the client is told where the provider stands
+    assert response.status_code == 200
+    assert response.json()["received"] == 1000
+    assert token_server.calls == calls + 1
+
+    assert (await send_chunk(client, headers, upload_id, data, 1000, 1999)).json()["received"] == 2000
+    response = await send_chunk(client, headers, upload_id, data, 2000, 2999)
+    assert response.json()["complete"] is True
+    assert drive_server.files[response.json()["file"]["id"]] == data
+
+
+@pytest.mark.anyio
+async def test_cancelled_upload_is_forgotten(client, headers, drive_server):
+    upload_id = await create_upload(client, headers, 10)
+
+    assert (await client.delete(f"/api/files/uploads/{upload_id}", headers=headers)).status_code == 200
+
+    assert drive_server.sessions == {}
+    assert (await client.get(f"/api/files/uploads/{upload_id}", headers=headers)).status_code == 404
+
+
+@pytest.mark.anyio
+async def test_transfers_over_the_per_user_limit_get_429(client, headers, drive_server, monkeypatch):
+    monkeypatch.setattr(transfer_limiter, "per_user", 1)
+    monkeypatch.setattr(transfer_limiter, "queue_timeout", 0.05)
+    file_id = drive_server.add_file("a.bin", b"payload")
+    owner = await user_id(client, headers)
+
+    # Another transfer of the same user holds the only slot
+    await transfer_limiter.acquire(owner)
+    try:
+        response = await client.get(f"/api/files/gdrive/{file_id}/content", headers=headers)
+        assert response.status_code == 429
+        assert response.headers["retry-after"] == str(transfer_limiter.retry_after)
+    finally:
+        transfer_limiter.release(owner)
+
+    response = await client.get(f"/api/files/gdrive/{file_id}/content", headers=headers)
+    assert response.status_code == 200
+    assert transfer_limiter.active == 0
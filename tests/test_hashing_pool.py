@@ -0,0 +1,66 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+import auth.routes as auth_routes
+from auth.hashing_pool import PasswordHashingPool
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def pool():
+    pool = PasswordHashingPool(workers=1, max_queue=1, retry_after=7)
+    yield pool
+    pool.shutdown()
+
+
+async def test_full_pool_rejects_with_retry_after(pool):
+    release = threading.Event()
+    running = [asyncio.ensure_future(pool._run(release.wait)) for _ in range(2)]
+    await asyncio.sleep(0.05)
+    assert pool.stats()["queue_depth"] == 1
+
+    with pytest.raises(HTTPException) as rejected:
+        await pool.hash("secret")
+
+    assert rejected.value.status_code == 503
+    assert rejected.value.headers == {"Retry-After": "7"}
+    assert pool.rejected == 1
+    release.set()
+    await asyncio.gather(*running)
+    await asyncio.sleep(0.01)
+    assert pool.pending == 0
+
+
+async def test_cancelled_request_keeps_its_slot_until_the_worker_finishes(pool):
+    release = threading.Event()
+    first = asyncio.ensure_future(pool._run(release.wait))
+    await asyncio.sleep(0.05)
+    first.cancel()
+    await asyncio.sleep(0.01)
+
+    # bcrypt cannot be interrupted, so the worker is still busy
+    assert pool.pending == 1
+    release.set()
+    await asyncio.sleep(0.05)
+    assert pool.pending == 0
+    assert await pool.verify("secret", await pool.hash("secret")) is True
+
+
+async def test_signup_answers_503_when_the_pool_is_full(client, pool, monkeypatch):
+    monkeypatch.setattr(auth_routes, "hashing_pool", pool)
+    release = threading.Event()
+    running = [asyncio.ensure_future(pool._run(release.wait)) for _ in range(2)]
+    await asyncio.sleep(0.05)
+
+    response = await client.post(
+        "/api/auth/signup", json={"username": "busy", "email": "busy@example.com", "password": "secret"}
+    )
+
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "7"
+    release.set()
+    await asyncio.gather(*running)
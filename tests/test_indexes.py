@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+
+import core.indexes as indexes
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_background_index_build_is_cancelled_at_shutdown(db, monkeypatch):
+    started = asyncio.Event()
+
+    async def slow_build(db):
+        started.set()
+        await asyncio.sleep(60)
+
+    monkeypatch.setattr(indexes, "MONGO_INDEX_BUILD_BACKGROUND", True)
+    monkeypatch.setattr(indexes, "ensure_optional_indexes", slow_build)
+
+    task = await indexes.bootstrap_indexes(db)
+    await started.wait()
+    await indexes.stop_index_bootstrap()
+
+    assert task.cancelled()
+    assert indexes._bootstrap_task is None
+    # Nothing left to stop
+    await indexes.stop_index_bootstrap()
+
+
+async def test_lifespan_stops_the_background_index_build(db, monkeypatch):
+    import server
+
+    build = asyncio.Event()
+
+    async def slow_build(db):
+        build.set()
+        await asyncio.sleep(60)
+
+    monkeypatch.setattr(indexes, "MONGO_INDEX_BUILD_BACKGROUND", True)
+    monkeypatch.setattr(indexes, "ensure_optional_indexes", slow_build)
+    app = server.create_app(db=db)
+
+    async with app.router.lifespan_context(app):
+        await build.wait()
+        task = indexes._bootstrap_task
+
+    assert task.cancelled()
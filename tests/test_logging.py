@@ -0,0 +1,90 @@
+import logging
+import queue
+
+import httpx
+import orjson
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+
+from core.log import BackgroundQueueHandler, ErrorSampler, JsonFormatter, RequestContextMiddleware, current_request_id
+
+
+@pytest.fixture
+def handler():
+    handler = BackgroundQueueHandler(queue.Queue(maxsize=2))
+    logger = logging.getLogger("tests.request")
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    yield handler
+    logger.removeHandler(handler)
+
+
+@pytest.fixture
+async def client():
+    app = FastAPI()
+
+    @app.get("/items/{item}")
+    async def served(item: str):
+        logging.getLogger("tests.request").info("serving %s", item)
+        return PlainTextResponse(current_request_id())
+
+    app.add_middleware(RequestContextMiddleware)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://logs") as client:
+        yield client
+
+
+@pytest.mark.anyio
+async def test_request_id_is_propagated_to_logs_and_the_response(client, handler):
+    response = await client.get("/items/42", headers={"X-Request-ID": "trace-1"})
+
+    assert response.headers["x-request-id"] == "trace-1"
+    assert response.text == "trace-1"
+    record = handler.queue.get_nowait()
+    assert (record.request_id, record.route) == ("trace-1", "/items/{item}")
+    assert record.latency_ms >= 0
+
+    entry = orjson.loads(JsonFormatter().format(record))
+    assert entry["message"] == "serving 42"
+    assert entry["request_id"] == "trace-1"
+    assert entry["level"] == "INFO"
+
+
+@pytest.mark.anyio
+async def test_unusable_request_ids_are_replaced(client, handler):
+    for sent in ({}, {"X-Request-ID": "bad id\twith spaces"}, {"X-Request-ID": "x" * 65}):
+        response = await client.get("/items/1", headers=sent)
+        generated = response.headers["x-request-id"]
+        assert generated != sent.get("X-Request-ID")
+        assert len(generated) == 32
+        assert handler.queue.get_nowait().request_id == generated
+
+
+@pytest.mark.anyio
+async def test_full_log_queue_drops_records(client, handler):
+    for _ in range(3):
+        await client.get("/items/1")
+
+    assert handler.queue.qsize() == 2
+    assert handler.dropped == 1
+
+
+def make_record(level: int = logging.ERROR, line: int = 10) -> logging.LogRecord:
+    return logging.LogRecord("tests", level, "app.py", line, "provider down", (), None)
+
+
+def test_sampler_lets_a_burst_through_per_call_site_and_window(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("core.log.time.monotonic", lambda: now[0])
+    sampler = ErrorSampler(burst=2, window=60)
+
+    assert [sampler.filter(make_record()) for _ in range(5)] == [True, True, False, False, False]
+    # Other call sites and lower levels are not affected
+    assert sampler.filter(make_record(line=11)) is True
+    assert all(sampler.filter(make_record(logging.INFO)) for _ in range(5))
+    assert sampler.suppressed == 3
+
+    now[0] += 60
+    record = make_record()
+    assert sampler.filter(record) is True
+    assert record.suppressed == 3
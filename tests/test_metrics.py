@@ -0,0 +1,50 @@
+import httpx
+import pytest
+
+import core.metrics as metrics
+import server
+
+from .conftest import bearer, signup
+
+pytestmark = pytest.mark.anyio
+
+
+def metrics_app(db, monkeypatch, enabled: bool = True):
+    monkeypatch.setattr(server, "METRICS_ENABLED", enabled)
+    return server.create_app(db=db)
+
+
+async def scrape(app, **headers) -> httpx.Response:
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://metrics") as client:
+        return await client.get("/metrics", headers=headers)
+
+
+async def test_metrics_are_off_by_default(db):
+    assert metrics.METRICS_ENABLED is False
+    response = await scrape(server.create_app(db=db))
+    assert response.status_code == 404
+
+
+async def test_requests_are_labelled_by_route_template(db, services, monkeypatch):
+    app = metrics_app(db, monkeypatch)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://metrics") as client:
+        tokens = await signup(client, "metrics")
+        headers = bearer(tokens["access_token"])
+        await client.get("/api/files/gdrive/abc123/content", headers=headers)
+        await client.get("/nowhere")
+
+    body = (await scrape(app)).text
+
+    assert 'route="/api/files/{provider}/{file_id}/content"' in body
+    assert 'route="unmatched"' in body
+    assert "abc123" not in body
+    assert 'http_requests_total{method="POST",route="/api/auth/signup",status="200"}' in body
+
+
+async def test_metrics_token_is_required_when_set(db, monkeypatch):
+    app = metrics_app(db, monkeypatch)
+    monkeypatch.setattr(metrics, "METRICS_TOKEN", "scrape-secret")
+
+    assert (await scrape(app)).status_code == 401
+    assert (await scrape(app, Authorization="Bearer wrong")).status_code == 401
+    assert (await scrape(app, Authorization="Bearer scrape-secret")).status_code == 200
@@ -0,0 +1,64 @@
+import pytest
+
+import auth.routes as auth_routes
+from auth.oauth_state import InMemoryOAuthStateStore, MongoOAuthStateStore
+
+from .conftest import bearer, signup
+
+pytestmark = pytest.mark.anyio
+
+
+async def start_flow(client, headers, provider: str = "gdrive") -> str:
+    response = await client.get(f"/api/auth/oauth/{provider}", headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()["state"]
+
+
+async def test_replayed_state_is_rejected(client, token_server):
+    tokens = await signup(client, "oauth_replay")
+    headers = bearer(tokens["access_token"])
+    state = await start_flow(client, headers)
+
+    first = await client.get("/api/auth/callback/gdrive", params={"code": "code", "state": state})
+    assert first.status_code == 200, first.text
+    assert token_server.calls == 1
+
+    replay = await client.get("/api/auth/callback/gdrive", params={"code": "code", "state": state})
+    assert replay.status_code == 400
+    assert token_server.calls == 1
+
+
+async def test_state_is_bound_to_its_provider(client, token_server):
+    tokens = await signup(client, "oauth_provider")
+    state = await start_flow(client, bearer(tokens["access_token"]))
+
+    response = await client.get("/api/auth/callback/proton", params={"code": "code", "state": state})
+    assert response.status_code == 400
+    assert token_server.calls == 0
+
+
+async def test_expired_state_is_rejected(client, token_server, monkeypatch):
+    store = InMemoryOAuthStateStore(ttl=0.0)
+    monkeypatch.setattr(auth_routes, "oauth_state_store", store)
+    tokens = await signup(client, "oauth_expired")
+    state = await start_flow(client, bearer(tokens["access_token"]))
+
+    response = await client.get("/api/auth/callback/gdrive", params={"code": "code", "state": state})
+    assert response.status_code == 400
+    assert token_server.calls == 0
+
+
+async def test_mongo_store_consumes_a_state_once(db):
+    store = MongoOAuthStateStore()
+    await store.save("state-1", {"user_id": "u1", "provider": "gdrive"})
+
+    assert await store.pop("state-1") == {"user_id": "u1", "provider": "gdrive"}
+    assert await store.pop("state-1") is None
+    assert await store.pop("unknown") is None
+
+
+async def test_mongo_store_ignores_expired_states_before_the_ttl_monitor(db):
+    store = MongoOAuthStateStore(ttl=-1)
+    await store.save("state-2", {"user_id": "u1", "provider": "gdrive"})
+
+    assert await store.pop("state-2") is None
@@ -0,0 +1,83 @@
+import httpx
+import pytest
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from core.rate_limit import RateLimitMiddleware, TokenBucketLimiter
+
+pytestmark = pytest.mark.anyio
+
+BURST = 3
+
+
+async def echo_login(request: Request):
+    return JSONResponse(await request.json())
+
+
+def limited_client(limiter: TokenBucketLimiter, ip: str = "203.0.113.7", **options) -> httpx.AsyncClient:
+    app = Starlette(routes=[Route("/api/auth/login", echo_login, methods=["POST"])])
+    app = RateLimitMiddleware(app, limiter=limiter, **options)
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app, client=(ip, 1234)), base_url="http://test")
+
+
+@pytest.fixture
+def limiter():
+    # No refill during a test: every token spent stays spent
+    return TokenBucketLimiter({"auth": (1e-6, BURST)})
+
+
+async def login(client, username: str) -> httpx.Response:
+    return await client.post("/api/auth/login", json={"username": username, "password": "guess"})
+
+
+async def test_distinct_usernames_from_one_ip_share_the_ip_burst(limiter):
+    async with limited_client(limiter) as client:
+        statuses = [(await login(client, f"user{i}")).status_code for i in range(BURST + 2)]
+
+    assert statuses == [200] * BURST + [429] * 2
+
+
+async def test_one_username_is_throttled_across_ips(limiter):
+    for i in range(BURST):
+        async with limited_client(limiter, ip=f"198.51.100.{i}") as client:
+            assert (await login(client, "Alice")).status_code == 200
+
+    async with limited_client(limiter, ip="198.51.100.200") as client:
+        response = await login(client, "alice")
+        assert response.status_code == 429
+        assert int(response.headers["retry-after"]) >= 1
+        # Other accounts from a fresh address are unaffected
+        assert (await login(client, "bob")).status_code == 200
+
+
+async def test_body_is_replayed_to_the_route(limiter):
+    async with limited_client(limiter) as client:
+        response = await login(client, "carol")
+
+    assert response.json() == {"username": "carol", "password": "guess"}
+
+
+async def test_forwarded_for_is_ignored_unless_the_peer_is_trusted(limiter):
+    async with limited_client(limiter, ip="192.0.2.1") as client:
+        statuses = [
+            (await client.post(
+                "/api/auth/login",
+                json={"username": f"spoof{i}"},
+                headers={"X-Forwarded-For": f"203.0.113.{i}"},
+            )).status_code
+            for i in range(BURST + 1)
+        ]
+    assert statuses[-1] == 429
+
+    async with limited_client(limiter, ip="10.0.0.2", trusted_proxies=["10.0.0.0/8"]) as client:
+        statuses = [
+            (await client.post(
+                "/api/auth/login",
+                json={"username": f"proxied{i}"},
+                headers={"X-Forwarded-For": f"203.0.113.{i}, 10.0.0.9"},
+            )).status_code
+            for i in range(BURST + 1)
+        ]
+    assert statuses == [200] * (BURST + 1)
@@ -0,0 +1,49 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from auth.revocation import RevocationList
+
+from .conftest import bearer, signup
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_token_revoked_at_logout_is_rejected(client):
+    tokens = await signup(client, "logout")
+    headers = bearer(tokens["access_token"])
+    assert (await client.get("/api/auth/me", headers=headers)).status_code == 200
+
+    response = await client.post("/api/auth/logout", headers=headers, json={"refresh_token": tokens["refresh_token"]})
+    assert response.status_code == 200
+
+    assert (await client.get("/api/auth/me", headers=headers)).status_code == 401
+    response = await client.post("/api/auth/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert response.status_code == 401
+
+
+async def test_revocations_by_another_worker_arrive_with_the_next_sync(db):
+    here, there = RevocationList(), RevocationList()
+    await here.sync()
+    expires_at = datetime.utcnow() + timedelta(hours=1)
+
+    await there.revoke("jti-1", expires_at, user_id="u1")
+    assert there.is_revoked("jti-1")
+    assert not here.is_revoked("jti-1")
+
+    await here.sync()
+    assert here.is_revoked("jti-1")
+    assert not here.is_revoked("jti-2")
+    assert not here.is_revoked(None)
+
+
+async def test_revocations_are_dropped_once_the_token_expires(db):
+    revocations = RevocationList()
+    revocations.add("expired", datetime.utcnow() - timedelta(seconds=1))
+    revocations.add("live", datetime.utcnow() + timedelta(hours=1))
+
+    await revocations.sync()
+
+    assert not revocations.is_revoked("expired")
+    assert revocations.is_revoked("live")
+    assert revocations.revoked_for("live") < 5
@@ -0,0 +1,77 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from auth.oauth_helpers import OAuthTokenManager
+from core.singleflight import SingleFlight
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_concurrent_callers_share_one_call():
+    flights = SingleFlight()
+    calls = []
+
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return "value"
+
+    results = await asyncio.gather(*(flights.do("key", load) for _ in range(5)), flights.do("other", load))
+
+    assert results == ["value"] * 6
+    assert len(calls) == 2
+    assert not flights.in_flight("key")
+    # Later callers start a new call
+    await flights.do("key", load)
+    assert len(calls) == 3
+
+
+async def test_failures_are_shared_and_not_remembered():
+    flights = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    results = await asyncio.gather(*(flights.do("key", fail) for _ in range(3)), return_exceptions=True)
+
+    assert all(isinstance(result, ValueError) for result in results)
+    assert results[0] is results[1]
+    assert not flights.in_flight("key")
+
+
+async def test_cancelling_a_waiter_leaves_the_call_running():
+    flights = SingleFlight()
+
+    async def load():
+        await asyncio.sleep(0.05)
+        return "value"
+
+    first = asyncio.ensure_future(flights.do("key", load))
+    second = asyncio.ensure_future(flights.do("key", load))
+    await asyncio.sleep(0.01)
+    first.cancel()
+
+    assert await second == "value"
+    assert first.cancelled()
+
+
+async def test_concurrent_token_refreshes_hit_the_provider_once(db, services, token_server):
+    token_server.latency = 0.05
+    await db.users.insert_one({
+        "id": "u1",
+        "username": "u1",
+        "email": "u1@example.com",
+        "oauth_providers": {"gdrive": {
+            "access_token": "old",
+            "refresh_token": "r1",
+            "expires_at": datetime.utcnow() + timedelta(minutes=1),
+        }},
+    })
+
+    tokens = await asyncio.gather(*(OAuthTokenManager(db).get_valid_token("u1", "gdrive") for _ in range(10)))
+
+    assert tokens == ["stub-access-1"] * 10
+    assert token_server.calls == 1
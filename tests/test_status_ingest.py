@@ -0,0 +1,107 @@
+import asyncio
+
+import orjson
+import pytest
+from fastapi import HTTPException
+
+import status_checks.routes as status_routes
+from status_checks.write_buffer import StatusWriteBuffer, insert_status_checks
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_unordered_insert_reports_each_failed_document(db):
+    await db.status_checks.create_index("id", unique=True)
+    docs = [{"id": "a", "client_name": "x"}, {"id": "a", "client_name": "y"}, {"id": "b", "client_name": "z"}]
+
+    results = await insert_status_checks(db, docs)
+
+    assert [error is None for error in results] == [True, False, True]
+    assert await db.status_checks.count_documents({}) == 2
+
+
+async def test_bulk_counts_partial_failures(client, db):
+    # Violated on purpose, so some of the batch fails while the rest is written
+    await db.status_checks.create_index("client_name", unique=True)
+    items = [{"client_name": name} for name in ("a", "b", "a", "c")]
+
+    response = await client.post("/api/status/bulk", json=items)
+
+    assert response.status_code == 200
+    assert response.json() == {"inserted": 3, "failed": 1}
+
+
+async def test_bulk_accepts_ndjson_and_validates_items(client, db, monkeypatch):
+    body = b"\n".join(orjson.dumps({"client_name": f"c{i}"}) for i in range(5)) + b"\n"
+    response = await client.post("/api/status/bulk", content=body, headers={"Content-Type": "application/x-ndjson"})
+    assert response.json() == {"inserted": 5, "failed": 0}
+
+    response = await client.post("/api/status/bulk", json=[{"client_name": "ok"}, {"name": "missing"}])
+    assert response.status_code == 422
+    assert "Item 1" in response.json()["detail"]
+
+    monkeypatch.setattr(status_routes, "STATUS_BULK_MAX_ITEMS", 2)
+    response = await client.post("/api/status/bulk", json=[{"client_name": "x"}] * 3)
+    assert response.status_code == 413
+    assert await db.status_checks.count_documents({}) == 5
+
+
+async def test_full_buffer_answers_503_with_retry_after(db):
+    buffer = StatusWriteBuffer(max_pending=2, durability="before_flush", retry_after=3)
+    await buffer.add({"id": "1", "client_name": "x"})
+    await buffer.add({"id": "2", "client_name": "x"})
+
+    with pytest.raises(HTTPException) as rejected:
+        await buffer.add({"id": "3", "client_name": "x"})
+
+    assert rejected.value.status_code == 503
+    assert rejected.value.headers == {"Retry-After": "3"}
+    assert buffer.rejected == 1
+
+
+async def test_after_flush_waits_for_the_write(db):
+    buffer = StatusWriteBuffer(max_batch=10, flush_interval=0.05)
+    buffer.start(db)
+
+    adds = [asyncio.ensure_future(buffer.add({"id": str(i), "client_name": "x"})) for i in range(3)]
+    await asyncio.sleep(0)
+    assert not any(add.done() for add in adds)
+    await asyncio.gather(*adds)
+
+    # Resolved only once written, in a single batch
+    assert await db.status_checks.count_documents({}) == 3
+    assert buffer.flushes == 1
+    await buffer.stop()
+
+
+async def test_before_flush_returns_at_once_and_stop_drains(db):
+    buffer = StatusWriteBuffer(max_batch=2, flush_interval=60, durability="before_flush")
+    buffer.start(db)
+
+    for i in range(5):
+        await buffer.add({"id": str(i), "client_name": "x"})
+    # Nothing was awaited, so nothing has been written yet
+    assert buffer.pending == 5
+    assert await db.status_checks.count_documents({}) == 0
+
+    await buffer.stop()
+    assert buffer.pending == 0
+    assert await db.status_checks.count_documents({}) == 5
+    assert buffer.stats()["flushed_docs"] == 5
+
+
+async def test_after_flush_surfaces_write_errors(db):
+    await db.status_checks.create_index("id", unique=True)
+    buffer = StatusWriteBuffer(max_batch=2, flush_interval=0.01)
+    buffer.start(db)
+
+    results = await asyncio.gather(
+        buffer.add({"id": "same", "client_name": "x"}),
+        buffer.add({"id": "same", "client_name": "y"}),
+        return_exceptions=True,
+    )
+
+    assert results[0] is None
+    assert isinstance(results[1], RuntimeError)
+    assert buffer.stats()["failed_docs"] == 1
+    await buffer.stop()
@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+
+import orjson
+import pytest
+from fastapi import HTTPException
+
+from status_checks.routes import decode_cursor, encode_cursor
+
+pytestmark = pytest.mark.anyio
+
+
+async def add_checks(db, count: int):
+    # Pairs share a timestamp so the id breaks ties
+    start = datetime(2026, 1, 1)
+    docs = [
+        {"id": f"id-{i:02d}", "client_name": f"client-{i}", "timestamp": start + timedelta(seconds=i // 2)}
+        for i in range(count)
+    ]
+    await db.status_checks.insert_many([dict(doc) for doc in docs])
+    return docs
+
+
+def test_cursor_round_trips_and_rejects_garbage():
+    doc = {"id": "id-01", "timestamp": datetime(2026, 1, 1, 12, 30)}
+
+    query = decode_cursor(encode_cursor(doc))
+
+    assert query == {"$or": [
+        {"timestamp": {"$gt": doc["timestamp"]}},
+        {"timestamp": doc["timestamp"], "id": {"$gt": "id-01"}},
+    ]}
+    for garbage in ("not-a-cursor", encode_cursor(doc)[:-3]):
+        with pytest.raises(HTTPException) as rejected:
+            decode_cursor(garbage)
+        assert rejected.value.status_code == 400
+
+
+async def test_pages_follow_the_next_cursor_without_gaps(client, db):
+    docs = await add_checks(db, 7)
+    seen, params = [], {"limit": 3}
+
+    while True:
+        response = await client.get("/api/status", params=params)
+        assert response.status_code == 200
+        seen.extend(check["id"] for check in response.json())
+        if "x-next-cursor" not in response.headers:
+            break
+        assert 'rel="next"' in response.headers["link"]
+        params = {"limit": 3, "after": response.headers["x-next-cursor"]}
+
+    assert seen == [doc["id"] for doc in docs]
+
+
+async def test_fields_select_a_projection(client, db):
+    await add_checks(db, 2)
+
+    response = await client.get("/api/status", params={"fields": "client_name"})
+    assert response.status_code == 200
+    assert set(response.json()[0]) == {"id", "timestamp", "client_name"}
+
+    response = await client.get("/api/status", params={"fields": "id,password"})
+    assert response.status_code == 400
+
+
+async def test_ndjson_streams_one_document_per_line(client, db):
+    docs = await add_checks(db, 5)
+
+    response = await client.get(
+        "/api/status", params={"batch_size": 2, "fields": "id"}, headers={"Accept": "application/x-ndjson"}
+    )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [orjson.loads(line) for line in response.content.splitlines()]
+    assert [line["id"] for line in lines] == [doc["id"] for doc in docs]
+    assert set(lines[0]) == {"id", "timestamp"}
+
+    limited = await client.get("/api/status", params={"format": "ndjson", "limit": 2})
+    assert len(limited.content.splitlines()) == 2
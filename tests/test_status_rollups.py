@@ -0,0 +1,56 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import status_checks.write_buffer as write_buffer
+from status_checks.rollups import ROLLUP_COLLECTION, record_rollups
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_rollups_accept_timezone_aware_bounds(client, db):
+    now = datetime.utcnow().replace(second=0, microsecond=0)
+    await record_rollups(db, [
+        {"client_name": "probe", "timestamp": now - timedelta(minutes=2)},
+        {"client_name": "probe", "timestamp": now - timedelta(minutes=2)},
+        {"client_name": "probe", "timestamp": now - timedelta(minutes=90)},
+    ])
+    # 02:00 in UTC-03:00 is 05:00 UTC: the offset is applied, not dropped
+    start = (now - timedelta(minutes=10) - timedelta(hours=3)).isoformat() + "-03:00"
+
+    response = await client.get(
+        "/api/status/rollups",
+        params={"granularity": "minute", "start": start, "end": (now + timedelta(minutes=1)).isoformat() + "Z"},
+    )
+
+    assert response.status_code == 200, response.text
+    assert [(bucket["client_name"], bucket["count"]) for bucket in response.json()["buckets"]] == [("probe", 2)]
+
+
+async def test_rollups_reject_an_empty_aware_range(client, db):
+    # 12:00 at +02:00 is 10:00 UTC, after the 09:00 UTC end
+    response = await client.get(
+        "/api/status/rollups",
+        params={"start": "2026-10-17T12:00:00+02:00", "end": "2026-10-17T09:00:00Z"},
+    )
+    assert response.status_code == 400
+
+
+async def test_rollups_default_end_with_aware_start(client, db):
+    start = (datetime.utcnow() - timedelta(hours=1)).isoformat() + "Z"
+
+    response = await client.get("/api/status/rollups", params={"granularity": "minute", "start": start})
+
+    assert response.status_code == 200, response.text
+
+
+async def test_ingest_leaves_rollups_to_the_job_by_default(db, monkeypatch):
+    docs = [{"client_name": "probe", "timestamp": datetime.utcnow()}]
+
+    assert write_buffer.STATUS_ROLLUP_MODE == "job"
+    await write_buffer.insert_status_checks(db, [dict(doc) for doc in docs])
+    assert await db[ROLLUP_COLLECTION].count_documents({}) == 0
+
+    monkeypatch.setattr(write_buffer, "STATUS_ROLLUP_MODE", "incremental")
+    await write_buffer.insert_status_checks(db, [dict(doc) for doc in docs])
+    assert await db[ROLLUP_COLLECTION].count_documents({}) == 2
@@ -0,0 +1,54 @@
+from datetime import timedelta
+
+import pytest
+from fastapi import HTTPException
+
+import auth.jwt_handler as jwt_handler
+from auth.jwt_handler import create_access_token, decode_token, encode_token, verify_token
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    jwt_handler._token_cache.clear()
+
+
+def test_verified_tokens_are_cached_until_they_expire(monkeypatch):
+    decoded = []
+    monkeypatch.setattr(jwt_handler, "decode_token", lambda token: decoded.append(token) or decode_token(token))
+    token = create_access_token({"sub": "alice", "user_id": "u1"}, expires_delta=timedelta(seconds=30))
+
+    assert verify_token(token).username == "alice"
+    assert verify_token(token).user_id == "u1"
+    assert decoded == [token]
+
+    # Capped at the token's own exp, not the cache-wide TTL
+    remaining = jwt_handler._token_cache.remaining_ttl(jwt_handler._token_digest(token))
+    assert 25 < remaining <= 30 < jwt_handler.TOKEN_CACHE_TTL_SECONDS
+
+
+def test_expired_and_tampered_tokens_are_rejected_and_not_cached():
+    expired = create_access_token({"sub": "alice"}, expires_delta=timedelta(seconds=-1))
+    valid = create_access_token({"sub": "alice"})
+    header, payload, signature = valid.split(".")
+    tampered = ".".join([header, payload, signature[::-1]])
+
+    for token in (expired, tampered):
+        with pytest.raises(HTTPException) as rejected:
+            verify_token(token)
+        assert rejected.value.status_code == 401
+    assert len(jwt_handler._token_cache) == 0
+
+
+@pytest.mark.parametrize("signer,verifier", [("jose", "pyjwt"), ("pyjwt", "jose"), ("pyjwt", "pyjwt")])
+def test_jwt_backends_accept_each_others_tokens(monkeypatch, signer, verifier):
+    monkeypatch.setattr(jwt_handler, "JWT_BACKEND", signer)
+    token = create_access_token({"sub": "alice", "user_id": "u1"})
+    expired = encode_token({"sub": "alice", "exp": 1})
+
+    monkeypatch.setattr(jwt_handler, "JWT_BACKEND", verifier)
+    token_data = verify_token(token)
+
+    assert (token_data.username, token_data.user_id) == ("alice", "u1")
+    assert jwt_handler.unverified_claims(token)["type"] == "access"
+    with pytest.raises(HTTPException):
+        verify_token(expired)
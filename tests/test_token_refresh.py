@@ -0,0 +1,89 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from auth.oauth_helpers import OAuthTokenManager
+from auth.token_refresher import LEASE_NAME, TokenRefreshScheduler
+from auth.user_cache import invalidate_user, user_cache
+
+pytestmark = pytest.mark.anyio
+
+
+async def add_user(db, user_id: str = "u1", expires_in: timedelta = timedelta(hours=1), refresh_token: str = "r1"):
+    await db.users.insert_one({
+        "id": user_id,
+        "username": user_id,
+        "email": f"{user_id}@example.com",
+        "version": 0,
+        "oauth_providers": {"gdrive": {
+            "access_token": "a1",
+            "refresh_token": refresh_token,
+            "expires_at": datetime.utcnow() + expires_in,
+        }},
+    })
+
+
+async def test_provider_tokens_are_read_once_then_cached(db, services, monkeypatch):
+    await add_user(db)
+    reads = []
+    find_one = type(db.users).find_one
+
+    async def counting_find_one(self, *args, **kwargs):
+        reads.append(args)
+        return await find_one(self, *args, **kwargs)
+
+    monkeypatch.setattr(type(db.users), "find_one", counting_find_one)
+    manager = OAuthTokenManager(db)
+
+    assert await manager.get_valid_token("u1", "gdrive") == "a1"
+    assert await manager.get_valid_token("u1", "gdrive") == "a1"
+    assert await manager.get_valid_token("u1", "proton") is None
+    assert len(reads) == 1
+
+    # Every write to the user invalidates the projection
+    await db.users.update_one({"id": "u1"}, {"$set": {"oauth_providers.gdrive.access_token": "a2"}})
+    invalidate_user(user_id="u1")
+    assert await manager.get_valid_token("u1", "gdrive") == "a2"
+    assert len(reads) == 2
+
+
+async def test_expiring_cached_token_is_refreshed_and_recached(db, services, token_server):
+    await add_user(db, expires_in=timedelta(minutes=1))
+    manager = OAuthTokenManager(db)
+
+    assert await manager.get_valid_token("u1", "gdrive") == "stub-access-1"
+    assert await manager.get_valid_token("u1", "gdrive") == "stub-access-1"
+    assert token_server.calls == 1
+    assert user_cache.get_providers("u1")["gdrive"]["access_token"] == "stub-access-1"
+
+
+async def test_only_the_lease_holder_runs(db):
+    first, second = TokenRefreshScheduler(db), TokenRefreshScheduler(db)
+
+    assert await first._acquire_lease() is True
+    assert await second._acquire_lease() is False
+    # The holder keeps extending its own lease
+    assert await first._acquire_lease() is True
+
+    await db.scheduler_leases.update_one({"_id": LEASE_NAME}, {"$set": {"expires_at": datetime.utcnow()}})
+    assert await second._acquire_lease() is True
+    assert await first._acquire_lease() is False
+
+    await second._release_lease()
+    assert await db.scheduler_leases.count_documents({}) == 0
+
+
+async def test_failed_refresh_backs_off(db, services, token_server):
+    await add_user(db, expires_in=timedelta(minutes=1), refresh_token="invalid")
+    await add_user(db, "u2", expires_in=timedelta(minutes=1))
+    scheduler = TokenRefreshScheduler(db, jitter=0, rate_per_second=0)
+
+    assert await scheduler.run_once() == {"refreshed": 1, "failed": 1}
+
+    provider = (await db.users.find_one({"id": "u1"}))["oauth_providers"]["gdrive"]
+    assert provider["refresh_failures"] == 1
+    assert provider["next_refresh_attempt"] > datetime.utcnow()
+    # Neither the failed token nor the fresh one is due on the next run
+    calls = token_server.calls
+    assert await scheduler.run_once() == {"refreshed": 0, "failed": 0}
+    assert token_server.calls == calls
@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from auth.models import User
+from auth.principal import Principal
+from auth.user_cache import UserCache, user_cache
+
+from .conftest import bearer, signup
+
+
+def make_user(username: str = "alice", **fields) -> User:
+    return User(username=username, email=f"{username}@example.com", **fields)
+
+
+def test_users_are_found_by_username_and_id():
+    cache = UserCache()
+    user = make_user()
+    cache.set(user)
+
+    assert cache.get("alice") is user
+    assert cache.get_by_id(user.id) is user
+    assert cache.get_by_id("unknown") is None
+
+
+def test_invalidation_by_id_forgets_the_user_and_principal():
+    cache = UserCache()
+    user = make_user()
+    cache.set(user)
+    assert cache.get_principal("alice") == Principal.from_user(user)
+
+    cache.invalidate(user_id=user.id)
+
+    assert cache.get("alice") is None
+    assert cache.get_by_id(user.id) is None
+    assert cache.get_principal("alice") is None
+
+
+def test_a_load_that_raced_an_invalidation_is_not_cached():
+    cache = UserCache()
+    generation = cache.generation
+    cache.invalidate(username="alice")
+
+    cache.set(make_user(), generation)
+    cache.set_principal(Principal("id-1", "alice"), generation)
+
+    assert cache.get("alice") is None
+    assert cache.get_principal("alice") is None
+
+
+@pytest.mark.anyio
+async def test_derived_principal_expires_with_its_user():
+    cache = UserCache(ttl=0.2)
+    cache.set(make_user())
+    await asyncio.sleep(0.15)
+
+    # Derived near the end of the user's TTL, it must not get a fresh one
+    assert cache.get_principal("alice") is not None
+    await asyncio.sleep(0.1)
+
+    assert cache.get("alice") is None
+    assert cache.get_principal("alice") is None
+
+
+def test_change_events_invalidate_the_user_they_name():
+    cache = UserCache()
+    alice, bob = make_user("alice"), make_user("bob")
+    cache.set(alice)
+    cache.set(bob)
+
+    cache.invalidate_change({"operationType": "update", "fullDocument": {"id": alice.id, "username": "alice"}})
+    assert cache.get("alice") is None
+    assert cache.get("bob") is bob
+
+    # A delete does not say which user it was
+    cache.invalidate_change({"operationType": "delete", "documentKey": {"_id": "x"}})
+    assert cache.get("bob") is None
+
+
+@pytest.mark.anyio
+async def test_requests_reuse_the_cached_principal_and_see_writes(client, db):
+    tokens = await signup(client, "cached")
+    headers = bearer(tokens["access_token"])
+    assert (await client.get("/api/auth/me", headers=headers)).status_code == 200
+    hits = user_cache.stats()["principal_hits"]
+
+    assert (await client.get("/api/auth/oauth/status", headers=headers)).status_code == 200
+    assert user_cache.stats()["principal_hits"] == hits + 1
+
+    # Writes through the API invalidate the cached user
+    assert (await client.delete("/api/auth/oauth/gdrive", headers=headers)).status_code == 200
+    response = await client.get("/api/auth/me", headers=headers)
+    assert response.json()["version"] == 1